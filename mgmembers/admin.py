@@ -3,7 +3,9 @@ from django.contrib import admin
 import django.db.models as django_models
 import mgmembers.models as mgmodels
 
-EXCLUDE_MODELS = set([])
+EXCLUDE_MODELS = set([
+    mgmodels.DynamisGearChoices,
+])
 
 
 def register_models(models, namespace=None):
@@ -31,4 +33,11 @@ def register_models(models, namespace=None):
         admin.site.register(value)
 
 
+class DynamisGearChoicesAdmin(admin.ModelAdmin):
+    # The choices are edited as DynamisGearChoice rows. The legacy columns
+    # are only kept until they have been converted.
+    readonly_fields = mgmodels.DynamisGearChoices.legacy_field_names()
+
+
 register_models(mgmodels, 'mgmembers.models')
+admin.site.register(mgmodels.DynamisGearChoices, DynamisGearChoicesAdmin)
@@ -0,0 +1,190 @@
+"""
+Aeonics NM demand and kill route planning.
+
+Progress is held as a character x NM boolean matrix stored as Python ints
+used as bitsets: for every NM a bitmask of the characters that still need
+it (a column) and for every character a bitmask of the NMs in their current
+area they still need (a row). Counting and set operations then work on whole
+rows or columns at once, which keeps the planner fast for hundreds of
+characters and every NM in Zi'Tah, Ru'Aun and Reisenjima.
+"""
+import mgmembers.models as mgmodels
+
+# Rough time the linkshell spends finding and killing one NM
+DEFAULT_MINUTES_PER_NM = 10
+
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+
+def bits(mask):
+    """Yields the indexes of the bits set in mask, lowest first."""
+    index = 0
+    while mask:
+        if mask & 1:
+            yield index
+        mask >>= 1
+        index += 1
+
+
+def heat(count, total, levels=4):
+    """Buckets count/total into 0..levels for colouring a heatmap."""
+    if not count or not total:
+        return 0
+    return max(1, (count * levels + total - 1) // total)
+
+
+def load_characters():
+    """
+    Returns [(character name, set of killed NM ids)] for active characters
+    that are currently working on an aeonic, using two queries.
+    """
+    progresses = list(
+        mgmodels.AeonicsProgress.objects.filter(
+            malformed_weapon_in_progress__isnull=False,
+            character__owner__is_active=True,
+        ).select_related("character").order_by("character__name")
+    )
+
+    killed = {}
+    for progress_id, nm_id in (
+        mgmodels.AeonicsProgress.killed_nms.through.objects.filter(
+            aeonicsprogress__in=[x.pk for x in progresses]
+        ).values_list("aeonicsprogress_id", "aeonicnm_id")
+    ):
+        killed.setdefault(progress_id, set()).add(nm_id)
+
+    return [(x.character.name, killed.get(x.pk, set())) for x in progresses]
+
+
+def plan_route(rows, demand):
+    """
+    Orders the NMs of one area so characters finish the area as early as
+    possible.
+
+    rows holds, per character, a bitmask over the area's NM indexes with
+    the NMs that character still needs; demand holds the number of
+    characters needing each NM. Greedy: repeatedly pick the character whose
+    missing NMs, once killed, finish the most characters per extra kill,
+    then kill those NMs, most wanted first. Returns
+    [(nm index, [row indexes finishing with this kill])].
+    """
+    killed = 0
+    pending = set(x for x, row in enumerate(rows) if row)
+    route = []
+
+    while pending:
+        best = None
+        for target in pending:
+            missing = rows[target] & ~killed
+            cost = popcount(missing)
+            gain = sum(
+                1 for x in pending if rows[x] & ~killed & ~missing == 0
+            )
+            score = (gain / cost, gain)
+            if best is None or score > best[0]:
+                best = (score, missing)
+
+        missing = best[1]
+        for nm in sorted(bits(missing), key=lambda x: -demand[x]):
+            killed |= 1 << nm
+            finished = sorted(x for x in pending if rows[x] & ~killed == 0)
+            pending.difference_update(finished)
+            route.append((nm, finished))
+
+    return route
+
+
+def build_report(minutes_per_nm=DEFAULT_MINUTES_PER_NM):
+    """
+    Returns the NM demand heatmap and a kill route per area as plain
+    dicts and lists, ready to be rendered or returned as JSON.
+    """
+    catalog = mgmodels.AeonicNM.catalog()
+    characters = load_characters()
+    names = [name for name, killed in characters]
+
+    areas = []
+    # Characters still looking for a current area, as indexes into names
+    unplaced = list(range(len(characters)))
+    for area in catalog["areas"]:
+        nms = [nm for type in area["types"] for nm in type["nms"]]
+        nm_index = {nm["id"]: x for x, nm in enumerate(nms)}
+        full_mask = (1 << len(nms)) - 1
+
+        # Row per character: NMs of this area still needed
+        needed = []
+        for name, killed in characters:
+            done = 0
+            for nm_id in killed:
+                if nm_id in nm_index:
+                    done |= 1 << nm_index[nm_id]
+            needed.append(full_mask & ~done)
+
+        # Characters stay in the first area they have not finished
+        current = [x for x in unplaced if needed[x]]
+        unplaced = [x for x in unplaced if not needed[x]]
+
+        # Column per NM: characters needing it, overall and in this area
+        # as their current area
+        current_mask = 0
+        for x in current:
+            current_mask |= 1 << x
+        columns = [0] * len(nms)
+        for x, row in enumerate(needed):
+            for nm in bits(row):
+                columns[nm] |= 1 << x
+        demand = [popcount(x & current_mask) for x in columns]
+
+        route = []
+        elapsed = 0
+        finished_total = 0
+        for nm, finished in plan_route(
+            [needed[x] for x in current], demand
+        ):
+            elapsed += minutes_per_nm
+            finished_total += len(finished)
+            route.append({
+                "nm": nms[nm]["name"],
+                "minutes": elapsed,
+                "finished": [names[current[x]] for x in finished],
+            })
+
+        areas.append({
+            "name": area["name"],
+            "characters": [names[x] for x in current],
+            "types": [
+                {
+                    "name": type["name"],
+                    "nms": [
+                        {
+                            "name": nm["name"],
+                            "needed_by": popcount(
+                                columns[nm_index[nm["id"]]]
+                            ),
+                            "needed_by_current": demand[
+                                nm_index[nm["id"]]
+                            ],
+                            "heat": heat(
+                                demand[nm_index[nm["id"]]], len(current)
+                            ),
+                        }
+                        for nm in type["nms"]
+                    ],
+                }
+                for type in area["types"]
+            ],
+            "route": route,
+            "route_minutes": elapsed,
+            "finished_per_hour": (
+                round(finished_total * 60.0 / elapsed, 2) if elapsed else 0
+            ),
+        })
+
+    return {
+        "minutes_per_nm": minutes_per_nm,
+        "number_of_characters": len(characters),
+        "areas": areas,
+        "completed": [names[x] for x in unplaced],
+    }
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class MgmembersConfig(AppConfig):
     name = 'mgmembers'
+
+    def ready(self):
+        import mgmembers.signals  # noqa
+        import mgmembers.sqlite  # noqa
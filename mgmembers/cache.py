@@ -0,0 +1,192 @@
+"""
+Caching helpers shared by the mgmembers views and models.
+
+All keys are namespaced and versioned: a key for namespace "lootitem" looks
+like "mgmembers:lootitem:<version>:<parts>". Bumping the version of a
+namespace invalidates everything stored under it without having to know
+the individual keys.
+
+The backend used is the one named by settings.MGMEMBERS_CACHE_ALIAS, so the
+same code works against local memory, the file based cache or the database
+cache.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+import threading
+import time
+import uuid
+
+DEFAULT_TIMEOUT = 60 * 60 * 24
+
+# How long a recomputation may hold the lock before others give up waiting
+# and compute the value themselves.
+LOCK_TIMEOUT = 30
+LOCK_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+
+class CacheStats(object):
+    """Thread safe hit/miss counters per namespace for this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def count(self, namespace, what):
+        with self.lock:
+            counter = self.counters.setdefault(
+                namespace, {"hits": 0, "misses": 0, "waits": 0}
+            )
+            counter[what] += 1
+
+    def hit(self, namespace):
+        self.count(namespace, "hits")
+
+    def miss(self, namespace):
+        self.count(namespace, "misses")
+
+    def wait(self, namespace):
+        self.count(namespace, "waits")
+
+    def snapshot(self):
+        with self.lock:
+            return {x: dict(y) for x, y in self.counters.items()}
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+
+
+stats = CacheStats()
+
+# Striped locks used to serialize recomputation within this process. A
+# fixed pool keeps memory bounded however many keys are in use.
+_local_locks = tuple(threading.Lock() for x in range(64))
+
+
+def _local_lock(key):
+    return _local_locks[hash(key) % len(_local_locks)]
+
+
+def cache_alias():
+    return getattr(settings, "MGMEMBERS_CACHE_ALIAS", "persistent")
+
+
+def get_cache():
+    return caches[cache_alias()]
+
+
+def version_key(namespace):
+    return "mgmembers:%s:version" % (namespace,)
+
+
+def namespace_version(namespace):
+    """
+    Returns the current version token for a namespace, creating one if the
+    namespace has not been used yet or its version was evicted.
+    """
+    cache = get_cache()
+    key = version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        version = create_version(cache, key)
+    return version
+
+
+def create_version(cache, key):
+    # add() is not atomic in every backend (the file based cache checks and
+    # then writes), so threads of this process take turns creating it.
+    with _local_lock(key):
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            version = cache.get(key)
+    return version
+
+
+def namespace_versions(namespaces):
+    """Like namespace_version, but for many namespaces in one round trip."""
+    cache = get_cache()
+    keys = {x: version_key(x) for x in namespaces}
+    stored = cache.get_many(keys.values())
+
+    result = {}
+    for namespace, key in keys.items():
+        if key not in stored:
+            stored[key] = create_version(cache, key)
+        result[namespace] = stored[key]
+
+    return result
+
+
+def bump_namespace(namespace):
+    # Versions are random tokens rather than counters, so a version that has
+    # been evicted can never come back with an old value and resurrect stale
+    # entries.
+    get_cache().set(version_key(namespace), uuid.uuid4().hex, None)
+
+
+def make_key(namespace, *parts, version=None):
+    if version is None:
+        version = namespace_version(namespace)
+    return "mgmembers:%s:%s:%s" % (
+        namespace, version, ":".join(str(x) for x in parts)
+    )
+
+
+def delete(namespace, *parts):
+    get_cache().delete(make_key(namespace, *parts))
+
+
+def get_or_compute(namespace, *parts, compute, timeout=DEFAULT_TIMEOUT):
+    """
+    Returns the cached value for the key, calling compute() to create it on
+    a miss.
+
+    Only one caller recomputes a missing value at a time: threads in this
+    process serialize on a local lock, and other processes sharing the
+    backend wait for a lock entry stored in the cache itself. Waiters pick
+    up the freshly stored value instead of recomputing it. If the lock
+    holder takes longer than LOCK_TIMEOUT, waiters compute the value
+    themselves rather than block forever.
+    """
+    cache = get_cache()
+    key = make_key(namespace, *parts)
+
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        stats.hit(namespace)
+        return value
+
+    with _local_lock(key):
+        # Another thread may have filled the value while we waited
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            stats.hit(namespace)
+            return value
+
+        lock_key = key + ":lock"
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        locked = cache.add(lock_key, True, LOCK_TIMEOUT)
+        while not locked:
+            stats.wait(namespace)
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                stats.hit(namespace)
+                return value
+            if time.monotonic() > deadline:
+                break
+            locked = cache.add(lock_key, True, LOCK_TIMEOUT)
+
+        stats.miss(namespace)
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+    return value
@@ -0,0 +1,14 @@
+-- Automatically generated file: Items
+-- Small extract in the format of Windower's res/items.lua, used by the tests
+
+return {
+    [100] = {id=100,en="Test Earring",ja="テストピアス",enl="test earring",jal="テストピアス",category="Armor",flags=0x6000,jobs=0x12,level=99,races=0x1FE,slots=0x1800,stack=1,targets=0x00,type=5,item_level=119},
+    [101] = {id=101,en="Test Potion",ja="テストポーション",enl="flask of test potion",jal="テストポーション",category="Usable",flags=0x0000,stack=12,targets=0x01,type=7},
+    [102] = {id=102,en="Test Tabard",ja="テストタバード",enl="test tabard",jal="テストタバード",category="Armor",flags=0x6000,jobs=0x30,level=99,races=0x1FE,slots=0x0020,stack=1,targets=0x00,type=5,item_level=119},
+    [103] = {id=103,en="Test Earring",ja="テストピアス改",enl="test earring +1",jal="テストピアス改",category="Armor",flags=0x6000,jobs=0x12,level=99,races=0x1FE,slots=0x1800,stack=1,targets=0x00,type=5,item_level=119},
+}, {"id", "en", "ja", "enl", "jal", "category", "flags", "jobs", "level", "races", "slots", "stack", "targets", "type", "item_level"}
+
+--[[
+Copyright © 2013-2022, Windower
+All rights reserved.
+]]
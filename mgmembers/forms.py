@@ -43,18 +43,82 @@ class AeonicsProgressForm(models.ModelForm):
             'number_of_beads',
             'finished_aeonics',
             'malformed_weapon_in_progress',
-            'killed_nms',
         )
 
+    killed_nms = forms.TypedMultipleChoiceField(
+        coerce=int,
+        required=False,
+        widget=widgets.CheckboxSelectMultiple(),
+    )
+
     def __init__(self, *args, **kwargs):
         super(AeonicsProgressForm, self).__init__(*args, **kwargs)
-        
-        for x in (
-            ('finished_aeonics', mg_models.AeonicGear.objects.all()),
-            ('killed_nms', mg_models.AeonicNM.objects.all()),
-        ):
-            self.fields[x[0]].widget = widgets.CheckboxSelectMultiple()
-            self.fields[x[0]].queryset = x[1]
+
+        # Choices come from the cached catalogs so rendering the form does
+        # not query the NM and gear tables.
+        gear = mg_models.AeonicGear.catalog()
+        self.fields['finished_aeonics'].widget = (
+            widgets.CheckboxSelectMultiple()
+        )
+        self.fields['finished_aeonics'].choices = gear
+        self.fields['malformed_weapon_in_progress'].choices = (
+            (("", "---------"),) + gear
+        )
+
+        self.fields['killed_nms'].choices = (
+            mg_models.AeonicNM.catalog()["choices"]
+        )
+        self.fields['killed_nms'].initial = sorted(
+            self.instance.killed_nm_ids()
+        )
+
+    def save(self, commit=True):
+        instance = super().save(commit=commit)
+        if commit:
+            self.instance.set_killed_nms(self.cleaned_data['killed_nms'])
+        return instance
+
+class DynamisGearForm(models.ModelForm):
+    class Meta:
+        model = mg_models.DynamisGearChoices
+        fields = ()
+
+    rank_names = {
+        mg_models.DynamisGearChoice.RANK_PRIMARY: "primary",
+        mg_models.DynamisGearChoice.RANK_SECONDARY: "secondary",
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        current = self.instance.zone_choice_map()
+        for zone, zone_name in mg_models.DynamisGearChoice.zone_choices:
+            for rank, rank_name in mg_models.DynamisGearChoice.rank_choices:
+                job = current.get((zone, rank))
+                self.fields[self.field_name(zone, rank)] = (
+                    forms.ModelChoiceField(
+                        queryset=mg_models.Job.objects.all(),
+                        required=False,
+                        label="%s %s" % (zone_name, rank_name),
+                        initial=job.pk if job else None,
+                    )
+                )
+
+    def field_name(self, zone, rank):
+        return "%s_%s" % (zone, self.rank_names[rank])
+
+    def save(self, commit=True):
+        instance = super().save(commit=commit)
+        if commit:
+            self.save_zone_choices()
+        return instance
+
+    def save_zone_choices(self):
+        self.instance.set_zone_choices({
+            (zone, rank): self.cleaned_data[self.field_name(zone, rank)]
+            for zone, x in mg_models.DynamisGearChoice.zone_choices
+            for rank, y in mg_models.DynamisGearChoice.rank_choices
+        })
 
 class DynamisWave3UpdateForm(models.ModelForm):
 
@@ -68,27 +132,101 @@ class DynamisWave3UpdateForm(models.ModelForm):
 class DynamisPlanUpdateForm(models.ModelForm):
 
     class Meta:
-        exclude = []
+        fields = ('date', 'zone', 'notes')
         model = mg_models.DynamisWave3Plan
         widgets = {
             'date': forms.DateInput(attrs={'type': 'date'})
         }
 
-    tank_jobs = ("RUN", "PLD")
-    support_jobs = ()
-
-    filter_map = {
-
-    }
-
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        dyna_char_qs = mg_models.Character.objects.filter(
-            dynamiswave3registration__isnull=False
-        )
-
-        for x in self.fields:
-            if (x.startswith("party")
-                and not (x.endswith("role") or x.endswith("other"))):
-                self.fields[x].queryset = dyna_char_qs
+        # Loaded once and shared by every character select on the page
+        self.characters = {
+            x.pk: x for x in mg_models.Character.objects.filter(
+                dynamiswave3registration__isnull=False
+            ).select_related(
+                'dynamiswave3registration'
+            ).prefetch_related(
+                'dynamiswave3registration__wave3jobs'
+            )
+        }
+        character_choices = [("", "---------")] + [
+            (x.pk, x.name) for x in self.characters.values()
+        ]
+
+        # Always offer one empty party more than the plan has, so parties
+        # can be added one at a time.
+        plan = self.instance
+        self.party_count = min(plan.party_count + 1, plan.MAX_PARTIES)
+
+        for party in plan.parties(self.party_count):
+            for slot in party["slots"]:
+                name = self.slot_field_name(slot.party, slot.slot)
+                self.fields[name + "_role"] = forms.ChoiceField(
+                    choices=mg_models.DynamisWave3Plan.role_choices,
+                    initial=slot.role,
+                )
+                self.fields[name] = forms.TypedChoiceField(
+                    choices=character_choices,
+                    coerce=int,
+                    empty_value=None,
+                    required=False,
+                    initial=slot.character_id,
+                )
+                self.fields[name + "_other"] = forms.CharField(
+                    max_length=20,
+                    required=False,
+                    initial=slot.other,
+                )
+
+    def slot_field_name(self, party, slot):
+        return "party%s_slot%s" % (party, slot)
+
+    def parties(self):
+        """Bound fields grouped by party, for rendering."""
+        result = []
+        for party in range(1, self.party_count + 1):
+            slots = []
+            for slot in range(1, self.instance.SLOTS_PER_PARTY + 1):
+                name = self.slot_field_name(party, slot)
+                slots.append({
+                    "name": name,
+                    "role": self[name + "_role"],
+                    "character": self[name],
+                    "other": self[name + "_other"],
+                })
+            result.append({"nr": party, "slots": slots})
+        return result
+
+    def slot_values(self):
+        result = {}
+        for party in range(1, self.party_count + 1):
+            for slot in range(1, self.instance.SLOTS_PER_PARTY + 1):
+                name = self.slot_field_name(party, slot)
+                character_id = self.cleaned_data[name]
+                result[(party, slot)] = (
+                    self.cleaned_data[name + "_role"],
+                    self.characters.get(character_id),
+                    self.cleaned_data[name + "_other"] or None,
+                )
+
+        # Drop trailing empty parties beyond the default ones
+        default_count = len(self.instance.default_party_roles)
+        for party in range(self.party_count, default_count, -1):
+            slots = [
+                result[(party, slot)]
+                for slot in range(1, self.instance.SLOTS_PER_PARTY + 1)
+            ]
+            if any(character or other for role, character, other in slots):
+                break
+            for slot in range(1, self.instance.SLOTS_PER_PARTY + 1):
+                del result[(party, slot)]
+
+        return result
+
+    def save(self, commit=True):
+        instance = super().save(commit=commit)
+        if commit:
+            self.instance.set_slots(self.slot_values())
+        return instance
@@ -0,0 +1,274 @@
+"""
+Bulk import of items from items.lua.
+
+Turning the Lua records into Item rows is CPU bound, so the records are
+split into batches that worker processes evaluate and convert with
+item_row(). The rows are sent back to the importing process, which is
+the only one writing to the database: one query per table and batch to
+find what exists, then bulk inserts and updates of what changed.
+
+The worker side only needs mgmembers.resources and the constants of the
+models, so this module does not import the models at the top. Worker
+processes that are started fresh (the default on Windows) set up Django
+before importing them.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from django.apps import apps
+from django.db import transaction
+
+import django
+
+import mgmembers.resources as mgresources
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Item field and items.lua key of the plain values of a record
+FIELDS = (
+    ("name", "en"),
+    ("name_ja", "ja"),
+    ("stack", "stack"),
+    ("cast_time", "cast_time"),
+    ("level", "level"),
+    ("cast_delay", "cast_delay"),
+    ("max_charges", "max_charges"),
+    ("recast_delay", "recast_delay"),
+    ("shield_size", "shield_size"),
+    ("damage", "damage"),
+    ("delay", "delay"),
+    ("item_level", "item_level"),
+    ("superior_level", "superior_level"),
+)
+
+
+def bitmask_values(model, bitmask):
+    """
+    Returns the keys of the model rows a resource bitmask decodes to:
+    Job names, and the primary keys of the other models.
+    """
+    import mgmembers.models as mgmodels
+
+    if model is mgmodels.Job:
+        return sorted(x for x, bit in model.BITS.items() if bitmask & bit)
+    if model in (mgmodels.Race, mgmodels.ItemSlot):
+        return [x["id"] for x in model.defaults if bitmask & 1 << x["id"]]
+    return [x for x, name in model.defaults if bitmask & x]
+
+
+def item_row(lua_item):
+    """
+    Converts an items.lua record to a dict of Item field values and the
+    decoded bitmasks, without touching the database.
+    """
+    import mgmembers.models as mgmodels
+
+    row = {
+        "id": lua_item["id"],
+        "fields": {
+            field: lua_item[key] for field, key in FIELDS if key in lua_item
+        },
+        "category": lua_item.get("category"),
+        "type": lua_item.get("type"),
+        "skill": lua_item.get("skill"),
+        "masks": {},
+        "relations": {},
+    }
+    for key, field, model in mgmodels.Item.MASKS:
+        value = int(lua_item[key]) if key in lua_item else 0
+        row["masks"][field] = value
+        row["relations"][key] = bitmask_values(model, value)
+    return row
+
+
+_worker_files = {}
+
+
+def init_worker():
+    if not apps.ready:
+        django.setup()
+
+
+def parse_batch(path, index_path, ids):
+    """Returns the item_row() of each of the given record ids."""
+    resource = _worker_files.get(path)
+    if resource is None:
+        resource = _worker_files[path] = mgresources.ResourceFile(
+            path, index_path
+        )
+    return [item_row(x) for x in resource.records(ids)]
+
+
+class ItemImport(object):
+    """
+    Imports items.lua records into Item, creating and updating only the
+    items and M2M rows that differ from the database.
+    """
+
+    def __init__(self, workers=1, batch_size=DEFAULT_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.counts = {"created": 0, "updated": 0, "unchanged": 0}
+        self.lookups = {}
+
+    def batches(self, resource, ids):
+        """Yields lists of item_row()s, converted by the worker pool."""
+        ids = list(ids)
+        chunks = [
+            ids[x:x + self.batch_size]
+            for x in range(0, len(ids), self.batch_size)
+        ]
+        if self.workers <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                yield [item_row(x) for x in resource.records(chunk)]
+            return
+
+        # Save the offset table first, so the workers only read it
+        resource.open()
+        with ProcessPoolExecutor(
+            max_workers=self.workers, initializer=init_worker
+        ) as executor:
+            yield from executor.map(
+                parse_batch,
+                [resource.path] * len(chunks),
+                [resource.index_path] * len(chunks),
+                chunks,
+            )
+
+    def run(self, ids=None):
+        """
+        Imports the records with the given ids, or all of them, and
+        rebuilds the item search index. Returns the counts of created,
+        updated and unchanged items.
+        """
+        import mgmembers.itemsearch as mgitemsearch
+
+        resource = mgresources.resource_file("items.lua")
+        if ids is None:
+            ids = resource.ids()
+
+        with transaction.atomic():
+            for rows in self.batches(resource, ids):
+                self.write(rows)
+            mgitemsearch.rebuild()
+
+        return self.counts
+
+    def lookup(self, model, key, value, make):
+        """
+        Returns the pk of the model row whose key field has the value,
+        creating it with make(value) if there is none.
+        """
+        if model not in self.lookups:
+            self.lookups[model] = dict(
+                model.objects.values_list(key, 'pk')
+            )
+        known = self.lookups[model]
+        if value not in known:
+            obj = make(value)
+            obj.save()
+            known[value] = obj.pk
+        return known[value]
+
+    def related_ids(self, row):
+        import mgmembers.models as mgmodels
+
+        values = {}
+        if row["category"] is not None:
+            values["category_id"] = self.lookup(
+                mgmodels.ItemCategory, 'name', row["category"],
+                lambda x: mgmodels.ItemCategory(name=x)
+            )
+        if row["type"] is not None:
+            values["type_id"] = self.lookup(
+                mgmodels.ItemType, 'pk', row["type"],
+                lambda x: mgmodels.ItemType(
+                    pk=x, name='Unknown type with id <%s>' % (x,)
+                )
+            )
+        if row["skill"] is not None:
+            values["skill_id"] = self.lookup(
+                mgmodels.Skill, 'pk', row["skill"],
+                lambda x: mgmodels.Skill(
+                    pk=x, name="Unknown skill with id %s" % (x,)
+                )
+            )
+        return values
+
+    @transaction.atomic
+    def write(self, rows):
+        """Writes a batch of item_row()s with bulk queries."""
+        import mgmembers.models as mgmodels
+        Item = mgmodels.Item
+
+        existing = Item.objects.in_bulk([x["id"] for x in rows])
+        new_items = []
+        changed_items = []
+        update_fields = set()
+        # {M2M field: [(item id, related keys)]} of masks that changed
+        relations = {key: [] for key, field, model in Item.MASKS}
+
+        for row in rows:
+            values = dict(row["fields"], **self.related_ids(row))
+            values.update(row["masks"])
+
+            item = existing.get(row["id"])
+            if item is None:
+                new_items.append(Item(id=row["id"], **values))
+                changed_masks = row["masks"]
+            else:
+                changed = {
+                    k: v for k, v in values.items()
+                    if getattr(item, k) != v
+                }
+                if changed:
+                    for k, v in changed.items():
+                        setattr(item, k, v)
+                    changed_items.append(item)
+                    update_fields.update(changed)
+                    self.counts["updated"] += 1
+                else:
+                    self.counts["unchanged"] += 1
+                changed_masks = {
+                    k: v for k, v in changed.items() if k in row["masks"]
+                }
+
+            for key, field, model in Item.MASKS:
+                if field in changed_masks:
+                    relations[key].append(
+                        (row["id"], row["relations"][key])
+                    )
+
+        Item.objects.bulk_create(new_items, batch_size=500)
+        self.counts["created"] += len(new_items)
+        if changed_items:
+            Item.objects.bulk_update(
+                changed_items, sorted(update_fields), batch_size=500
+            )
+
+        for key, field, model in Item.MASKS:
+            if relations[key]:
+                self.write_relations(key, model, relations[key])
+
+    def write_relations(self, key, model, relations):
+        import mgmembers.models as mgmodels
+
+        through = getattr(mgmodels.Item, key).through
+        target = model._meta.model_name
+        through.objects.filter(
+            item_id__in=[x for x, y in relations]
+        ).delete()
+
+        if model is mgmodels.Job:
+            job_ids = dict(model.objects.values_list('name', 'pk'))
+            relations = [
+                (x, [job_ids[name] for name in names if name in job_ids])
+                for x, names in relations
+            ]
+
+        through.objects.bulk_create(
+            [
+                through(**{"item_id": item_id, target + "_id": value})
+                for item_id, values in relations
+                for value in values
+            ],
+            batch_size=500,
+        )
@@ -0,0 +1,315 @@
+"""
+Item search over the imported Windower item database.
+
+ItemSearchEntry holds one row per Item with its names, levels and the
+job, race, slot and flag sets as bitmasks, so a filter such as "earrings
+usable by BLM with item level 119" is a single query on one table instead
+of joins through the Item M2M tables.
+
+On SQLite builds whose FTS5 has the trigram tokenizer, the names are
+also indexed in an FTS5 table, which finds any part of three or more
+characters of an English or Japanese name. Shorter search terms, and
+other databases, use LIKE on the entry table instead.
+
+Only imported items are searched. Items are imported on demand, so until
+"manage.py import_items --all" has been run the search misses items that
+nothing has looked up yet.
+"""
+from django.db import OperationalError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Q
+
+import mgmembers.models as mgmodels
+
+FTS_TABLE = "mgmembers_itemsearch_fts"
+
+# Shortest search term the trigram tokenizer can match
+FTS_MIN_LENGTH = 3
+
+DEFAULT_LIMIT = 50
+
+# Slot filters, with both ears and both rings as one choice
+SLOT_FILTERS = (
+    ("main", "Main", (0,)),
+    ("sub", "Sub", (1,)),
+    ("range", "Range", (2,)),
+    ("ammo", "Ammo", (3,)),
+    ("head", "Head", (4,)),
+    ("body", "Body", (5,)),
+    ("hands", "Hands", (6,)),
+    ("legs", "Legs", (7,)),
+    ("feet", "Feet", (8,)),
+    ("neck", "Neck", (9,)),
+    ("waist", "Waist", (10,)),
+    ("ear", "Earring", (11, 12)),
+    ("ring", "Ring", (13, 14)),
+    ("back", "Back", (15,)),
+)
+
+SLOT_BITS = {
+    key: sum(1 << x for x in slot_ids)
+    for key, label, slot_ids in SLOT_FILTERS
+}
+
+
+# {database: whether its SQLite has FTS5 with the trigram tokenizer}
+_fts_support = {}
+
+
+def fts_supported():
+    if connection.vendor != "sqlite":
+        return False
+
+    database = connection.settings_dict["NAME"]
+    if database not in _fts_support:
+        # The trigram tokenizer is only in SQLite 3.34 and later, and FTS5
+        # itself is optional, so try to create a table that uses it
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE temp.%s_probe USING fts5("
+                    "name, tokenize = 'trigram')" % FTS_TABLE
+                )
+                cursor.execute("DROP TABLE temp.%s_probe" % FTS_TABLE)
+            _fts_support[database] = True
+        except OperationalError:
+            _fts_support[database] = False
+
+    return _fts_support[database]
+
+
+# Databases known to have the FTS table, so searches do not have to check
+_fts_databases = set()
+
+
+def fts_exists(cached=True):
+    if not fts_supported():
+        return False
+
+    database = connection.settings_dict["NAME"]
+    if not cached or database not in _fts_databases:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE type = 'table' AND name = %s",
+                [FTS_TABLE]
+            )
+            if cursor.fetchone() is None:
+                _fts_databases.discard(database)
+                return False
+        _fts_databases.add(database)
+
+    return True
+
+
+MASK_FIELDS = ("jobs_mask", "races_mask", "slots_mask", "flags_mask")
+
+
+def item_masks():
+    """
+    Returns {item id: {mask field: bitmask}} from the Item M2M tables,
+    reading each of them once. Used for items imported before Item
+    stored the masks itself.
+    """
+    Item = mgmodels.Item
+    masks = {}
+
+    def add(field, item_id, bit):
+        row = masks.setdefault(item_id, {
+            "jobs_mask": 0,
+            "races_mask": 0,
+            "slots_mask": 0,
+            "flags_mask": 0,
+        })
+        row[field] |= bit
+
+    for item_id, name in Item.jobs.through.objects.values_list(
+        "item_id", "job__name"
+    ).iterator():
+        add("jobs_mask", item_id, mgmodels.Job.BITS[name])
+
+    for field, through, column, to_bit in (
+        ("races_mask", Item.races.through, "race_id", lambda x: 1 << x),
+        ("slots_mask", Item.slots.through, "itemslot_id", lambda x: 1 << x),
+        # Flag ids are their bit values
+        ("flags_mask", Item.flags.through, "itemflag_id", lambda x: x),
+    ):
+        for item_id, value in through.objects.values_list(
+            "item_id", column
+        ).iterator():
+            add(field, item_id, to_bit(value))
+
+    return masks
+
+
+def make_entries(items):
+    """Returns ItemSearchEntry objects for the Items of a queryset."""
+    legacy_masks = None
+    empty = {}
+
+    entries = []
+    for item in items.values(
+        "id", "name", "name_ja", "level", "item_level", *MASK_FIELDS
+    ).iterator():
+        masks = {x: item[x] for x in MASK_FIELDS}
+        if None in masks.values():
+            if legacy_masks is None:
+                legacy_masks = item_masks()
+            masks = legacy_masks.get(item["id"], empty)
+        entries.append(mgmodels.ItemSearchEntry(
+            item_id=item["id"],
+            name=item["name"],
+            name_ja=item["name_ja"],
+            level=item["level"],
+            item_level=item["item_level"],
+            **masks
+        ))
+    return entries
+
+
+def insert_fts_rows(cursor, where="", params=()):
+    cursor.execute(
+        "INSERT INTO %s (rowid, name, name_ja) "
+        "SELECT item_id, name, name_ja FROM %s%s" % (
+            FTS_TABLE, mgmodels.ItemSearchEntry._meta.db_table, where
+        ),
+        params
+    )
+
+
+@transaction.atomic
+def rebuild():
+    """Rebuilds the search index from the Item tables. Returns its size."""
+    mgmodels.ItemSearchEntry.objects.all().delete()
+    entries = make_entries(mgmodels.Item.objects.all())
+    mgmodels.ItemSearchEntry.objects.bulk_create(entries, batch_size=500)
+
+    if fts_supported():
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS %s" % FTS_TABLE)
+            cursor.execute(
+                "CREATE VIRTUAL TABLE %s USING fts5("
+                "name, name_ja, tokenize = 'trigram')" % FTS_TABLE
+            )
+            insert_fts_rows(cursor)
+        _fts_databases.add(connection.settings_dict["NAME"])
+
+    return len(entries)
+
+
+@transaction.atomic
+def add_items(item_ids):
+    """
+    Adds or refreshes the entries of single items, for items imported
+    on demand.
+    """
+    item_ids = sorted(set(item_ids))
+    if not item_ids:
+        return
+
+    mgmodels.ItemSearchEntry.objects.filter(item_id__in=item_ids).delete()
+    mgmodels.ItemSearchEntry.objects.bulk_create(
+        make_entries(mgmodels.Item.objects.filter(pk__in=item_ids))
+    )
+
+    # Not cached, as a rolled back rebuild leaves the cache out of date
+    if fts_exists(cached=False):
+        placeholders = ", ".join(["%s"] * len(item_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM %s WHERE rowid IN (%s)" % (
+                    FTS_TABLE, placeholders
+                ),
+                item_ids
+            )
+            insert_fts_rows(
+                cursor, " WHERE item_id IN (%s)" % placeholders, item_ids
+            )
+
+
+def fts_query(text):
+    # Quote as a single FTS5 string so the search text is not parsed as
+    # query syntax
+    return '"%s"' % text.replace('"', '""')
+
+
+def search(text=None, job=None, slot=None, flag=None, min_item_level=None,
+           max_item_level=None, limit=DEFAULT_LIMIT):
+    """
+    Returns a list of up to limit ItemSearchEntry rows matching all given
+    filters, using one query.
+
+    job is a Job name, slot a SLOT_FILTERS key and flag an ItemFlag id.
+    """
+    text = (text or "").strip()
+    use_fts = len(text) >= FTS_MIN_LENGTH and fts_exists()
+    if use_fts:
+        try:
+            # A savepoint, so that a failed query does not break the
+            # caller's transaction before the fallback runs
+            with transaction.atomic():
+                return list(filter_entries(
+                    text, True, job, slot, flag, min_item_level,
+                    max_item_level
+                )[:limit])
+        except OperationalError:
+            # The FTS table went away with a rolled back rebuild()
+            _fts_databases.discard(connection.settings_dict["NAME"])
+
+    return list(filter_entries(
+        text, False, job, slot, flag, min_item_level, max_item_level
+    )[:limit])
+
+
+def filter_entries(text, use_fts, job, slot, flag, min_item_level,
+                   max_item_level):
+    qs = mgmodels.ItemSearchEntry.objects.all()
+
+    if text:
+        if use_fts:
+            match = "item_id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)"
+            qs = qs.extra(
+                where=[match % (FTS_TABLE, FTS_TABLE)],
+                params=[fts_query(text)],
+            )
+        else:
+            qs = qs.filter(
+                Q(name__icontains=text) | Q(name_ja__icontains=text)
+            )
+
+    for field, bits in (
+        ("jobs_mask", mgmodels.Job.BITS.get(job)),
+        ("slots_mask", SLOT_BITS.get(slot)),
+        ("flags_mask", flag),
+    ):
+        if bits:
+            # Any of the slot bits, all of the flag bits
+            qs = mgmodels.filter_bits(
+                qs, field, bits, match_all=field == "flags_mask"
+            )
+
+    if min_item_level is not None:
+        qs = qs.filter(item_level__gte=min_item_level)
+    if max_item_level is not None:
+        qs = qs.filter(item_level__lte=max_item_level)
+
+    return qs.order_by("name", "item_id")
+
+
+def entry_dict(entry):
+    return {
+        "id": entry.item_id,
+        "name": entry.name,
+        "name_ja": entry.name_ja,
+        "level": entry.level,
+        "item_level": entry.item_level,
+        "jobs": [
+            name for name, bit in mgmodels.Job.BITS.items()
+            if entry.jobs_mask & bit
+        ],
+        "slots": [
+            label for key, label, slot_ids in SLOT_FILTERS
+            if entry.slots_mask & SLOT_BITS[key]
+        ],
+    }
@@ -0,0 +1,154 @@
+from django.core.management.base import BaseCommand
+
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import mgmembers.sqlite as mgsqlite
+
+
+SCHEMA = """
+CREATE TABLE character (
+    id INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE
+);
+CREATE TABLE characterjob (
+    id INTEGER PRIMARY KEY,
+    character_id INTEGER NOT NULL REFERENCES character (id),
+    job_id INTEGER NOT NULL,
+    level INTEGER NULL,
+    event_status INTEGER NOT NULL,
+    gear_status INTEGER NOT NULL
+);
+CREATE INDEX characterjob_character_id ON characterjob (character_id);
+CREATE INDEX characterjob_job_id ON characterjob (job_id);
+"""
+
+READ_SQL = """
+SELECT c.name, cj.level
+FROM characterjob cj INNER JOIN character c ON cj.character_id = c.id
+WHERE cj.job_id = ? AND cj.gear_status = 1
+"""
+
+WRITE_SQL = """
+UPDATE characterjob SET gear_status = ?, event_status = ? WHERE id = ?
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures concurrent read/write throughput on a scratch SQLite '
+        'database, with default settings and with settings.SQLITE_PRAGMAS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--characters', type=int, default=500)
+
+    def handle(self, *args, **options):
+        results = []
+        for label, pragmas in (
+            ('default', ()),
+            ('tuned', mgsqlite.get_pragmas()),
+        ):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                filename = os.path.join(tmpdir, 'benchmark.sqlite3')
+                self.create_database(filename, options['characters'])
+                results.append(
+                    (label,) + self.run(filename, pragmas, options)
+                )
+
+        self.stdout.write(
+            '%-8s %12s %12s %12s' % ('mode', 'reads/s', 'writes/s', 'locked')
+        )
+        for label, reads, writes, locked, seconds in results:
+            self.stdout.write('%-8s %12.1f %12.1f %12d' % (
+                label, reads / seconds, writes / seconds, locked
+            ))
+
+    def connect(self, filename, pragmas):
+        # Same connection timeout as Django uses by default
+        conn = sqlite3.connect(filename, timeout=5, check_same_thread=False)
+        cursor = conn.cursor()
+        mgsqlite.apply_pragmas(cursor, pragmas)
+        cursor.close()
+        return conn
+
+    def create_database(self, filename, number_of_characters):
+        conn = sqlite3.connect(filename)
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            'INSERT INTO character (id, name) VALUES (?, ?)',
+            ((x, 'Char%d' % x) for x in range(1, number_of_characters + 1))
+        )
+        conn.executemany(
+            'INSERT INTO characterjob '
+            '(character_id, job_id, level, event_status, gear_status) '
+            'VALUES (?, ?, 99, ?, ?)',
+            (
+                (c, j, random.randint(1, 3), random.randint(1, 3))
+                for c in range(1, number_of_characters + 1)
+                for j in range(1, 23)
+            )
+        )
+        conn.commit()
+        conn.close()
+
+    def run(self, filename, pragmas, options):
+        counters = {'reads': 0, 'writes': 0, 'locked': 0}
+        counters_lock = threading.Lock()
+        stop_at = time.monotonic() + options['seconds']
+        max_id = options['characters'] * 22
+
+        def count(what):
+            with counters_lock:
+                counters[what] += 1
+
+        def reader():
+            conn = self.connect(filename, pragmas)
+            while time.monotonic() < stop_at:
+                try:
+                    conn.execute(READ_SQL, (random.randint(1, 22),)).fetchall()
+                    count('reads')
+                except sqlite3.OperationalError:
+                    count('locked')
+            conn.close()
+
+        def writer():
+            conn = self.connect(filename, pragmas)
+            while time.monotonic() < stop_at:
+                try:
+                    # A form save touches a handful of rows in one commit
+                    for x in range(5):
+                        conn.execute(WRITE_SQL, (
+                            random.randint(1, 3),
+                            random.randint(1, 3),
+                            random.randint(1, max_id),
+                        ))
+                    conn.commit()
+                    count('writes')
+                except sqlite3.OperationalError:
+                    conn.rollback()
+                    count('locked')
+            conn.close()
+
+        threads = (
+            [threading.Thread(target=reader)
+             for x in range(options['readers'])] +
+            [threading.Thread(target=writer)
+             for x in range(options['writers'])]
+        )
+        started = time.monotonic()
+        for x in threads:
+            x.start()
+        for x in threads:
+            x.join()
+        seconds = time.monotonic() - started
+
+        return (
+            counters['reads'], counters['writes'], counters['locked'], seconds
+        )
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import mgmembers.models as mgmodels
+
+
+class Command(BaseCommand):
+    help = (
+        'Removes registered alliances that are repeated uploads of an '
+        'earlier one and stores the content hash of the rest'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be removed',
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        Alliance = mgmodels.RegisteredAlliance
+
+        members = {}
+        for alliance_id, character_id in (
+            Alliance.characters.through.objects.values_list(
+                'registeredalliance_id', 'character_id'
+            ).iterator()
+        ):
+            members.setdefault(alliance_id, set()).add(character_id)
+
+        seen = set()
+        keep = []
+        duplicates = []
+        for alliance in Alliance.objects.order_by(
+            'register_time', 'pk'
+        ).only('pk', 'zone', 'register_time', 'content_hash').iterator():
+            hashes = Alliance.content_hashes(
+                alliance.zone, members.get(alliance.pk, ()),
+                alliance.register_time
+            )
+            if seen.intersection(hashes):
+                duplicates.append(alliance.pk)
+                continue
+            seen.add(hashes[0])
+            if alliance.content_hash != hashes[0]:
+                alliance.content_hash = hashes[0]
+                keep.append(alliance)
+
+        self.stdout.write('%d duplicate alliances, %d hashes to store' % (
+            len(duplicates), len(keep)
+        ))
+        if options['dry_run']:
+            return
+
+        # Deleted through the ORM so the pre_delete signal takes the
+        # duplicates out of the loot ledger and attendance rollups
+        for i in range(0, len(duplicates), 500):
+            Alliance.objects.filter(pk__in=duplicates[i:i + 500]).delete()
+
+        # Clear first so hashes can move between rows without conflicts
+        Alliance.objects.filter(
+            pk__in=[x.pk for x in keep]
+        ).update(content_hash=None)
+        Alliance.objects.bulk_update(keep, ['content_hash'], batch_size=500)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+import mgmembers.queryplans as mgqueryplans
+
+
+class Command(BaseCommand):
+    help = (
+        'Prints EXPLAIN QUERY PLAN output for every query issued by the '
+        'overview pages'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scans-only',
+            action='store_true',
+            help='Only show queries whose plan contains a full table scan',
+        )
+
+    def handle(self, *args, **options):
+        for url_name, plans in mgqueryplans.capture_query_plans().items():
+            self.stdout.write('== %s (%d queries)' % (url_name, len(plans)))
+            for sql, plan in plans:
+                if options['scans_only'] and not any(
+                    x.startswith('SCAN') for x in plan
+                ):
+                    continue
+                self.stdout.write(sql)
+                for x in plan:
+                    self.stdout.write('    ' + x)
+                self.stdout.write('')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+import mgmembers.roster as mgroster
+
+
+class Command(BaseCommand):
+    help = 'Exports all member data as a zip file of CSV files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', help='Zip file to write')
+
+    def handle(self, *args, **options):
+        with open(options['filename'], 'wb') as f:
+            mgroster.export_roster(f)
+        self.stdout.write('Wrote %s' % options['filename'])
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+
+import os
+
+import mgmembers.models as mgmodels
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports items from items.lua. By default only the items that loot '
+        'items and Aeonic gear refer to are imported, other items are '
+        'imported on demand when something looks them up. Item search '
+        'only finds imported items, so use --all for a complete search.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help=(
+                'Import every item in items.lua, so item search finds '
+                'all of them'
+            ),
+        )
+        parser.add_argument(
+            '--id',
+            type=int,
+            action='append',
+            default=[],
+            help='Import the item with this id, can be repeated',
+        )
+        parser.add_argument(
+            '--name',
+            action='append',
+            default=[],
+            help='Import the item with this English name, can be repeated',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help=(
+                'Number of processes converting records with --all, '
+                'defaults to the number of CPUs'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            counts = mgmodels.Item.create_defaults(
+                workers=options['workers']
+            )
+            self.stdout.write(', '.join(
+                '%d %s' % (count, kind) for kind, count in counts.items()
+            ))
+            return
+
+        names = set(options['name'])
+        if not options['id'] and not names:
+            for model in (mgmodels.LootItem, mgmodels.AeonicGear):
+                names.update(model.objects.values_list('name', flat=True))
+
+        items = mgmodels.Item.resolve_ids(options['id'])
+        by_name = mgmodels.Item.resolve_names(names)
+        items.update((x.pk, x) for x in by_name.values())
+
+        for name in sorted(names - set(by_name)):
+            self.stdout.write('No item named %s' % name)
+        for item_id in sorted(set(options['id']) - set(items)):
+            self.stdout.write('No item with id %d' % item_id)
+        self.stdout.write('%d items available' % len(items))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+import mgmembers.progress_import as mgimport
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports characters, jobs, Omen and Warder of Courage progress from '
+        'the progress sheet'
+    )
+    sections = mgimport.SECTIONS
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default=mgimport.DEFAULT_FILENAME,
+            help='CSV export of the progress sheet',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be imported',
+        )
+
+    def handle(self, *args, **options):
+        with open(options['file'], newline='') as csvfile:
+            sheet = mgimport.parse(csvfile, self.sections)
+
+        importer = mgimport.ProgressImport(sheet, self.sections)
+        for x in importer.run(dry_run=options['dry_run']):
+            self.stdout.write(x)
+        self.stdout.write(importer.summary())
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+import mgmembers.roster as mgroster
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports a roster snapshot made by export_roster, replacing the '
+        'data of the characters in it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', help='Zip file to read')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be imported',
+        )
+
+    def handle(self, *args, **options):
+        with open(options['filename'], 'rb') as f:
+            counts = mgroster.RosterImport(f).run(
+                dry_run=options['dry_run']
+            )
+        for name, count in counts.items():
+            self.stdout.write('%s: %d' % (name, count))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import mgmembers.models as mgmodels
+
+
+class Command(BaseCommand):
+    help = (
+        'Copies Dynamis gear choices from the legacy per-zone columns on '
+        'DynamisGearChoices into DynamisGearChoice rows and clears the '
+        'legacy columns'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be copied',
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        # Characters that already have normalized rows were converted when
+        # they were first saved and are left alone.
+        converted = set(
+            mgmodels.DynamisGearChoice.objects.values_list(
+                'character_id', flat=True
+            ).distinct()
+        )
+
+        new_rows = []
+        characters = set()
+        for x in mgmodels.DynamisGearChoices.objects.exclude(
+            character_id__in=converted
+        ):
+            for (zone, rank), job_id in x.legacy_zone_choices().items():
+                new_rows.append(mgmodels.DynamisGearChoice(
+                    character_id=x.character_id,
+                    zone=zone,
+                    rank=rank,
+                    job_id=job_id,
+                ))
+                characters.add(x.character_id)
+
+        self.stdout.write('%d choices for %d characters to copy' % (
+            len(new_rows), len(characters)
+        ))
+        if options['dry_run']:
+            return
+
+        mgmodels.DynamisGearChoice.objects.bulk_create(new_rows)
+        mgmodels.DynamisGearChoices.objects.filter(
+            character_id__in=characters
+        ).update(**{
+            x: None for x in mgmodels.DynamisGearChoices.legacy_field_names()
+        })
+        for x in characters:
+            mgmodels.Character.bump_profile_section(
+                x, mgmodels.Character.PROFILE_SECTION_DYNAMIS
+            )
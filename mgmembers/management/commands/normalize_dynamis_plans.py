@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import mgmembers.models as mgmodels
+
+
+class Command(BaseCommand):
+    help = (
+        'Copies Dynamis wave 3 plan parties from the legacy per-slot columns '
+        'on DynamisWave3Plan into DynamisWave3PlanSlot rows and resets the '
+        'legacy columns'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be copied',
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        # Plans that already have slot rows were converted when they were
+        # first saved and are left alone.
+        converted = set(
+            mgmodels.DynamisWave3PlanSlot.objects.values_list(
+                'plan_id', flat=True
+            ).distinct()
+        )
+
+        new_rows = []
+        plans = []
+        for x in mgmodels.DynamisWave3Plan.objects.exclude(pk__in=converted):
+            if not x.has_legacy_slots():
+                continue
+            for (party, slot), (role, character_id, other) in (
+                x.legacy_slots().items()
+            ):
+                new_rows.append(mgmodels.DynamisWave3PlanSlot(
+                    plan_id=x.pk,
+                    party=party,
+                    slot=slot,
+                    role=role,
+                    character_id=character_id,
+                    other=other,
+                ))
+            plans.append(x)
+
+        self.stdout.write('%d slots for %d plans to copy' % (
+            len(new_rows), len(plans)
+        ))
+        if options['dry_run']:
+            return
+
+        mgmodels.DynamisWave3PlanSlot.objects.bulk_create(new_rows)
+        for x in plans:
+            x.clear_legacy_slots()
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+import mgmembers.models as mgmodels
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the daily and weekly attendance rollups from the '
+        'registered alliance history'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be stored',
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        Rollup = mgmodels.AttendanceRollup
+        counts = {}
+
+        through = mgmodels.RegisteredAlliance.characters.through
+        for character_id, zone, register_time in through.objects.values_list(
+            'character_id',
+            'registeredalliance__zone',
+            'registeredalliance__register_time',
+        ).iterator():
+            day = timezone.localdate(register_time)
+            for period, start in Rollup.period_starts(day):
+                key = (character_id, zone or '', period, start)
+                counts[key] = counts.get(key, 0) + 1
+
+        self.stdout.write('%d rollup rows for %d characters' % (
+            len(counts), len(set(x[0] for x in counts))
+        ))
+        if options['dry_run']:
+            return
+
+        Rollup.objects.all().delete()
+        Rollup.objects.bulk_create(
+            [
+                Rollup(
+                    character_id=character_id,
+                    zone=zone,
+                    period=period,
+                    start=start,
+                    count=count,
+                )
+                for (character_id, zone, period, start), count
+                in sorted(counts.items())
+            ],
+            batch_size=500,
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+import mgmembers.itemsearch as mgitemsearch
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the item search index from the imported items'
+
+    def handle(self, *args, **options):
+        size = mgitemsearch.rebuild()
+        self.stdout.write('Indexed %d items%s' % (
+            size,
+            '' if mgitemsearch.fts_supported() else ' (without full text)'
+        ))
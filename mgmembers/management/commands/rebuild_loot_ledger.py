@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import mgmembers.models as mgmodels
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the loot ledger counters from the registered alliance '
+        'history and the dated registered drops. Drops registered before '
+        'drop dates were recorded are not counted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be stored',
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            counters = mgmodels.LootLedgerDay.history()
+            rows = len(counters)
+            characters = len(set(x for x, y in counters))
+        else:
+            rows = mgmodels.LootLedgerDay.rebuild()
+            characters = mgmodels.LootLedgerDay.objects.values(
+                'character_id'
+            ).distinct().count()
+
+        self.stdout.write('%d ledger rows for %d characters' % (
+            rows, characters
+        ))
+
+        undated = (
+            mgmodels.Character.registered_drops.through.objects.count() -
+            mgmodels.RegisteredDrop.objects.count()
+        )
+        if undated > 0:
+            self.stdout.write(
+                '%d registered drops have no date and are not counted' % (
+                    undated,
+                )
+            )
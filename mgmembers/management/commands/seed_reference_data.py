@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import mgmembers.models as mgmodels
+
+# In dependency order
+MODELS = (
+    mgmodels.Job,
+    mgmodels.Race,
+    mgmodels.ItemType,
+    mgmodels.Target,
+    mgmodels.ItemFlag,
+    mgmodels.ItemSlot,
+    mgmodels.Skill,
+    mgmodels.AeonicNM,
+    mgmodels.AeonicGear,
+    mgmodels.LootItem,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates or updates the built in reference data (jobs, races, item '
+        'types, targets, flags, slots, skills, Aeonic NMs and gear, and '
+        'loot items) in one transaction'
+    )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model in MODELS:
+            created, updated = model.create_defaults()
+            self.stdout.write('%s: %d created, %d updated' % (
+                model._meta.verbose_name_plural, created, updated
+            ))
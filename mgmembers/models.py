@@ -1,33 +1,59 @@
 from django.db import models
+from django.db import IntegrityError
 from django.db import transaction
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.validators import MaxValueValidator
 from django.utils import timezone
-import os
 import uuid
 import datetime
-import lupa
+import hashlib
+import mgmembers.cache as mgcache
+import mgmembers.resources as mgresources
 
 
 RECENT_EDIT_INTERVAL = datetime.timedelta(minutes=60)
 EDITING_BLOCKED_INTERVAL = datetime.timedelta(days=60)
-
-def read_lua_data_from_file(f, start_marker="return"):
-    lua = lupa.LuaRuntime()
-    luacode = ""
-    for line in f:
-        if luacode:
-            if line.startswith("}"):
-                luacode += "}"
-                break
-            else:
-                luacode += line
-        else:
-            if line.startswith(start_marker):
-                luacode = "{"
-
-    return lua.eval(luacode)
+PROFILE_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+
+@transaction.atomic
+def upsert_defaults(model, rows, key="id", update=True):
+    """
+    Makes sure the model table has a row for each of rows, dicts of field
+    values matched to the table on the key field. Reads the table once,
+    then inserts the missing rows and, with update, saves the changed
+    fields of the existing ones in bulk. Returns (created, updated).
+    """
+    # Later rows with the same key win, like saving them one by one
+    rows = {x[key]: x for x in rows}
+    existing = {}
+    for obj in model.objects.all():
+        existing.setdefault(getattr(obj, key), obj)
+
+    new_objs = []
+    changed_objs = []
+    changed_fields = set()
+    for value, row in rows.items():
+        obj = existing.get(value)
+        if obj is None:
+            new_objs.append(model(**row))
+        elif update:
+            changed = [
+                k for k, v in row.items()
+                if k != key and getattr(obj, k) != v
+            ]
+            if changed:
+                for k in changed:
+                    setattr(obj, k, row[k])
+                changed_objs.append(obj)
+                changed_fields.update(changed)
+
+    model.objects.bulk_create(new_objs)
+    if changed_objs:
+        model.objects.bulk_update(changed_objs, sorted(changed_fields))
+
+    return len(new_objs), len(changed_objs)
 
 class Character(models.Model):
     owner = models.ForeignKey(
@@ -53,6 +79,51 @@ class Character(models.Model):
 
     registered_drops = models.ManyToManyField('LootItem')
 
+    PROFILE_SECTION_JOBS = "jobs"
+    PROFILE_SECTION_OMEN = "omen"
+    PROFILE_SECTION_DYNAMIS = "dynamis"
+
+    profile_sections = (
+        PROFILE_SECTION_JOBS,
+        PROFILE_SECTION_OMEN,
+        PROFILE_SECTION_DYNAMIS,
+    )
+
+    @staticmethod
+    def profile_section_namespace(character_id, section):
+        return "profile:%s:%s" % (character_id, section)
+
+    @classmethod
+    def bump_profile_section(cls, character_id, section):
+        mgcache.bump_namespace(
+            cls.profile_section_namespace(character_id, section)
+        )
+
+    def profile_section_versions(self):
+        """
+        Returns a dict mapping each profile section to its current cache
+        version, for use as a vary_on value in {% cache %} tags.
+        """
+        namespaces = {
+            x: self.profile_section_namespace(self.pk, x)
+            for x in self.profile_sections
+        }
+        versions = mgcache.namespace_versions(namespaces.values())
+
+        return {x: versions[y] for x, y in namespaces.items()}
+
+    @property
+    def characterjobs_with_jobs(self):
+        return self.characterjobs.select_related("job")
+
+    def dynamis_gear_choice_rows(self):
+        # Use prefetched rows (from prefetch_related(
+        # "dynamis_gear_choices__job")) when the caller loaded them.
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        if 'dynamis_gear_choices' in prefetched:
+            return self.dynamis_gear_choices.all()
+        return self.dynamis_gear_choices.select_related("job")
+
     @property
     def primary_event_jobs(self):
         return self.jobs.filter(
@@ -102,6 +173,36 @@ class Character(models.Model):
             return False
         return self.owner.pk == user.pk
 
+    @transaction.atomic
+    def set_registered_drops(self, loot_items):
+        # Only touch the rows that actually changed: one delete for drops
+        # that were unselected and one bulk insert for new ones.
+        through = Character.registered_drops.through
+        new_ids = set(x.pk for x in loot_items)
+        current_ids = set(
+            through.objects.filter(character=self).values_list(
+                'lootitem_id', flat=True
+            )
+        )
+
+        removed_ids = current_ids - new_ids
+        if removed_ids:
+            through.objects.filter(
+                character=self,
+                lootitem_id__in=removed_ids
+            ).delete()
+
+        added_ids = new_ids - current_ids
+        if added_ids:
+            through.objects.bulk_create([
+                through(character=self, lootitem_id=x)
+                for x in sorted(added_ids)
+            ])
+
+        # Bulk writes to the through table do not send m2m_changed
+        RegisteredDrop.removed([(self.pk, x) for x in removed_ids])
+        RegisteredDrop.added([(self.pk, x) for x in added_ids])
+
     def limit_to_two_primary(self):
         pjobs = CharacterJob.objects.filter(
             character=self,
@@ -121,6 +222,19 @@ class CharacterJob(models.Model):
 
     class Meta:
         ordering = ['event_status', 'gear_status', 'job_id']
+        indexes = [
+            # Gear and event overviews filter on job plus one status. The
+            # other status is included so the default ordering can be read
+            # straight from the index instead of sorting.
+            models.Index(
+                fields=['job', 'gear_status', 'event_status'],
+                name='mgm_cjob_job_gear_idx'
+            ),
+            models.Index(
+                fields=['job', 'event_status', 'gear_status'],
+                name='mgm_cjob_job_event_idx'
+            ),
+        ]
 
     character = models.ForeignKey(
         Character,
@@ -133,6 +247,8 @@ class CharacterJob(models.Model):
         on_delete=models.CASCADE,
         related_name='characterjobs',
         related_query_name='characterjob',
+        # Covered by the composite indexes in Meta
+        db_index=False,
     )
 
     level = models.PositiveIntegerField(
@@ -262,6 +378,9 @@ class Job(models.Model):
 
     FULL_NAMES = {x[0]: x[1] for x in job_choices}
 
+    # Bit of each job in the jobs bitmask of the Windower resources
+    BITS = {x[0]: 1 << (i + 1) for i, x in enumerate(job_choices)}
+
     healing_job_names = (WHM, SCH, RDM, PUP)
     tank_job_names = (RUN, PLD, NIN, PUP, WAR)
     support_job_names = (GEO, COR, BRD, RDM, SMN, BLU)
@@ -307,12 +426,10 @@ class Job(models.Model):
 
     @classmethod
     def create_defaults(cls):
-        for x in (x[0] for x in cls.job_choices):
-            try:
-                cls.objects.get(name=x)
-            except Job.DoesNotExist:
-                new_obj = cls(name=x)
-                new_obj.save()
+        return upsert_defaults(
+            cls, [dict(name=x[0]) for x in cls.job_choices],
+            key="name", update=False
+        )
 
     @classmethod
     def bitmask_to_qs(cls, bitmask):
@@ -420,6 +537,14 @@ class OmenBossesClears(models.Model):
 
 
 class OmenBossWishlist(models.Model):
+
+    class Meta:
+        indexes = [
+            # The scales overview ORs these, so each needs its own index
+            models.Index(fields=['first_choice'], name='mgm_omen_first_idx'),
+            models.Index(fields=['second_choice'], name='mgm_omen_second_idx'),
+        ]
+
     FU = 1
     KYOU = 2
     KEI = 3
@@ -512,6 +637,18 @@ class DynamisGearChoices(models.Model):
         default=None
     )
 
+    # Legacy per-zone columns. The choices now live in DynamisGearChoice;
+    # these are only read until a character's choices are converted, by
+    # the first save or the normalize_dynamis_choices command, and can be
+    # dropped once that command has been run on every database.
+    legacy_fields = (
+        ('sandoria', 'sandoria_primary', 'sandoria_secondary'),
+        ('bastok', 'bastok_primary', 'bastok_secondary'),
+        ('windurst', 'windurst_primary', 'windurst_secondary'),
+        ('jeuno', 'jeuno_primary', 'jeuno_secondary'),
+        ('body', 'body_primary', 'body_secondary'),
+    )
+
     sandoria_primary = models.ForeignKey(
         Job,
         verbose_name="San d'Oria #1",
@@ -644,63 +781,271 @@ class DynamisGearChoices(models.Model):
         return self.last_change + EDITING_BLOCKED_INTERVAL
 
     @property
-    def sandoria_jobs(self):
+    def zone_jobs(self):
+        """
+        Returns {zone: [Job, ...]} with the jobs for each zone ordered by
+        rank.
+        """
+        if not hasattr(self, '_zone_jobs'):
+            self._zone_jobs = DynamisGearChoice.jobs_by_zone(
+                self.zone_choice_rows()
+            )
+        return self._zone_jobs
+
+    def jobs_for_zone(self, zone):
+        return [x.name for x in self.zone_jobs.get(zone, ())]
+
+    def zone_choice_rows(self):
+        """
+        Returns the character's DynamisGearChoice rows. A character that
+        has none yet gets unsaved rows made from the legacy columns, so its
+        choices still show until they are converted.
+        """
+        rows = list(self.character.dynamis_gear_choice_rows())
+        if rows:
+            return rows
+
         return [
-            x.name
-            for x in (self.sandoria_primary, self.sandoria_secondary) if x
+            DynamisGearChoice(
+                character=self.character, zone=zone, rank=rank, job=job
+            )
+            for (zone, rank), job in sorted(self.legacy_zone_jobs().items())
         ]
 
+    def zone_choice_map(self):
+        """Returns {(zone, rank): Job} for this character."""
+        return {(x.zone, x.rank): x.job for x in self.zone_choice_rows()}
+
+    @property
+    def sandoria_jobs(self):
+        return self.jobs_for_zone(DynamisGearChoice.ZONE_SANDORIA)
+
     @property
     def bastok_jobs(self):
-        return [
-            x.name
-            for x in (self.bastok_primary, self.bastok_secondary) if x
-        ]
+        return self.jobs_for_zone(DynamisGearChoice.ZONE_BASTOK)
 
     @property
     def windurst_jobs(self):
-        return [
-            x.name
-            for x in (self.windurst_primary, self.windurst_secondary) if x
-        ]
+        return self.jobs_for_zone(DynamisGearChoice.ZONE_WINDURST)
 
     @property
     def jeuno_jobs(self):
-        return [
-            x.name
-            for x in (self.jeuno_primary, self.jeuno_secondary) if x
-        ]
+        return self.jobs_for_zone(DynamisGearChoice.ZONE_JEUNO)
 
     @property
     def body_jobs(self):
-        return [
-            x.name
-            for x in (self.body_primary, self.body_secondary) if x
-        ]
+        return self.jobs_for_zone(DynamisGearChoice.ZONE_BODY)
+
+    @transaction.atomic
+    def set_zone_choices(self, choices):
+        """
+        Stores {(zone, rank): Job or None} for this character, only
+        touching rows that changed.
+
+        The first save of a character that still has legacy choices
+        converts them: zones missing from choices keep their legacy job,
+        and the legacy columns are cleared.
+        """
+        existing = {
+            (x.zone, x.rank): x
+            for x in self.character.dynamis_gear_choice_rows()
+        }
+
+        if self.legacy_zone_choices():
+            if not existing:
+                merged = self.legacy_zone_jobs()
+                merged.update(choices)
+                choices = merged
+            self.clear_legacy_choices()
+
+        to_delete = []
+        to_create = []
+        for key, job in choices.items():
+            current = existing.get(key)
+            if job is None:
+                if current is not None:
+                    to_delete.append(current.pk)
+            elif current is None:
+                to_create.append(DynamisGearChoice(
+                    character=self.character,
+                    zone=key[0],
+                    rank=key[1],
+                    job=job
+                ))
+            elif current.job_id != job.pk:
+                # Replace rather than update so it can be done in bulk
+                to_delete.append(current.pk)
+                to_create.append(DynamisGearChoice(
+                    character=self.character,
+                    zone=key[0],
+                    rank=key[1],
+                    job=job
+                ))
+
+        if to_delete:
+            DynamisGearChoice.objects.filter(pk__in=to_delete).delete()
+        if to_create:
+            DynamisGearChoice.objects.bulk_create(to_create)
+
+        if hasattr(self, '_zone_jobs'):
+            del self._zone_jobs
+        getattr(self.character, '_prefetched_objects_cache', {}).pop(
+            'dynamis_gear_choices', None
+        )
+
+    def legacy_zone_choices(self):
+        result = {}
+        for zone, primary, secondary in self.legacy_fields:
+            for rank, field in (
+                (DynamisGearChoice.RANK_PRIMARY, primary),
+                (DynamisGearChoice.RANK_SECONDARY, secondary),
+            ):
+                job_id = getattr(self, field + '_id')
+                if job_id is not None:
+                    result[(zone, rank)] = job_id
+        return result
+
+    @classmethod
+    def unconverted_rows(cls, **filters):
+        """
+        Returns unsaved DynamisGearChoice rows made from the legacy columns
+        of the characters that have no DynamisGearChoice rows yet, for
+        listings that read the rows directly. filters apply to the
+        DynamisGearChoices rows.
+        """
+        result = []
+        for x in cls.objects.filter(
+            character__dynamis_gear_choice__isnull=True, **filters
+        ).select_related('character'):
+            for (zone, rank), job_id in sorted(
+                x.legacy_zone_choices().items()
+            ):
+                result.append(DynamisGearChoice(
+                    character=x.character, zone=zone, rank=rank, job_id=job_id
+                ))
+        return result
+
+    def legacy_zone_jobs(self):
+        """Returns legacy_zone_choices() with Jobs instead of ids."""
+        choices = self.legacy_zone_choices()
+        if not choices:
+            return {}
+        jobs = Job.objects.in_bulk(set(choices.values()))
+        return {
+            key: jobs[job_id]
+            for key, job_id in choices.items() if job_id in jobs
+        }
+
+    @classmethod
+    def legacy_field_names(cls):
+        return tuple(
+            field for x in cls.legacy_fields for field in x[1:]
+        )
+
+    def clear_legacy_choices(self):
+        values = {x: None for x in self.legacy_field_names()}
+        DynamisGearChoices.objects.filter(pk=self.pk).update(**values)
+        for field, value in values.items():
+            setattr(self, field, value)
 
     @classmethod
     def import_from_gear_choices(cls):
         for character in Character.objects.all():
             if hasattr(character, 'dynamisgearchoices'):
                 continue
-            
+
             item = cls(character=character)
+            item.save()
 
+            choices = {}
             pjobs = tuple(character.primary_gear_jobs)
-            if len(pjobs) > 0:
-                item.sandoria_primary = pjobs[0]
-                item.bastok_primary = pjobs[0]
-                item.windurst_primary = pjobs[0]
-            if len(pjobs) > 1:
-                item.sandoria_secondary = pjobs[1]
-                item.bastok_secondary = pjobs[1]
-                item.windurst_secondary = pjobs[1]
-
-            item.save()
+            for rank, idx in (
+                (DynamisGearChoice.RANK_PRIMARY, 0),
+                (DynamisGearChoice.RANK_SECONDARY, 1),
+            ):
+                if len(pjobs) > idx:
+                    for zone in (
+                        DynamisGearChoice.ZONE_SANDORIA,
+                        DynamisGearChoice.ZONE_BASTOK,
+                        DynamisGearChoice.ZONE_WINDURST,
+                    ):
+                        choices[(zone, rank)] = pjobs[idx]
+
+            item.set_zone_choices(choices)
 
     def __str__(self):
         return "DynamisGearChoices for %s" % self.character
 
+class DynamisGearChoice(models.Model):
+    """
+    One job a character wants Dynamis gear for in one zone. Each character
+    has at most one job per (zone, rank).
+    """
+
+    class Meta:
+        ordering = ['zone', 'rank']
+        unique_together = (('character', 'zone', 'rank'),)
+        indexes = [
+            # "Who wants gear for job X in zone Y"
+            models.Index(fields=['zone', 'job'], name='mgm_dynachoice_zone_job_idx'),
+        ]
+
+    ZONE_SANDORIA = "sandoria"
+    ZONE_BASTOK = "bastok"
+    ZONE_WINDURST = "windurst"
+    ZONE_JEUNO = "jeuno"
+    ZONE_BODY = "body"
+
+    zone_choices = (
+        (ZONE_SANDORIA, "San d'Oria"),
+        (ZONE_BASTOK, "Bastok"),
+        (ZONE_WINDURST, "Windurst"),
+        (ZONE_JEUNO, "Jeuno"),
+        (ZONE_BODY, "Body"),
+    )
+
+    RANK_PRIMARY = 1
+    RANK_SECONDARY = 2
+
+    rank_choices = (
+        (RANK_PRIMARY, "#1"),
+        (RANK_SECONDARY, "#2"),
+    )
+
+    character = models.ForeignKey(
+        Character,
+        on_delete=models.CASCADE,
+        related_name='dynamis_gear_choices',
+        related_query_name='dynamis_gear_choice',
+    )
+    zone = models.CharField(
+        max_length=20,
+        choices=zone_choices,
+    )
+    rank = models.IntegerField(
+        choices=rank_choices,
+    )
+    job = models.ForeignKey(
+        Job,
+        on_delete=models.CASCADE,
+        related_name='dynamis_gear_choices',
+        related_query_name='dynamis_gear_choice',
+    )
+
+    @staticmethod
+    def jobs_by_zone(choices):
+        result = {}
+        for x in sorted(choices, key=lambda c: (c.zone, c.rank)):
+            result.setdefault(x.zone, []).append(x.job)
+        return result
+
+    def __str__(self):
+        return "%s: %s %s %s" % (
+            self.character, self.get_zone_display(), self.get_rank_display(),
+            self.job.name
+        )
+
+
 class RemaAugmentChoice(models.Model):
     RELIC = 1
     MYTHIC = 2
@@ -738,6 +1083,79 @@ class RegisteredAlliance(models.Model):
         blank=True,
     )
     characters = models.ManyToManyField(Character)
+    # Hash of the zone, the members and the time bucket of the alliance,
+    # so the same alliance uploaded by each of its members is stored once.
+    # Null for history that has not been compacted yet.
+    content_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        unique=True,
+        editable=False,
+    )
+
+    DEDUPLICATION_BUCKET = datetime.timedelta(minutes=10)
+
+    @classmethod
+    def bucket_start(cls, register_time):
+        seconds = cls.DEDUPLICATION_BUCKET.total_seconds()
+        return datetime.datetime.fromtimestamp(
+            register_time.timestamp() // seconds * seconds,
+            tz=datetime.timezone.utc,
+        )
+
+    @staticmethod
+    def make_hash(zone, character_ids, bucket_start):
+        content = "%s\n%s\n%s" % (
+            zone or "",
+            ",".join(str(x) for x in sorted(set(character_ids))),
+            bucket_start.isoformat(),
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def content_hashes(cls, zone, character_ids, register_time):
+        """
+        Returns the hash for register_time's bucket and the one before it,
+        so uploads on either side of a bucket boundary are still matched.
+        """
+        start = cls.bucket_start(register_time)
+        return (
+            cls.make_hash(zone, character_ids, start),
+            cls.make_hash(
+                zone, character_ids, start - cls.DEDUPLICATION_BUCKET
+            ),
+        )
+
+    @classmethod
+    def register(cls, zone, character_ids, registered_by=None,
+                 register_time=None):
+        """
+        Stores an alliance unless the same one was already registered.
+        Returns (alliance, created).
+        """
+        register_time = register_time or timezone.now()
+        character_ids = set(character_ids)
+        hashes = cls.content_hashes(zone, character_ids, register_time)
+
+        existing = cls.objects.filter(content_hash__in=hashes).first()
+        if existing:
+            return existing, False
+
+        try:
+            with transaction.atomic():
+                alliance = cls.objects.create(
+                    zone=zone,
+                    registered_by=registered_by,
+                    register_time=register_time,
+                    content_hash=hashes[0],
+                )
+                alliance.characters.add(*character_ids)
+        except IntegrityError:
+            # Another member's upload of the same alliance got in first
+            return cls.objects.get(content_hash=hashes[0]), False
+
+        return alliance, True
 
     def __str__(self):
         return '%s, %s in %s: %d members' % (
@@ -748,6 +1166,442 @@ class RegisteredAlliance(models.Model):
         )
 
 
+@transaction.atomic
+def add_to_counters(model, character_ids, lookups, **changes):
+    """
+    Adds changes to the counter fields of the model rows for each
+    character and lookups, creating the missing rows. Uses one select, one
+    update and one insert however many characters there are.
+    """
+    character_ids = set(character_ids)
+    changes = {k: v for k, v in changes.items() if v}
+    if not character_ids or not changes:
+        return
+
+    increments = {k: models.F(k) + v for k, v in changes.items()}
+
+    existing = set(
+        model.objects.filter(
+            character_id__in=character_ids, **lookups
+        ).values_list('character_id', flat=True)
+    )
+    if existing:
+        model.objects.filter(
+            character_id__in=existing, **lookups
+        ).update(**increments)
+
+    missing = character_ids - existing
+    if missing:
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([
+                    model(character_id=x, **lookups, **changes)
+                    for x in sorted(missing)
+                ])
+        except IntegrityError:
+            # Another request created some of the rows first
+            for x in missing:
+                row, created = model.objects.get_or_create(
+                    character_id=x, **lookups
+                )
+                model.objects.filter(pk=row.pk).update(**increments)
+
+
+class LootLedgerDay(models.Model):
+    """
+    Per character and day counters of events attended (registered
+    alliances) and drops received (registered drops).
+
+    The counters are updated as alliances and drops are registered, so
+    questions over a window of days only read the rows in that window
+    however long the history is.
+    """
+
+    class Meta:
+        unique_together = (('character', 'day'),)
+        indexes = [
+            models.Index(fields=['day'], name='mgm_ledger_day_idx'),
+        ]
+
+    character = models.ForeignKey(
+        Character,
+        on_delete=models.CASCADE,
+        related_name='loot_ledger_days',
+        related_query_name='loot_ledger_day',
+    )
+    day = models.DateField()
+    events = models.IntegerField(default=0)
+    drops = models.IntegerField(default=0)
+
+    DEFAULT_WINDOWS = (30, 90, 365)
+
+    @classmethod
+    def windows(cls):
+        return tuple(
+            getattr(settings, "MGMEMBERS_LOOT_LEDGER_WINDOWS", None) or
+            cls.DEFAULT_WINDOWS
+        )
+
+    @classmethod
+    def record(cls, character_ids, day, events=0, drops=0):
+        """Adds events and drops to each character's counters for day."""
+        add_to_counters(cls, character_ids, {'day': day},
+                        events=events, drops=drops)
+
+    @classmethod
+    def record_drops(cls, drop_times, change):
+        """
+        Adds change to the drops counter of each (character id,
+        registered time) pair, on the day the drop was registered.
+        """
+        counts = {}
+        for character_id, registered in drop_times:
+            key = (character_id, timezone.localdate(registered))
+            counts[key] = counts.get(key, 0) + change
+
+        # record() adds the same amount to each character of a day
+        groups = {}
+        for (character_id, day), drops in counts.items():
+            groups.setdefault((day, drops), []).append(character_id)
+        for (day, drops), character_ids in sorted(groups.items()):
+            cls.record(character_ids, day, drops=drops)
+
+    @classmethod
+    def history(cls, character_ids=None):
+        """
+        Returns {(character_id, day): {"events", "drops"}} counted from
+        the registered alliances and the dated registered drops.
+        """
+        counters = {}
+
+        def count(character_id, day, field):
+            row = counters.setdefault(
+                (character_id, day), {'events': 0, 'drops': 0}
+            )
+            row[field] += 1
+
+        alliances = RegisteredAlliance.characters.through.objects.all()
+        drops = RegisteredDrop.objects.all()
+        if character_ids is not None:
+            alliances = alliances.filter(character_id__in=character_ids)
+            drops = drops.filter(character_id__in=character_ids)
+
+        for character_id, register_time in alliances.values_list(
+            'character_id', 'registeredalliance__register_time'
+        ).iterator():
+            count(character_id, timezone.localdate(register_time), 'events')
+
+        for character_id, registered in drops.values_list(
+            'character_id', 'registered'
+        ).iterator():
+            count(character_id, timezone.localdate(registered), 'drops')
+
+        return counters
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls, character_ids=None):
+        """
+        Replaces the counters of the given characters, or of everyone,
+        with the ones counted by history(). Returns the number of rows.
+        """
+        counters = cls.history(character_ids)
+
+        qs = cls.objects.all()
+        if character_ids is not None:
+            qs = qs.filter(character_id__in=character_ids)
+        qs.delete()
+
+        cls.objects.bulk_create(
+            [
+                cls(character_id=character_id, day=day, **values)
+                for (character_id, day), values in sorted(counters.items())
+            ],
+            batch_size=500,
+        )
+        return len(counters)
+
+    @classmethod
+    def summary(cls, character_ids=None, windows=None, today=None):
+        """
+        Returns {character_id: {days: {"events", "drops", "fairness"}}}
+        for each window of days, in one query.
+        """
+        windows = tuple(windows or cls.windows())
+        today = today or timezone.localdate()
+        starts = {x: today - datetime.timedelta(days=x - 1) for x in windows}
+
+        qs = cls.objects.filter(day__gte=min(starts.values()))
+        if character_ids is not None:
+            qs = qs.filter(character_id__in=character_ids)
+
+        aggregates = {}
+        for days, start in starts.items():
+            for field in ('events', 'drops'):
+                aggregates['%s_%d' % (field, days)] = models.Sum(
+                    models.Case(
+                        models.When(day__gte=start, then=field),
+                        default=0,
+                        output_field=models.IntegerField(),
+                    )
+                )
+
+        result = {}
+        for row in qs.values('character_id').annotate(**aggregates):
+            result[row['character_id']] = {
+                days: cls.counters(
+                    row['events_%d' % days], row['drops_%d' % days]
+                )
+                for days in windows
+            }
+
+        return result
+
+    @staticmethod
+    def fairness(events, drops):
+        # Events attended per drop received, smoothed so characters
+        # without history are neither first nor last
+        return round((events + 1) / (max(drops, 0) + 1), 2)
+
+    @classmethod
+    def counters(cls, events, drops):
+        return {
+            "events": events,
+            "drops": drops,
+            "fairness": cls.fairness(events, drops),
+        }
+
+    @classmethod
+    def fairness_order(cls, characters, days=None):
+        """
+        Returns [(character, counters)] ordered with the characters that
+        have attended most per drop received over the window first.
+        """
+        days = days or cls.windows()[0]
+        characters = list(characters)
+        summary = cls.summary([x.pk for x in characters], (days,))
+        empty = cls.counters(0, 0)
+
+        result = [
+            (x, summary.get(x.pk, {}).get(days, empty)) for x in characters
+        ]
+        result.sort(key=lambda x: (-x[1]["fairness"], x[0].name))
+        return result
+
+    def __str__(self):
+        return "%s on %s: %d events, %d drops" % (
+            self.character, self.day, self.events, self.drops
+        )
+
+
+class RegisteredDrop(models.Model):
+    """
+    When each of a character's registered drops (Character.registered_drops)
+    was registered, so the loot ledger can count drops on the right day.
+
+    Drops registered before this table existed have no row. They have no
+    date to put them in a window of days, so the ledger leaves them out.
+    """
+
+    class Meta:
+        unique_together = (('character', 'item'),)
+
+    character = models.ForeignKey(
+        Character,
+        on_delete=models.CASCADE,
+        related_name='registered_drop_times',
+    )
+    item = models.ForeignKey('LootItem', on_delete=models.CASCADE)
+    registered = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def added(cls, pairs, registered=None):
+        """
+        Records (character id, loot item id) pairs as registered now, or
+        at registered, and counts them in the loot ledger.
+        """
+        pairs = sorted(set(pairs))
+        if not pairs:
+            return
+        registered = registered or timezone.now()
+
+        cls.objects.bulk_create([
+            cls(character_id=x, item_id=y, registered=registered)
+            for x, y in pairs
+        ], ignore_conflicts=True)
+        LootLedgerDay.record_drops(
+            [(x, registered) for x, y in pairs], 1
+        )
+
+    @classmethod
+    def removed(cls, pairs):
+        """
+        Forgets (character id, loot item id) pairs and takes them out of
+        the loot ledger on the day they were registered.
+        """
+        pairs = set(pairs)
+        if not pairs:
+            return
+
+        rows = [
+            x for x in cls.objects.filter(
+                character_id__in=set(x for x, y in pairs),
+                item_id__in=set(y for x, y in pairs),
+            )
+            if (x.character_id, x.item_id) in pairs
+        ]
+        if not rows:
+            return
+
+        LootLedgerDay.record_drops(
+            [(x.character_id, x.registered) for x in rows], -1
+        )
+        cls.objects.filter(pk__in=[x.pk for x in rows]).delete()
+
+    def __str__(self):
+        return "%s got %s on %s" % (
+            self.character, self.item,
+            self.registered.strftime("%Y-%m-%d %H:%M:%S")
+        )
+
+
+class AttendanceRollup(models.Model):
+    """
+    Number of registered alliances each character was in, per zone and
+    per day or week (weeks start on Monday).
+
+    Kept up to date as alliances are registered, so attendance over a
+    window is read from at most six daily rows and one row per week for
+    each character and zone, however long the history is.
+    """
+
+    class Meta:
+        unique_together = (('character', 'zone', 'period', 'start'),)
+        indexes = [
+            models.Index(fields=['period', 'start'],
+                         name='mgm_attend_period_start_idx'),
+            models.Index(fields=['zone', 'period', 'start'],
+                         name='mgm_attend_zone_period_idx'),
+        ]
+
+    PERIOD_DAY = 1
+    PERIOD_WEEK = 2
+
+    period_choices = (
+        (PERIOD_DAY, "Day"),
+        (PERIOD_WEEK, "Week"),
+    )
+
+    character = models.ForeignKey(
+        Character,
+        on_delete=models.CASCADE,
+        related_name='attendance_rollups',
+        related_query_name='attendance_rollup',
+    )
+    zone = models.CharField(max_length=255, blank=True, default='')
+    period = models.IntegerField(choices=period_choices)
+    start = models.DateField()
+    count = models.IntegerField(default=0)
+
+    DEFAULT_DAYS = 30
+
+    @staticmethod
+    def week_start(day):
+        return day - datetime.timedelta(days=day.weekday())
+
+    @classmethod
+    def period_starts(cls, day):
+        return (
+            (cls.PERIOD_DAY, day),
+            (cls.PERIOD_WEEK, cls.week_start(day)),
+        )
+
+    @classmethod
+    def record(cls, character_ids, zone, day, count):
+        """Adds count to the day and week rows of each character."""
+        for period, start in cls.period_starts(day):
+            add_to_counters(
+                cls, character_ids,
+                {'zone': zone or '', 'period': period, 'start': start},
+                count=count,
+            )
+
+    @classmethod
+    def window_filter(cls, days, today=None):
+        """
+        Returns (first day, Q) selecting the rows that together cover the
+        last days days: daily rows up to the first Monday, weekly rows from
+        there on.
+        """
+        today = today or timezone.localdate()
+        first_day = today - datetime.timedelta(days=days - 1)
+        first_week = cls.week_start(first_day)
+        if first_week < first_day:
+            first_week += datetime.timedelta(days=7)
+
+        return first_day, (
+            models.Q(
+                period=cls.PERIOD_DAY,
+                start__gte=first_day,
+                start__lt=first_week,
+            ) |
+            models.Q(period=cls.PERIOD_WEEK, start__gte=first_week)
+        )
+
+    @classmethod
+    def attendance(cls, days=None, zone=None, character_ids=None,
+                   today=None):
+        """
+        Returns {"first_day", "zones": [zone], "characters": {name:
+        {"total", "zones": {zone: count}}}} for the last days days, in one
+        query.
+        """
+        days = days or cls.DEFAULT_DAYS
+        first_day, window = cls.window_filter(days, today)
+
+        qs = cls.objects.filter(window)
+        if zone is not None:
+            qs = qs.filter(zone=zone)
+        if character_ids is not None:
+            qs = qs.filter(character_id__in=character_ids)
+
+        zones = set()
+        characters = {}
+        for row in qs.values('character__name', 'zone').annotate(
+            total=models.Sum('count')
+        ).order_by():
+            if not row['total']:
+                continue
+            zones.add(row['zone'])
+            x = characters.setdefault(
+                row['character__name'], {"total": 0, "zones": {}}
+            )
+            x["total"] += row['total']
+            x["zones"][row['zone']] = row['total']
+
+        return {
+            "days": days,
+            "first_day": first_day.isoformat(),
+            "zone": zone,
+            "zones": sorted(zones),
+            "characters": characters,
+        }
+
+    @classmethod
+    def known_zones(cls):
+        return list(
+            cls.objects.filter(period=cls.PERIOD_WEEK).order_by(
+                'zone'
+            ).values_list('zone', flat=True).distinct()
+        )
+
+    def __str__(self):
+        return "%s in %s, %s of %s: %d" % (
+            self.character, self.zone, self.get_period_display().lower(),
+            self.start, self.count
+        )
+
+
 class Race(models.Model):
     name = models.CharField(max_length=60)
     name_ja = models.CharField(max_length=60)
@@ -781,20 +1635,10 @@ class Race(models.Model):
 
     @classmethod
     def create_defaults(cls):
-        for x in cls.defaults:
-            data = dict(
-                id=x["id"],
-                name=x["en"],
-                name_ja=x["ja"],
-                gender=x["gender"],
-            )
-            try:
-                obj = cls.objects.get(pk=data["id"])
-                del data["id"]
-                cls.objects.filter(pk=obj.pk).update(**data)
-            except cls.DoesNotExist:
-                obj = cls(**data)
-                obj.save()
+        return upsert_defaults(cls, [
+            dict(id=x["id"], name=x["en"], name_ja=x["ja"], gender=x["gender"])
+            for x in cls.defaults
+        ])
 
     @classmethod
     def bitmask_to_qs(cls, bitmask):
@@ -861,13 +1705,9 @@ class ItemType(models.Model):
 
     @classmethod
     def create_defaults(cls):
-        for (id, name) in cls.defaults:
-            try:
-                obj = cls.objects.get(pk=id)
-            except cls.DoesNotExist:
-                obj = cls(pk=id)
-            obj.name = name
-            obj.save()
+        return upsert_defaults(
+            cls, [dict(id=id, name=name) for (id, name) in cls.defaults]
+        )
 
     @classmethod
     def get_or_create(cls, id):
@@ -900,13 +1740,9 @@ class Target(models.Model):
 
     @classmethod
     def create_defaults(cls):
-        for (id, name) in cls.defaults:
-            try:
-                obj = cls.objects.get(pk=id)
-            except cls.DoesNotExist:
-                obj = cls(pk=id)
-            obj.name = name
-            obj.save()
+        return upsert_defaults(
+            cls, [dict(id=id, name=name) for (id, name) in cls.defaults]
+        )
 
 
     @classmethod
@@ -947,13 +1783,9 @@ class ItemFlag(models.Model):
 
     @classmethod
     def create_defaults(cls):
-        for (id, name) in cls.defaults:
-            try:
-                obj = cls.objects.get(pk=id)
-            except cls.DoesNotExist:
-                obj = cls(pk=id)
-            obj.name = name
-            obj.save()
+        return upsert_defaults(
+            cls, [dict(id=id, name=name) for (id, name) in cls.defaults]
+        )
 
 
     @classmethod
@@ -994,14 +1826,9 @@ class ItemSlot(models.Model):
 
     @classmethod
     def create_defaults(cls):
-        for x in cls.defaults:
-            try:
-                obj = cls.objects.get(pk=x["id"])
-                obj.name = x["en"]
-                obj.save()
-            except cls.DoesNotExist:
-                obj = cls(pk=x["id"], name=x["en"])
-                obj.save()
+        return upsert_defaults(
+            cls, [dict(id=x["id"], name=x["en"]) for x in cls.defaults]
+        )
 
     @classmethod
     def bitmask_to_qs(cls, bitmask):
@@ -1093,22 +1920,27 @@ class Skill(models.Model):
         return self.name
 
     @classmethod
+    @transaction.atomic
     def create_defaults(cls):
-        for x in cls.defaults:
-            data = dict(
+        upsert_defaults(
+            SkillCategory,
+            [dict(name=x["category"]) for x in cls.defaults],
+            key="name", update=False
+        )
+        categories = {}
+        for x in SkillCategory.objects.order_by('-pk'):
+            # The first category with a name, like get_or_create()
+            categories[x.name] = x.pk
+
+        return upsert_defaults(cls, [
+            dict(
                 id=x["id"],
                 name=x["en"],
                 name_ja=x["ja"],
-                category=SkillCategory.get_or_create(x["category"])
+                category_id=categories[x["category"]],
             )
-            try:
-                obj = cls.objects.get(pk=data["id"])
-                del data["id"]
-                cls.objects.filter(pk=obj.pk).update(**data)
-            except cls.DoesNotExist:
-                obj = cls(**data)
-
-            obj.save()
+            for x in cls.defaults
+        ])
 
     @classmethod
     def get_or_create(cls, id):
@@ -1124,6 +1956,43 @@ class Skill(models.Model):
 
 
 
+def filter_bits(qs, field, bits, match_all=False):
+    """
+    Filters qs to rows whose integer bitmask field has any of the given
+    bits set, or all of them with match_all.
+    """
+    alias = "%s_match" % field
+    qs = qs.annotate(**{alias: models.F(field).bitand(bits)})
+    if match_all:
+        return qs.filter(**{alias: bits})
+    return qs.exclude(**{alias: 0})
+
+
+class ItemQuerySet(models.QuerySet):
+    """Item filters on the bitmask columns, without joins."""
+
+    def for_jobs(self, *names):
+        return filter_bits(
+            self, "jobs_mask", sum(Job.BITS[x] for x in set(names))
+        )
+
+    def for_races(self, *race_ids):
+        return filter_bits(
+            self, "races_mask", sum(1 << x for x in set(race_ids))
+        )
+
+    def for_slots(self, *slot_ids):
+        return filter_bits(
+            self, "slots_mask", sum(1 << x for x in set(slot_ids))
+        )
+
+    def with_flags(self, bits):
+        return filter_bits(self, "flags_mask", bits, match_all=True)
+
+    def for_targets(self, bits):
+        return filter_bits(self, "targets_mask", bits)
+
+
 class Item(models.Model):
 
     STACK_SINGLE = 1
@@ -1172,97 +2041,131 @@ class Item(models.Model):
     targets = models.ManyToManyField(Target)
     slots = models.ManyToManyField(ItemSlot)
 
+    # The bitmasks from the Windower resources that the M2M fields above
+    # are decoded from, None for items imported before they were stored
+    jobs_mask = models.IntegerField(null=True, editable=False)
+    races_mask = models.BigIntegerField(null=True, editable=False)
+    flags_mask = models.IntegerField(null=True, editable=False)
+    targets_mask = models.IntegerField(null=True, editable=False)
+    slots_mask = models.IntegerField(null=True, editable=False)
+
     description =  models.TextField()
 
+    objects = ItemQuerySet.as_manager()
+
+    # (Resource key and M2M field, mask field, related model)
+    MASKS = (
+        ("jobs", "jobs_mask", Job),
+        ("races", "races_mask", Race),
+        ("flags", "flags_mask", ItemFlag),
+        ("targets", "targets_mask", Target),
+        ("slots", "slots_mask", ItemSlot),
+    )
+
     def __str__(self):
         return self.name
 
     def set_jobs_by_bitmask(self, bitmask):
-        new_jobs = Job.get_jobs_from_bitmask(bitmask)
-        self.jobs.exclude(pk__in=new_jobs).delete()
-        self.jobs.add(new_jobs)
+        self.jobs_mask = bitmask
+        self.save(update_fields=['jobs_mask'])
+        self.jobs.set(Job.bitmask_to_qs(bitmask))
 
     @classmethod
-    @transaction.atomic
-    def create_defaults(cls):
-        items_file = os.path.join(settings.FFXI_RES_FILES_DIR, "items.lua")
-        with open(items_file, encoding="utf8") as f:
-            lua_items = read_lua_data_from_file(f)
-
-
-            for lua_item in lua_items.values():
-                print("Importing item %s" % (lua_item["id"]))
-                try:
-                    item = cls.objects.get(id=lua_item["id"])
-                except cls.DoesNotExist:
-                    item = cls()
-                for attr, key in (
-                    ("id", "id"),
-                    ("name", "en"),
-                    ("name_ja", "ja"),
-                    ("stack", "stack"),
-                    ("cast_time", "cast_time"),
-                    ("level", "level"),
-                    ("cast_delay", "cast_delay"),
-                    ("max_charges","max_charges"),
-                    ("recast_delay", "recast_delay"),
-                    ("shield_size", "shield_size"),
-                    ("damage", "damage"),
-                    ("delay", "delay"), 
-                    ("item_level", "item_level"),
-                    ("superior_level", "superior_level"),
-                ):
-                    if key in lua_item:
-                        setattr(item, attr, lua_item[key])
-
-                if "category" in lua_item:
-                    value = lua_item["category"]
-                    item.category = ItemCategory.get_or_create(value)
-
-                if "type" in lua_item:
-                    value = lua_item["type"]
-                    item.type = ItemType.get_or_create(value)
-
-                if "skill" in lua_item:
-                    value = lua_item["skill"]
-                    item.skill = Skill.get_or_create(value)
-
-                item.save()
-
-                if "flags" in lua_item:
-                    value = int(lua_item["flags"])
-                    qs = ItemFlag.bitmask_to_qs(value)
-                    item.flags.clear()
-                    for x in qs:
-                        item.flags.add(x)
-
-                if "targets" in lua_item:
-                    value = int(lua_item["targets"])
-                    qs = Target.bitmask_to_qs(value)
-                    item.targets.clear()
-                    for x in qs:
-                        item.targets.add(x)
-
-                if "jobs" in lua_item:
-                    value = int(lua_item["jobs"])
-                    qs = Job.bitmask_to_qs(value)
-                    item.jobs.clear()
-                    for x in qs:
-                        item.jobs.add(x)
-
-                if "races" in lua_item:
-                    value = int(lua_item["races"])
-                    qs = Race.bitmask_to_qs(value)
-                    item.races.clear()
-                    for x in qs:
-                        item.races.add(x)
-
-                if "slots" in lua_item:
-                    value = int(lua_item["slots"])
-                    qs = ItemSlot.bitmask_to_qs(value)
-                    item.slots.clear()
-                    for x in qs:
-                        item.slots.add(x)
+    def create_defaults(cls, workers=1):
+        import mgmembers.item_import as mgitemimport
+        return mgitemimport.ItemImport(workers=workers).run()
+
+    @classmethod
+    def resolve_ids(cls, ids):
+        """
+        Returns {id: Item} for the given item ids. Items that are not in
+        the database yet are imported from their items.lua records, and
+        ids that are in neither are left out.
+        """
+        ids = set(ids)
+        found = cls.objects.in_bulk(ids)
+        missing = sorted(ids - set(found))
+        if not missing:
+            return found
+
+        import mgmembers.item_import as mgitemimport
+        import mgmembers.itemsearch as mgitemsearch
+
+        resource = mgresources.resource_file("items.lua")
+        rows = [
+            mgitemimport.item_row(x) for x in resource.records(missing)
+        ]
+        if rows:
+            mgitemimport.ItemImport().write(rows)
+            found.update(cls.objects.in_bulk([x["id"] for x in rows]))
+            mgitemsearch.add_items([x["id"] for x in rows])
+
+        return found
+
+    @classmethod
+    def resolve_names(cls, names):
+        """
+        Returns {name: Item} for the given English item names, importing
+        the items that are not in the database yet like resolve_ids().
+        """
+        names = set(names)
+        result = {}
+        for item in cls.objects.filter(name__in=names).order_by('-pk'):
+            # The lowest id wins, like in the resource index
+            result[item.name] = item
+
+        missing = names - set(result)
+        if missing:
+            index = mgresources.resource_file("items.lua")
+            ids = {}
+            for name in missing:
+                item_id = index.id_for_name(name)
+                if item_id is not None:
+                    ids[name] = item_id
+            items = cls.resolve_ids(ids.values())
+            for name, item_id in ids.items():
+                if item_id in items:
+                    result[name] = items[item_id]
+
+        return result
+
+    @classmethod
+    def get_or_import(cls, item_id):
+        """Returns the Item with the given id, or None if there is none."""
+        return cls.resolve_ids([item_id]).get(item_id)
+
+
+class ItemSearchEntry(models.Model):
+    """
+    Search index row for an Item, see mgmembers/itemsearch.py. The job,
+    race, slot and flag sets are stored as the same bitmasks the
+    Windower resources use, so filtering on them needs no joins.
+    """
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item_level'],
+                         name='mgm_itemsearch_ilvl_idx'),
+            models.Index(fields=['name'], name='mgm_itemsearch_name_idx'),
+        ]
+
+    item = models.OneToOneField(
+        Item,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_entry',
+    )
+    name = models.CharField(max_length=60)
+    name_ja = models.CharField(max_length=60)
+    level = models.IntegerField(null=True)
+    item_level = models.IntegerField(null=True)
+    jobs_mask = models.IntegerField(default=0)
+    races_mask = models.BigIntegerField(default=0)
+    slots_mask = models.IntegerField(default=0)
+    flags_mask = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.name
 
 
 class AeonicNM(models.Model):
@@ -1310,6 +2213,7 @@ class AeonicNM(models.Model):
 
     @classmethod
     def create_defaults(cls):
+        rows = []
         for x in (
             # Zitah tier 1
             ("Aglaophotis", cls.AREA_ZITAH, cls.TYPE_TIER_1),
@@ -1414,15 +2318,72 @@ class AeonicNM(models.Model):
             ("Vinipata", cls.AREA_REISENJIMA, cls.TYPE_HELM_1),
             ("Zerde", cls.AREA_REISENJIMA, cls.TYPE_HELM_1),
         ):
-            try:
-                cls.objects.get(name=x[0])
-            except cls.DoesNotExist:
-                new = cls(
-                    name=x[0],
-                    area=x[1],
-                    type=x[2]
-                )
-                new.save()
+            rows.append(dict(name=x[0], area=x[1], type=x[2]))
+
+        result = upsert_defaults(cls, rows, key="name", update=False)
+        # Bulk inserts do not send the signals that clear it
+        cls.clear_catalog()
+        return result
+
+    @classmethod
+    def catalog(cls):
+        """
+        Returns all NMs ordered by area, type and pk as a dict with:
+
+            "areas": [{"id", "name", "types": [
+                {"id", "name", "nms": [{"id", "name"}, ...]}, ...
+            ]}, ...]
+            "choices": ((id, label), ...) for form widgets
+            "area_starts": {id: area name} for the first NM of each area
+            "type_starts": {id: type name} for the first NM of each type
+
+        The result is cached until an NM or aeonic gear changes and must not
+        be modified by callers.
+        """
+        return mgcache.get_or_compute(
+            "aeonics", "nm_catalog", compute=cls.build_catalog, timeout=None
+        )
+
+    @classmethod
+    def build_catalog(cls):
+        areas = []
+        choices = []
+        area_starts = {}
+        type_starts = {}
+        current_area = None
+        current_type = None
+        for x in cls.objects.order_by("area", "type", "pk"):
+            if current_area is None or current_area["id"] != x.area:
+                current_area = {
+                    "id": x.area,
+                    "name": x.get_area_display(),
+                    "types": [],
+                }
+                areas.append(current_area)
+                area_starts[x.pk] = current_area["name"]
+                current_type = None
+            if current_type is None or current_type["id"] != x.type:
+                current_type = {
+                    "id": x.type,
+                    "name": x.get_type_display(),
+                    "nms": [],
+                }
+                current_area["types"].append(current_type)
+                type_starts[x.pk] = current_type["name"]
+
+            current_type["nms"].append({"id": x.pk, "name": x.name})
+            choices.append((x.pk, str(x)))
+
+        return {
+            "areas": areas,
+            "choices": tuple(choices),
+            "area_starts": area_starts,
+            "type_starts": type_starts,
+        }
+
+    @classmethod
+    def clear_catalog(cls):
+        mgcache.bump_namespace("aeonics")
 
     def __str__(self):
         return '%s (%s %s)' % (
@@ -1435,6 +2396,7 @@ class AeonicGear(models.Model):
 
     @classmethod
     def create_defaults(cls):
+        rows = []
         for x in (
             "Godhands",
             "Aeneas",
@@ -1453,11 +2415,25 @@ class AeonicGear(models.Model):
             "Marsyas",
             "Srivatsa",
         ):
-            try:
-                cls.objects.get(name=x)
-            except cls.DoesNotExist:
-                new = cls(name=x)
-                new.save()
+            rows.append(dict(name=x))
+
+        result = upsert_defaults(cls, rows, key="name", update=False)
+        AeonicNM.clear_catalog()
+        return result
+
+    @classmethod
+    def catalog(cls):
+        """
+        Returns ((id, name), ...) for all aeonic gear, cached together with
+        the AeonicNM catalog.
+        """
+        return mgcache.get_or_compute(
+            "aeonics", "gear_catalog", compute=cls.build_catalog, timeout=None
+        )
+
+    @classmethod
+    def build_catalog(cls):
+        return tuple(cls.objects.order_by("pk").values_list("pk", "name"))
 
     def __str__(self):
         return self.name
@@ -1489,6 +2465,39 @@ class AeonicsProgress(models.Model):
         blank=True
     )
 
+    def killed_nm_ids(self):
+        if self.pk is None:
+            return set()
+        return set(
+            AeonicsProgress.killed_nms.through.objects.filter(
+                aeonicsprogress=self
+            ).values_list('aeonicnm_id', flat=True)
+        )
+
+    @transaction.atomic
+    def set_killed_nms(self, nm_ids):
+        # Only touch the rows that changed: one delete for NMs that were
+        # unchecked and one bulk insert for new ones.
+        through = AeonicsProgress.killed_nms.through
+        new_ids = set(nm_ids)
+        current_ids = self.killed_nm_ids()
+
+        removed_ids = current_ids - new_ids
+        if removed_ids:
+            through.objects.filter(
+                aeonicsprogress=self,
+                aeonicnm_id__in=removed_ids
+            ).delete()
+
+        added_ids = new_ids - current_ids
+        if added_ids:
+            through.objects.bulk_create([
+                through(aeonicsprogress=self, aeonicnm_id=x)
+                for x in sorted(added_ids)
+            ])
+
+        getattr(self, '_prefetched_objects_cache', {}).pop('killed_nms', None)
+
     def __str__(self):
         return 'Aeonics progress for %s' % (self.character.name)
 
@@ -1523,10 +2532,118 @@ class DynamisWave3Registration(models.Model):
     san_doria_boss_clear = models.BooleanField(default=False)
     jeuno_boss_clear = models.BooleanField(default=False)
 
+    # (mask clear field, boss clear field) per DynamisWave3Plan zone
+    clear_fields = {
+        "san_doria": ("san_doria_mask_clear", "san_doria_boss_clear"),
+        "bastok": ("bastok_mask_clear", "bastok_boss_clear"),
+        "windurst": ("windurst_mask_clear", "windurst_boss_clear"),
+        "jeuno": ("jeuno_mask_clear", "jeuno_boss_clear"),
+    }
+
     @property
     def jobs_shortname_list(self):
         return ",".join(x.name for x in self.wave3jobs.all())
 
+    @classmethod
+    def readiness_matrix(cls):
+        return mgcache.get_or_compute(
+            "dynawave3",
+            "readiness",
+            compute=cls.build_readiness_matrix,
+            timeout=None,
+        )
+
+    @classmethod
+    def clear_readiness_matrix(cls):
+        mgcache.bump_namespace("dynawave3")
+
+    @classmethod
+    def build_readiness_matrix(cls):
+        """
+        Builds, in two queries, who can fill each DynamisWave3Plan role in
+        each zone:
+
+            {
+                "zones": [[zone, zone name], ...],
+                "roles": [[role, role name, [job, ...]], ...],
+                "characters": [{"name", "owner", "backup", "jobs",
+                                "clears": {zone: [mask, boss]}}, ...],
+                "zone_roles": {zone: {role: [
+                    {"character", "backup", "jobs", "mask", "boss"}, ...
+                ]}},
+            }
+
+        Candidates for a role are ordered with main characters before
+        backups, then by boss clear, mask clear and name.
+
+        Only plain lists, dicts and strings are used so the result can be
+        stored in any cache backend and returned as JSON as it is.
+        """
+        registrations = list(
+            cls.objects.filter(
+                character__owner__is_active=True
+            ).select_related(
+                "character__owner"
+            ).order_by("character__name")
+        )
+
+        jobs_by_registration = {}
+        for registration_id, job_name in cls.wave3jobs.through.objects.filter(
+            dynamiswave3registration__in=[x.pk for x in registrations]
+        ).values_list("dynamiswave3registration_id", "job__name"):
+            jobs_by_registration.setdefault(registration_id, set()).add(
+                job_name
+            )
+
+        zones = DynamisWave3Plan.ZONE_CHOICES
+        roles = [
+            [role, role_name, DynamisWave3Plan.jobs_by_role.get(role, [])]
+            for role, role_name in DynamisWave3Plan.role_choices
+        ]
+
+        characters = []
+        zone_roles = {zone: {x[0]: [] for x in roles} for zone, y in zones}
+        for x in registrations:
+            jobs = jobs_by_registration.get(x.pk, set())
+            clears = {
+                zone: [getattr(x, mask), getattr(x, boss)]
+                for zone, (mask, boss) in cls.clear_fields.items()
+            }
+            characters.append({
+                "name": x.character.name,
+                "owner": x.character.owner.username,
+                "backup": x.backup_character,
+                "jobs": sorted(jobs),
+                "clears": clears,
+            })
+
+            for role, role_name, role_jobs in roles:
+                matching = [job for job in role_jobs if job in jobs]
+                if not matching:
+                    continue
+                for zone, zone_name in zones:
+                    mask, boss = clears[zone]
+                    zone_roles[zone][role].append({
+                        "character": x.character.name,
+                        "backup": x.backup_character,
+                        "jobs": matching,
+                        "mask": mask,
+                        "boss": boss,
+                    })
+
+        for by_role in zone_roles.values():
+            for candidates in by_role.values():
+                candidates.sort(key=lambda c: (
+                    c["backup"], not c["boss"], not c["mask"], c["character"]
+                ))
+
+        return {
+            "zones": [list(x) for x in zones],
+            "roles": roles,
+            "characters": characters,
+            "zone_roles": zone_roles,
+        }
+
 
 def build_character_ref(party, position):
     return models.ForeignKey(Character, 
@@ -1581,6 +2698,10 @@ class DynamisWave3Plan(models.Model):
     other_kwargs = {"max_length": 20, "blank": True, "null": True}
     role_kwargs = {"max_length": 10, "choices": role_choices}
 
+    # Legacy per-slot columns. Plan slots now live in DynamisWave3PlanSlot;
+    # these are only read until a plan's slots are converted, by the first
+    # save or the normalize_dynamis_plans command, and can be dropped once
+    # that command has been run on every database.
     party1_slot1 = build_character_ref(1, 1)
     party1_slot1_role = models.CharField(default="main_tank", **role_kwargs)
     party1_slot1_other = models.CharField(**other_kwargs)
@@ -1640,34 +2761,279 @@ class DynamisWave3Plan(models.Model):
 
     notes = models.TextField(blank=True)
 
-    def role_for_slot(self, party, slot):
-        return getattr(self, "party%s_slot%s_role" % (party, slot)) 
+    SLOTS_PER_PARTY = 6
+    MAX_PARTIES = 8
 
-    def role_display_for_slot(self, party, slot):
-        method = getattr(
-            self, "get_party%s_slot%s_role_display" % (party, slot)
+    # Roles for new plans, one tuple per party. Parties added beyond these
+    # use extra_party_roles.
+    default_party_roles = (
+        ("main_tank", "off_tank", "support", "support", "support", "healer"),
+        ("dd", "dd", "COR", "BRD", "GEO", "healer"),
+        ("dd", "dd", "COR", "BRD", "GEO", "healer"),
+    )
+    extra_party_roles = ("dd", "dd", "COR", "BRD", "GEO", "healer")
+
+    @classmethod
+    def with_slots(cls):
+        # Loads plans with all their slots (and the assigned characters with
+        # their wave 3 registration) prefetched, so showing a plan costs two
+        # queries however many parties it has.
+        return cls.objects.prefetch_related(
+            models.Prefetch(
+                "slots",
+                queryset=DynamisWave3PlanSlot.objects.select_related(
+                    "character__dynamiswave3registration"
+                )
+            )
         )
 
-        if method:
-            return method()
+    @classmethod
+    def default_role(cls, party, slot):
+        if party <= len(cls.default_party_roles):
+            return cls.default_party_roles[party - 1][slot - 1]
+        return cls.extra_party_roles[slot - 1]
+
+    def slot_rows(self):
+        if self.pk is None:
+            return []
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        if 'slots' in prefetched:
+            return self.slots.all()
+        return self.slots.select_related(
+            "character__dynamiswave3registration"
+        )
 
-        return ""
+    def slot_map(self):
+        """
+        Returns {(party, slot): DynamisWave3PlanSlot} for stored slots. A
+        plan that has none yet gets unsaved slots made from the legacy
+        columns, so its parties still show until they are converted.
+        """
+        if not hasattr(self, '_slot_map'):
+            rows = list(self.slot_rows()) or self.legacy_slot_rows()
+            self._slot_map = {(x.party, x.slot): x for x in rows}
+        return self._slot_map
+
+    @property
+    def party_count(self):
+        return max(
+            [len(self.default_party_roles)] +
+            [party for party, slot in self.slot_map()]
+        )
+
+    def get_slot(self, party, slot):
+        """
+        Returns the stored slot, or an unsaved one with the default role if
+        nothing has been stored for it yet.
+        """
+        result = self.slot_map().get((party, slot))
+        if result is None:
+            result = DynamisWave3PlanSlot(
+                plan=self,
+                party=party,
+                slot=slot,
+                role=self.default_role(party, slot),
+            )
+        return result
+
+    def parties(self, party_count=None):
+        if party_count is None:
+            party_count = self.party_count
+        return [
+            {
+                "nr": party,
+                "slots": [
+                    self.get_slot(party, slot)
+                    for slot in range(1, self.SLOTS_PER_PARTY + 1)
+                ]
+            }
+            for party in range(1, party_count + 1)
+        ]
+
+    @transaction.atomic
+    def set_slots(self, slots):
+        """
+        Stores {(party, slot): (role, Character or None, other)} for this
+        plan. Stored slots missing from the dict are removed and only rows
+        that changed are written.
+
+        The first save of a plan that still has legacy slots converts them:
+        slots missing from the dict keep their legacy values, and the
+        legacy columns are reset.
+        """
+        existing = {(x.party, x.slot): x for x in self.slots.all()}
+
+        if self.has_legacy_slots():
+            if not existing:
+                merged = {
+                    (x.party, x.slot): (x.role, x.character, x.other)
+                    for x in self.legacy_slot_rows()
+                }
+                merged.update(slots)
+                slots = merged
+            self.clear_legacy_slots()
+
+        to_create = []
+        to_update = []
+        for (party, slot), (role, character, other) in slots.items():
+            character_id = character.pk if character else None
+            current = existing.pop((party, slot), None)
+            if current is None:
+                to_create.append(DynamisWave3PlanSlot(
+                    plan=self,
+                    party=party,
+                    slot=slot,
+                    role=role,
+                    character_id=character_id,
+                    other=other,
+                ))
+            elif (current.role, current.character_id, current.other) != (
+                role, character_id, other
+            ):
+                current.role = role
+                current.character_id = character_id
+                current.other = other
+                to_update.append(current)
+
+        if existing:
+            DynamisWave3PlanSlot.objects.filter(
+                pk__in=[x.pk for x in existing.values()]
+            ).delete()
+        if to_create:
+            DynamisWave3PlanSlot.objects.bulk_create(to_create)
+        if to_update:
+            DynamisWave3PlanSlot.objects.bulk_update(
+                to_update, ["role", "character", "other"]
+            )
+
+        if hasattr(self, '_slot_map'):
+            del self._slot_map
+        getattr(self, '_prefetched_objects_cache', {}).pop('slots', None)
+
+    def legacy_slots(self):
+        result = {}
+        for party in range(1, 4):
+            for slot in range(1, self.SLOTS_PER_PARTY + 1):
+                prefix = "party%s_slot%s" % (party, slot)
+                result[(party, slot)] = (
+                    getattr(self, prefix + "_role"),
+                    getattr(self, prefix + "_id"),
+                    getattr(self, prefix + "_other"),
+                )
+        return result
+
+    def has_legacy_slots(self):
+        """
+        Returns whether the legacy columns hold anything but the default
+        roles of an empty plan.
+        """
+        return any(
+            (role, character_id, other or None) !=
+            (self.default_role(party, slot), None, None)
+            for (party, slot), (role, character_id, other) in (
+                self.legacy_slots().items()
+            )
+        )
+
+    def legacy_slot_rows(self):
+        """Returns legacy_slots() as unsaved DynamisWave3PlanSlot rows."""
+        if not self.has_legacy_slots():
+            return []
+
+        legacy = self.legacy_slots()
+        characters = Character.objects.select_related(
+            "dynamiswave3registration"
+        ).in_bulk(set(
+            x[1] for x in legacy.values() if x[1] is not None
+        ))
+        return [
+            DynamisWave3PlanSlot(
+                plan=self,
+                party=party,
+                slot=slot,
+                role=role,
+                character=characters.get(character_id),
+                other=other,
+            )
+            for (party, slot), (role, character_id, other) in sorted(
+                legacy.items()
+            )
+        ]
+
+    def clear_legacy_slots(self):
+        values = {}
+        for party in range(1, 4):
+            for slot in range(1, self.SLOTS_PER_PARTY + 1):
+                prefix = "party%s_slot%s" % (party, slot)
+                values[prefix + "_id"] = None
+                values[prefix + "_role"] = self.default_role(party, slot)
+                values[prefix + "_other"] = None
+        DynamisWave3Plan.objects.filter(pk=self.pk).update(**values)
+        for field, value in values.items():
+            setattr(self, field, value)
+
+    def role_for_slot(self, party, slot):
+        return self.get_slot(party, slot).role
+
+    def role_display_for_slot(self, party, slot):
+        return self.get_slot(party, slot).get_role_display()
 
     def jobs_for_slot(self, party, slot):
-        role = self.role_for_slot(party, slot)
-        if role and role in self.jobs_by_role:
-            return ", ".join(self.jobs_by_role[role])
+        return self.get_slot(party, slot).jobs
 
     def character_for_slot(self, party, slot):
-        return getattr(self, "party%s_slot%s" % (party, slot))
+        return self.get_slot(party, slot).character
 
     def character_for_slot_display(self, party, slot):
-        char = getattr(self, "party%s_slot%s" % (party, slot))
-        if char is None:
-            char = getattr(self, "party%s_slot%s_other" % (party, slot))
-        if char is None:
-            char = ""
-        return char
+        return self.get_slot(party, slot).character_display
+
+
+class DynamisWave3PlanSlot(models.Model):
+    """One position in one party of a Dynamis wave 3 plan."""
+
+    class Meta:
+        ordering = ['party', 'slot']
+        unique_together = (('plan', 'party', 'slot'),)
+
+    plan = models.ForeignKey(
+        DynamisWave3Plan,
+        on_delete=models.CASCADE,
+        related_name='slots',
+        related_query_name='slot',
+    )
+    party = models.PositiveSmallIntegerField()
+    slot = models.PositiveSmallIntegerField()
+    role = models.CharField(
+        max_length=10,
+        choices=DynamisWave3Plan.role_choices,
+    )
+    character = models.ForeignKey(
+        Character,
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name='dynamis_plan_slots',
+        related_query_name='dynamis_plan_slot',
+    )
+    other = models.CharField(
+        max_length=20,
+        blank=True,
+        null=True,
+    )
+
+    @property
+    def jobs(self):
+        if self.role in DynamisWave3Plan.jobs_by_role:
+            return ", ".join(DynamisWave3Plan.jobs_by_role[self.role])
+
+    @property
+    def character_display(self):
+        if self.character_id is not None:
+            return self.character.name
+        return self.other or ""
+
+    def __str__(self):
+        return "%s party %s slot %s" % (self.plan_id, self.party, self.slot)
 
 class LootItem(models.Model):
 
@@ -1756,16 +3122,58 @@ class LootItem(models.Model):
 
     @classmethod
     def create_defaults(cls):
-        for x in cls.defaults:
-            try:
-                cls.objects.get(name=x[0])
-            except cls.DoesNotExist:
-                new_obj = cls(
-                    name=x[0],
-                    category=x[1],
-                    second_category=x[2]
-                )
-                new_obj.save()
+        result = upsert_defaults(cls, [
+            dict(name=x[0], category=x[1], second_category=x[2])
+            for x in cls.defaults
+        ], key="name", update=False)
+
+        cls.clear_catalog()
+        return result
+
+    @classmethod
+    def catalog(cls):
+        """
+        Returns all loot items grouped by category and second category:
+        a list of {"id", "name", "subcategories"} dicts, where each
+        subcategory is a {"name", "items"} dict and items are
+        {"id", "name"} dicts. The result is cached until the set of loot
+        items changes and must not be modified by callers.
+        """
+        return mgcache.get_or_compute(
+            "lootitem", "catalog", compute=cls.build_catalog, timeout=None
+        )
+
+    @classmethod
+    def build_catalog(cls):
+        result = []
+        current_category = None
+        current_2nd_category = None
+        for x in cls.objects.all():
+            if not current_category or x.category != current_category["id"]:
+                current_category = {
+                    "id": x.category,
+                    "name": x.get_category_display(),
+                    "subcategories": [],
+                }
+                result.append(current_category)
+                current_2nd_category = None
+            if (not current_2nd_category or
+                current_2nd_category["name"] != x.second_category):
+                current_2nd_category = {
+                    "name": x.second_category,
+                    "items": []
+                }
+                current_category["subcategories"].append(current_2nd_category)
+            current_2nd_category["items"].append({
+                "id": x.id,
+                "name": x.name,
+            })
+
+        return result
+
+    @classmethod
+    def clear_catalog(cls):
+        mgcache.bump_namespace("lootitem")
 
     def __str__(self):
         return "%s (%s, %s)" % (
@@ -1778,11 +3186,23 @@ class ItemQueue(models.Model):
     def character_list(self):
         return ", ".join([x.character.name for x in self.positions.all()])
 
+    @classmethod
+    def with_positions(cls):
+        # Loads queues with their item joined in and all positions (with
+        # characters) prefetched, so listing queues costs two queries no
+        # matter how many queues and positions exist.
+        return cls.objects.select_related("item").prefetch_related(
+            models.Prefetch(
+                "positions",
+                queryset=ItemQueuePosition.objects.select_related("character")
+            )
+        )
+
     @classmethod
     def item_dict(cls):
         excluded_set = {}
 
-        for x in cls.objects.all():
+        for x in cls.with_positions():
             excluded_set[x.item.name] = x
 
         return excluded_set
@@ -1800,11 +3220,18 @@ class ItemQueuePosition(models.Model):
 
     class Meta:
         ordering = ['position', 'character__name']
+        indexes = [
+            models.Index(
+                fields=['queue', 'position'], name='mgm_queuepos_queue_pos_idx'
+            ),
+        ]
 
     character = models.ForeignKey(Character, on_delete=models.CASCADE)
     queue = models.ForeignKey(
         ItemQueue,
         on_delete=models.CASCADE,
-        related_name="positions"
+        related_name="positions",
+        # Covered by the composite index in Meta
+        db_index=False,
     )
     position = models.IntegerField()
\ No newline at end of file
@@ -0,0 +1,154 @@
+"""
+Omen run planning: which bosses to target for a group of attendees and in
+which order their scales should be handed out.
+
+All data for the attendees is loaded up front in a few queries; the
+planning itself is a single pass over plain Python structures.
+"""
+import mgmembers.models as mgmodels
+
+Wishlist = mgmodels.OmenBossWishlist
+
+# (boss, OmenBossesClears field, scale LootItem name)
+BOSSES = (
+    (Wishlist.FU, "fu", "Fu's Scale"),
+    (Wishlist.KYOU, "kyou", "Kyou's Scale"),
+    (Wishlist.KEI, "kei", "Kei's Scale"),
+    (Wishlist.GIN, "gin", "Gin's Scale"),
+    (Wishlist.KIN, "kin", "Kin's Scale"),
+)
+
+FIRST_CHOICE_WEIGHT = 2
+SECOND_CHOICE_WEIGHT = 1
+# Characters without the clear key item for a boss count this many times
+MISSING_CLEAR_FACTOR = 2
+
+DEFAULT_NUMBER_OF_BOSSES = 3
+
+
+def load_attendees(characters):
+    """
+    Returns ([attendee dict], {boss: [queued character names]}) for the
+    given Character queryset, using three queries.
+
+    Each attendee is {"name", "choices": {boss: rank}, "cleared": set of
+    bosses, "received": set of bosses whose scale they have registered}.
+    """
+    characters = list(
+        characters.select_related("omenbosswishlist", "omenbossesclears")
+    )
+    scale_bosses = {scale: boss for boss, field, scale in BOSSES}
+
+    received = {}
+    for character_id, scale in (
+        mgmodels.Character.registered_drops.through.objects.filter(
+            character__in=[x.pk for x in characters],
+            lootitem__name__in=scale_bosses.keys(),
+        ).values_list("character_id", "lootitem__name")
+    ):
+        received.setdefault(character_id, set()).add(scale_bosses[scale])
+
+    queues = {}
+    for scale, name in mgmodels.ItemQueuePosition.objects.filter(
+        queue__item__name__in=scale_bosses.keys()
+    ).order_by("position").values_list(
+        "queue__item__name", "character__name"
+    ):
+        queues.setdefault(scale_bosses[scale], []).append(name)
+
+    attendees = []
+    for x in characters:
+        choices = {}
+        wishlist = getattr(x, "omenbosswishlist", None)
+        if wishlist:
+            if wishlist.second_choice:
+                choices[wishlist.second_choice] = 2
+            if wishlist.first_choice:
+                choices[wishlist.first_choice] = 1
+
+        cleared = set()
+        clears = getattr(x, "omenbossesclears", None)
+        if clears:
+            cleared = set(
+                boss for boss, field, scale in BOSSES if getattr(clears, field)
+            )
+
+        attendees.append({
+            "name": x.name,
+            "choices": choices,
+            "cleared": cleared,
+            "received": received.get(x.pk, set()),
+        })
+
+    return attendees, queues
+
+
+def plan_run(attendees, queues, number_of_bosses=DEFAULT_NUMBER_OF_BOSSES):
+    """
+    Scores every boss by the wishlist choices it satisfies among the
+    attendees and returns the best number_of_bosses of them, best first,
+    each with its scale distribution order.
+
+    Scores are independent per boss, so taking the top scoring bosses is
+    the optimal selection.
+    """
+    boss_names = dict(Wishlist.choices)
+    scores = {boss: 0 for boss, field, scale in BOSSES}
+    wanted_by = {boss: [] for boss, field, scale in BOSSES}
+
+    for x in attendees:
+        for boss, rank in x["choices"].items():
+            if boss not in scores:
+                continue
+            weight = (
+                FIRST_CHOICE_WEIGHT if rank == 1 else SECOND_CHOICE_WEIGHT
+            )
+            if boss not in x["cleared"]:
+                weight *= MISSING_CLEAR_FACTOR
+            scores[boss] += weight
+            wanted_by[boss].append(x)
+
+    attending = set(x["name"] for x in attendees)
+    bosses = []
+    for boss, field, scale in BOSSES:
+        queue = [x for x in queues.get(boss, ()) if x in attending]
+        queued = set(queue)
+        # Priority queue first, then first before second choices, missing
+        # clears first, those who already got the scale last
+        rest = sorted(
+            (x for x in wanted_by[boss] if x["name"] not in queued),
+            key=lambda x: (
+                x["choices"][boss],
+                boss in x["cleared"],
+                boss in x["received"],
+                x["name"],
+            )
+        )
+        bosses.append({
+            "boss": boss,
+            "name": boss_names[boss],
+            "scale": scale,
+            "score": scores[boss],
+            "first_choices": sum(
+                1 for x in wanted_by[boss] if x["choices"][boss] == 1
+            ),
+            "second_choices": sum(
+                1 for x in wanted_by[boss] if x["choices"][boss] == 2
+            ),
+            "missing_clear": sum(
+                1 for x in wanted_by[boss] if boss not in x["cleared"]
+            ),
+            "distribution": queue + [x["name"] for x in rest],
+        })
+
+    bosses.sort(key=lambda x: (-x["score"], x["boss"]))
+    return {
+        "attendees": sorted(attending),
+        "targets": bosses[:number_of_bosses],
+        "other_bosses": bosses[number_of_bosses:],
+    }
+
+
+def build_plan(characters, number_of_bosses=DEFAULT_NUMBER_OF_BOSSES):
+    attendees, queues = load_attendees(characters)
+    return plan_run(attendees, queues, number_of_bosses)
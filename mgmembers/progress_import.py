@@ -0,0 +1,447 @@
+"""
+Import of the member progress sheet ("Midguardians progress - Progress.csv",
+exported from Google Sheets).
+
+The sheet has one column per character, with the names in the first row,
+and sections of labelled rows below that. SectionReader streams the cells
+of the sections that have a registered SectionHandler, and parse() feeds
+them to the handlers to build a ProgressSheet in one pass over the file.
+Tracking a new section of the sheet only takes a new handler.
+
+ProgressImport then looks up what already exists with one query per table
+and creates the rest with bulk inserts in a single transaction.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+
+import csv
+import os
+
+import mgmembers.models as mgmodels
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+DEFAULT_FILENAME = os.path.join(
+    DATA_DIR, 'Midguardians progress - Progress.csv'
+)
+
+# Characters whose owner has another name than the character itself
+OWNER_MAP = {
+    'Kirstin': 'Miaw',
+    'Walle': 'Svedin',
+    'Zistus': 'Kerian',
+}
+
+SECTION_CHARACTERS = "characters"
+SECTION_OMEN = "omen"
+SECTION_WARDER = "warder"
+
+SECTIONS = (SECTION_CHARACTERS, SECTION_OMEN, SECTION_WARDER)
+
+
+def parse_job_status(value):
+    """Returns the CharacterJob values for a job cell, or None."""
+    if value == "Levelled":
+        return {'level': 99}
+
+    for prefix, status in (
+        ("Primary", mgmodels.CharacterJob.EVENT_PRIMARY),
+        ("Secondary", mgmodels.CharacterJob.EVENT_SECONDARY),
+    ):
+        if value.startswith(prefix):
+            result = {
+                'level': 99,
+                'event_status': status,
+                'gear_status': status,
+            }
+            if value.endswith("(Mastered)"):
+                result['mastered'] = True
+            return result
+
+    return None
+
+
+class SectionHandler(object):
+    """
+    Reads one section of the sheet. A section starts at the row whose
+    first cell starts with title and ends at the first row without a
+    label in the second cell.
+    """
+    # Name of the section in the ProgressSheet
+    name = None
+    # Start of the first cell of the section's header row
+    title = None
+    # Whether the header row also holds the first row of values
+    values_on_header = False
+    # The ProgressImport section that uses the data
+    import_section = None
+
+    def empty(self):
+        return {}
+
+    def add(self, data, label, value):
+        """Adds the cell value of row label to a character's data."""
+        raise NotImplementedError()
+
+
+SECTION_HANDLERS = []
+
+
+def register_section(handler_class):
+    SECTION_HANDLERS.append(handler_class())
+    return handler_class
+
+
+@register_section
+class JobsSection(SectionHandler):
+    name = "jobs"
+    title = "Jobs"
+    values_on_header = True
+    import_section = SECTION_CHARACTERS
+
+    def add(self, data, label, value):
+        values = parse_job_status(value)
+        if values:
+            data[label] = values
+
+
+@register_section
+class OmenClearsSection(SectionHandler):
+    name = "omen_clears"
+    title = "Omen clear KIs obtained"
+    import_section = SECTION_OMEN
+
+    def add(self, data, label, value):
+        data[label.lower()] = value == "Yes"
+
+
+@register_section
+class OmenWantedSection(SectionHandler):
+    name = "omen_wanted"
+    title = "Omen scales wanted"
+    import_section = SECTION_OMEN
+
+    def empty(self):
+        return []
+
+    def add(self, data, label, value):
+        # Labels look like "Fu (BST, DRG, SMN, PUP)"
+        if value == "Yes":
+            data.append(label.lower().split(" ")[0])
+
+
+@register_section
+class WarderPopsSection(SectionHandler):
+    name = "woc_pops"
+    title = "Warder of Courage pop"
+    import_section = SECTION_WARDER
+
+    def add(self, data, label, value):
+        # Labels look like "Primary / Warder of Temperance"
+        data[label.lower().split(" ")[0] + "_nazar"] = value == "Yes"
+
+
+def handlers_for(sections):
+    return [x for x in SECTION_HANDLERS if x.import_section in sections]
+
+
+class SectionReader(object):
+    """
+    Iterates over a progress sheet CSV file object one row at a time,
+    yielding (section name, row label, column owner, value) for each
+    character cell in the sections of the given handlers.
+
+    Stops reading once all the sections have been seen, so the rest of
+    the file is never parsed.
+    """
+
+    def __init__(self, f, handlers=None):
+        self.reader = csv.reader(f, delimiter=',', quotechar='"')
+        self.handlers = SECTION_HANDLERS if handlers is None else handlers
+        # {column index: character name} from the first row
+        self.names = {
+            idx: x for idx, x in enumerate(next(self.reader, ())) if x
+        }
+
+    def __iter__(self):
+        remaining = set(x.name for x in self.handlers)
+        names = sorted(self.names.items())
+
+        handler = None
+        for row in self.reader:
+            if not remaining:
+                return
+            if len(row) < 2:
+                continue
+
+            if handler is None:
+                handler = next(
+                    (x for x in self.handlers if row[0].startswith(x.title)),
+                    None
+                )
+                if handler is None or not handler.values_on_header:
+                    continue
+
+            label = row[1]
+            if not label:
+                remaining.discard(handler.name)
+                handler = None
+                continue
+
+            for idx, name in names:
+                if idx < len(row):
+                    yield handler.name, label, name, row[idx]
+
+
+class ProgressSheet(object):
+    """The data of a progress sheet, by section and character name."""
+
+    def __init__(self, names, handlers):
+        self.names = names
+        self.handlers = {x.name: x for x in handlers}
+        self.data = {x: {} for x in self.handlers}
+
+    def add(self, section, label, name, value):
+        data = self.data[section].get(name)
+        if data is None:
+            data = self.data[section][name] = self.handlers[section].empty()
+        self.handlers[section].add(data, label, value)
+
+    def get(self, section, name):
+        data = self.data[section].get(name)
+        if data is None:
+            return self.handlers[section].empty()
+        return data
+
+
+def parse(f, sections=SECTIONS):
+    """
+    Reads the parts of a progress sheet CSV file object needed for the
+    given import sections into a ProgressSheet.
+    """
+    handlers = handlers_for(sections)
+    reader = SectionReader(f, handlers)
+
+    sheet = ProgressSheet(reader.names, handlers)
+    for section, label, name, value in reader:
+        sheet.add(section, label, name, value)
+
+    return sheet
+
+
+class ProgressImport(object):
+    """
+    Creates the characters, owners and data from a ProgressSheet that are
+    not in the database yet. Existing rows are left alone, so importing
+    the same sheet again changes nothing.
+    """
+
+    def __init__(self, sheet, sections=SECTIONS, owner_map=OWNER_MAP):
+        self.sheet = sheet
+        self.sections = sections
+        self.owner_map = owner_map
+        self.changes = []
+        self.counts = {}
+        self.profile_sections = set()
+
+    def add_change(self, kind, description):
+        self.changes.append(description)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def run(self, dry_run=False):
+        """
+        Runs the import and returns a list of descriptions of what was
+        created. A dry run does the same work in a transaction that is
+        rolled back.
+        """
+        with transaction.atomic():
+            if SECTION_CHARACTERS in self.sections:
+                self.import_characters()
+            if SECTION_OMEN in self.sections:
+                self.import_omen()
+            if SECTION_WARDER in self.sections:
+                self.import_warder()
+
+            if dry_run:
+                transaction.set_rollback(True)
+
+        if not dry_run:
+            self.clear_caches()
+
+        return self.changes
+
+    def summary(self):
+        return ", ".join(
+            "%d %s" % (count, kind)
+            for kind, count in sorted(self.counts.items())
+        ) or "Nothing to import"
+
+    def names(self):
+        # In column order, without repeated columns
+        return list(dict.fromkeys(self.sheet.names.values()))
+
+    def characters_by_name(self):
+        return {
+            x.name: x
+            for x in mgmodels.Character.objects.filter(name__in=self.names())
+        }
+
+    def import_characters(self):
+        names = self.names()
+        owner_names = {x: self.owner_map.get(x, x) for x in names}
+
+        existing_owners = set(
+            User.objects.filter(
+                username__in=owner_names.values()
+            ).values_list('username', flat=True)
+        )
+        new_owners = sorted(set(owner_names.values()) - existing_owners)
+        if new_owners:
+            User.objects.bulk_create([
+                User(username=x, first_name=x) for x in new_owners
+            ])
+            for x in new_owners:
+                self.add_change("owners", "Create owner %s" % x)
+
+        existing = set(
+            mgmodels.Character.objects.filter(
+                name__in=names
+            ).values_list('name', flat=True)
+        )
+        new_names = [x for x in names if x not in existing]
+        if not new_names:
+            return
+
+        owners = {
+            x.username: x for x in User.objects.filter(
+                username__in=[owner_names[x] for x in new_names]
+            )
+        }
+        mgmodels.Character.objects.bulk_create([
+            mgmodels.Character(owner=owners[owner_names[x]], name=x)
+            for x in new_names
+        ])
+        # Bulk inserts do not return primary keys on SQLite
+        characters = {
+            x.name: x for x in mgmodels.Character.objects.filter(
+                name__in=new_names
+            )
+        }
+
+        jobs = {x.name: x for x in mgmodels.Job.objects.all()}
+        character_jobs = []
+        for name in new_names:
+            character = characters[name]
+            jobs_data = self.sheet.get("jobs", name)
+            for job_name, values in sorted(jobs_data.items()):
+                character_jobs.append(mgmodels.CharacterJob(
+                    character=character, job=jobs[job_name], **values
+                ))
+            self.add_change(
+                "characters",
+                "Create character %s (%s) with %d jobs" % (
+                    name, owner_names[name], len(jobs_data)
+                )
+            )
+            self.profile_sections.add(
+                (character.pk, mgmodels.Character.PROFILE_SECTION_JOBS)
+            )
+
+        mgmodels.CharacterJob.objects.bulk_create(character_jobs)
+        if character_jobs:
+            self.counts["jobs"] = len(character_jobs)
+
+    def import_omen(self):
+        characters = self.characters_by_name()
+        ids = [x.pk for x in characters.values()]
+        Wishlist = mgmodels.OmenBossWishlist
+
+        have_wishlist = set(
+            Wishlist.objects.filter(
+                character_id__in=ids
+            ).values_list('character_id', flat=True)
+        )
+        have_clears = set(
+            mgmodels.OmenBossesClears.objects.filter(
+                character_id__in=ids
+            ).values_list('character_id', flat=True)
+        )
+
+        wishlists = []
+        clears = []
+        for name in self.names():
+            character = characters.get(name)
+            if character is None:
+                continue
+
+            if character.pk not in have_wishlist:
+                wanted = self.sheet.get("omen_wanted", name)[:2]
+                choices = [getattr(Wishlist, x.upper()) for x in wanted]
+                wishlists.append(Wishlist(
+                    character=character,
+                    first_choice=choices[0] if choices else None,
+                    second_choice=choices[1] if len(choices) > 1 else None,
+                ))
+                self.add_change(
+                    "omen wishlists",
+                    "Create Omen wishlist for %s: %s" % (
+                        name,
+                        ", ".join(x.capitalize() for x in wanted) or "none"
+                    )
+                )
+                self.profile_sections.add(
+                    (character.pk, mgmodels.Character.PROFILE_SECTION_OMEN)
+                )
+
+            if character.pk not in have_clears:
+                values = self.sheet.get("omen_clears", name)
+                clears.append(mgmodels.OmenBossesClears(
+                    character=character, **values
+                ))
+                self.add_change(
+                    "omen clears",
+                    "Create Omen clears for %s: %s" % (
+                        name,
+                        ", ".join(
+                            x.capitalize() for x, y in values.items() if y
+                        ) or "none"
+                    )
+                )
+
+        Wishlist.objects.bulk_create(wishlists)
+        mgmodels.OmenBossesClears.objects.bulk_create(clears)
+
+    def import_warder(self):
+        characters = self.characters_by_name()
+        have_pops = set(
+            mgmodels.WarderOfCouragePops.objects.filter(
+                character_id__in=[x.pk for x in characters.values()]
+            ).values_list('character_id', flat=True)
+        )
+
+        pops = []
+        for name in self.names():
+            character = characters.get(name)
+            if character is None or character.pk in have_pops:
+                continue
+
+            values = self.sheet.get("woc_pops", name)
+            pops.append(mgmodels.WarderOfCouragePops(
+                character=character, **values
+            ))
+            self.add_change(
+                "warder pops",
+                "Create Warder pops for %s: %d items" % (
+                    name, sum(1 for x in values.values() if x)
+                )
+            )
+
+        mgmodels.WarderOfCouragePops.objects.bulk_create(pops)
+
+    def clear_caches(self):
+        # Bulk inserts do not send the post_save signals that normally
+        # invalidate these
+        for character_id, section in self.profile_sections:
+            mgmodels.Character.bump_profile_section(character_id, section)
+        if self.counts.get("owners") or self.counts.get("characters"):
+            mgmodels.DynamisWave3Registration.clear_readiness_matrix()
@@ -0,0 +1,61 @@
+"""
+Captures SQLite query plans for the queries issued by the overview pages.
+
+Each overview view is rendered for an anonymous user while its queries are
+recorded, and every distinct query is then run through EXPLAIN QUERY PLAN.
+Used by the explain_overviews command and by the index tests.
+"""
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import mgmembers.views as mgviews
+
+OVERVIEW_VIEWS = (
+    ('gear-choices-overview', mgviews.GearChoicesOverview),
+    ('gear-omen-scales', mgviews.OmenScalesOverview),
+    ('gear-dynamis-overview', mgviews.DynamisGearOverview),
+    ('party-builder', mgviews.PartyBuilder),
+    ('item-queue-list', mgviews.ItemQueueList),
+    ('gear-overview-json', mgviews.LootJsonView),
+)
+
+
+def render_and_capture(url_name, view_class):
+    request = RequestFactory().get(reverse(url_name))
+    request.user = AnonymousUser()
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = view_class.as_view()(request)
+        if hasattr(response, 'render'):
+            response.render()
+
+    return [x['sql'] for x in ctx.captured_queries]
+
+
+def explain(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        # Rows are (id, parent, notused, detail)
+        return [x[-1] for x in cursor.fetchall()]
+
+
+def capture_query_plans(views=OVERVIEW_VIEWS):
+    """
+    Returns {url name: [(sql, [plan detail lines]), ...]} with one entry
+    per distinct query issued while rendering each view.
+    """
+    result = {}
+    for url_name, view_class in views:
+        plans = []
+        seen = set()
+        for sql in render_and_capture(url_name, view_class):
+            if sql in seen or not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            seen.add(sql)
+            plans.append((sql, explain(sql)))
+        result[url_name] = plans
+
+    return result
@@ -0,0 +1,217 @@
+"""
+Access to the Windower resource files (res/*.lua).
+
+The resource files hold one record per line, like
+
+    [12345] = {id=12345,en="Some Item",ja="...",category="Armor",...},
+
+ResourceFile memory-maps a file and keeps a table of the byte offset and
+length of every record, with the English names, so single records can be
+read and evaluated without loading the rest of the file into Lua. The
+table is saved in a small index file under FFXI_RES_INDEX_DIR and only
+rebuilt, with one scan over the mapped file, when the resource file
+changes.
+
+resource_file() shares one ResourceFile per file between all importers
+in the process.
+"""
+from django.conf import settings
+
+import json
+import lupa
+import mmap
+import os
+import re
+
+RECORD_RE = re.compile(rb'^[ \t]*\[(\d+)\][ \t]*=[ \t]*(\{[^\n]*\})', re.M)
+NAME_RE = re.compile(rb'\ben="((?:[^"\\]|\\.)*)"')
+
+INDEX_VERSION = 2
+
+
+def lua_to_python(value):
+    """Converts a Lua table to a dict, leaving other values alone."""
+    if lupa.lua_type(value) == "table":
+        return {k: lua_to_python(v) for k, v in value.items()}
+    return value
+
+
+class ResourceFile(object):
+    """
+    A memory-mapped resource file and its record offset table. The file
+    is mapped on first use and stays mapped until close().
+    """
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        if index_path is None:
+            index_path = os.path.join(
+                settings.FFXI_RES_INDEX_DIR,
+                "%s.idx" % os.path.basename(path)
+            )
+        self.index_path = index_path
+        self.stamp = None
+        self.data = None
+        # {id: (offset, length)}
+        self.offsets = None
+        # {lower case English name: id of the first record with it}
+        self.names = None
+        self._lua = None
+
+    def source_stamp(self):
+        stat = os.stat(self.path)
+        return {
+            "version": INDEX_VERSION,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
+
+    def is_current(self):
+        return self.stamp is not None and self.stamp == self.source_stamp()
+
+    def open(self):
+        """Maps the file and loads or builds its offset table."""
+        if self.data is not None:
+            return self
+
+        self.stamp = self.source_stamp()
+        with open(self.path, "rb") as f:
+            if self.stamp["size"]:
+                self.data = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            else:
+                # Empty files can not be mapped
+                self.data = b""
+
+        if not self.load_index():
+            self.build_index()
+        return self
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                # A record_data() view is still in use, leave the mapping
+                # to be closed when it is garbage collected
+                pass
+        self.data = None
+        self.offsets = None
+        self.names = None
+        self.stamp = None
+
+    def scan(self):
+        """
+        Yields (id, offset, length, English name) for each record of the
+        mapped file.
+        """
+        for match in RECORD_RE.finditer(self.data):
+            name = NAME_RE.search(self.data, match.start(2), match.end(2))
+            yield (
+                int(match.group(1)),
+                match.start(2),
+                match.end(2) - match.start(2),
+                name.group(1).decode("utf8") if name else "",
+            )
+
+    def add(self, record_id, offset, length, name):
+        self.offsets[record_id] = (offset, length)
+        if name:
+            self.names.setdefault(name.lower(), record_id)
+
+    def load_index(self):
+        """Reads the saved offset table if it matches the mapped file."""
+        self.offsets = {}
+        self.names = {}
+        try:
+            with open(self.index_path, encoding="utf8") as f:
+                if json.loads(f.readline()) != self.stamp:
+                    return False
+                for line in f:
+                    record_id, offset, length, name = (
+                        line.rstrip("\n").split("\t", 3)
+                    )
+                    self.add(int(record_id), int(offset), int(length), name)
+        except (OSError, ValueError):
+            self.offsets = {}
+            self.names = {}
+            return False
+        return True
+
+    def build_index(self):
+        self.offsets = {}
+        self.names = {}
+
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        # Worker processes may build the same index at the same time
+        tmp_path = "%s.%d.tmp" % (self.index_path, os.getpid())
+        with open(tmp_path, "w", encoding="utf8") as f:
+            f.write(json.dumps(self.stamp) + "\n")
+            for record_id, offset, length, name in self.scan():
+                f.write("%d\t%d\t%d\t%s\n" % (record_id, offset, length, name))
+                self.add(record_id, offset, length, name)
+        os.replace(tmp_path, self.index_path)
+
+    def ids(self):
+        """Returns the record ids in file order."""
+        offsets = self.open().offsets
+        return sorted(offsets, key=lambda x: offsets[x][0])
+
+    def id_for_name(self, name):
+        return self.open().names.get(name.lower())
+
+    def record_data(self, record_id):
+        """
+        Returns the source of a record as a memoryview of the mapped
+        file, or None if there is no such id.
+        """
+        position = self.open().offsets.get(record_id)
+        if position is None:
+            return None
+        offset, length = position
+        return memoryview(self.data)[offset:offset + length]
+
+    def evaluate(self, data):
+        if self._lua is None:
+            self._lua = lupa.LuaRuntime()
+        return lua_to_python(self._lua.eval(str(data, "utf8")))
+
+    def record(self, record_id):
+        """Returns a record as a dict, or None if there is no such id."""
+        data = self.record_data(record_id)
+        if data is None:
+            return None
+        return self.evaluate(data)
+
+    def records(self, ids=None, batch_size=1000):
+        """
+        Yields the records with the given ids, or all of them in file
+        order, as dicts. Records are evaluated batch_size at a time, as
+        one Lua table each.
+        """
+        if ids is None:
+            ids = self.ids()
+        ids = [x for x in ids if x in self.open().offsets]
+        for start in range(0, len(ids), batch_size):
+            batch = b",".join(
+                self.record_data(x) for x in ids[start:start + batch_size]
+            )
+            yield from self.evaluate(b"{" + batch + b"}").values()
+
+
+_files = {}
+
+
+def resource_file(filename):
+    """
+    Returns the shared ResourceFile of a file in FFXI_RES_FILES_DIR,
+    mapping it again if the file has changed since it was mapped.
+    """
+    path = os.path.join(settings.FFXI_RES_FILES_DIR, filename)
+    resource = _files.get(path)
+    if resource is None:
+        resource = _files[path] = ResourceFile(path)
+    elif resource.data is not None and not resource.is_current():
+        resource.close()
+    return resource
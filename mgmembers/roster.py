@@ -0,0 +1,340 @@
+"""
+Roster snapshots: all member data as a zip file with one CSV file per
+table.
+
+Rows refer to characters, jobs, items and NMs by name rather than by
+primary key, so a snapshot can be loaded into another database. Export
+streams each table with iterator() straight into the zip file, and import
+replaces the data of the characters in the snapshot with bulk inserts in
+a single transaction.
+
+Dynamis gear choices that are still in the legacy DynamisGearChoices
+columns are exported as DynamisGearChoice rows, so snapshots do not
+depend on normalize_dynamis_choices having run.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+
+import csv
+import heapq
+import io
+import zipfile
+
+import mgmembers.models as mgmodels
+
+CHARACTER = "character"
+# The AeonicsProgress and ItemQueue rows are found by the name of their
+# character and item
+AEONICS_PROGRESS = "aeonics progress"
+ITEM_QUEUE = "item queue"
+
+
+class Table(object):
+    """
+    A table of the snapshot. columns are (CSV column, field or lookup to
+    export, field to import into, what the value refers to by name or
+    None for plain values).
+    """
+
+    def __init__(self, name, model, columns, ordering=None):
+        self.name = name
+        self.model = model
+        self.columns = columns
+        self.ordering = ordering or [columns[0][1], 'pk']
+
+    @property
+    def filename(self):
+        return "%s.csv" % self.name
+
+    def header(self):
+        return [x[0] for x in self.columns]
+
+    def rows(self):
+        return self.model.objects.order_by(*self.ordering).values_list(
+            *[x[1] for x in self.columns]
+        ).iterator()
+
+    def field(self, column):
+        attname = dict((x[0], x[2]) for x in self.columns)[column]
+        return self.model._meta.get_field(attname)
+
+
+class DynamisGearChoiceTable(Table):
+    """
+    Also exports the legacy choices of the characters that have no
+    DynamisGearChoice rows yet.
+    """
+
+    def rows(self):
+        jobs = dict(mgmodels.Job.objects.values_list("pk", "name"))
+        legacy = sorted(
+            (
+                (x.character.name, x.zone, x.rank, jobs[x.job_id])
+                for x in mgmodels.DynamisGearChoices.unconverted_rows()
+            ),
+            key=lambda x: x[0]
+        )
+        return heapq.merge(super().rows(), legacy, key=lambda x: x[0])
+
+
+Through = mgmodels.AeonicsProgress.finished_aeonics.through
+KilledThrough = mgmodels.AeonicsProgress.killed_nms.through
+DropsThrough = mgmodels.Character.registered_drops.through
+
+TABLES = (
+    # Characters and their owners are created by import_characters
+    Table("characters", mgmodels.Character, (
+        ("name", "name", "name", None),
+        ("owner", "owner__username", None, None),
+        ("owner_first_name", "owner__first_name", None, None),
+        ("owner_active", "owner__is_active", None, None),
+    )),
+    Table("character_jobs", mgmodels.CharacterJob, (
+        ("character", "character__name", "character_id", CHARACTER),
+        ("job", "job__name", "job_id", mgmodels.Job),
+        ("level", "level", "level", None),
+        ("mastered", "mastered", "mastered", None),
+        ("event_status", "event_status", "event_status", None),
+        ("gear_status", "gear_status", "gear_status", None),
+    )),
+    DynamisGearChoiceTable(
+        "dynamis_gear_choices", mgmodels.DynamisGearChoice, (
+            ("character", "character__name", "character_id", CHARACTER),
+            ("zone", "zone", "zone", None),
+            ("rank", "rank", "rank", None),
+            ("job", "job__name", "job_id", mgmodels.Job),
+        )
+    ),
+    Table("omen_wishlists", mgmodels.OmenBossWishlist, (
+        ("character", "character__name", "character_id", CHARACTER),
+        ("first_choice", "first_choice", "first_choice", None),
+        ("second_choice", "second_choice", "second_choice", None),
+    )),
+    Table("omen_clears", mgmodels.OmenBossesClears, (
+        ("character", "character__name", "character_id", CHARACTER),
+    ) + tuple(
+        (x, x, x, None) for x in ("fu", "kyou", "kei", "gin", "kin")
+    )),
+    Table("warder_pops", mgmodels.WarderOfCouragePops, (
+        ("character", "character__name", "character_id", CHARACTER),
+    ) + tuple(
+        (x.name, x.name, x.name, None)
+        for x in mgmodels.WarderOfCouragePops._meta.fields
+        if x.name.endswith("_nazar")
+    )),
+    Table("aeonics_progress", mgmodels.AeonicsProgress, (
+        ("character", "character__name", "character_id", CHARACTER),
+        ("number_of_beads", "number_of_beads", "number_of_beads", None),
+        ("malformed_weapon_in_progress",
+         "malformed_weapon_in_progress__name",
+         "malformed_weapon_in_progress_id", mgmodels.AeonicGear),
+    )),
+    Table("aeonics_finished", Through, (
+        ("character", "aeonicsprogress__character__name",
+         "aeonicsprogress_id", AEONICS_PROGRESS),
+        ("aeonic", "aeonicgear__name", "aeonicgear_id", mgmodels.AeonicGear),
+    )),
+    Table("aeonics_killed_nms", KilledThrough, (
+        ("character", "aeonicsprogress__character__name",
+         "aeonicsprogress_id", AEONICS_PROGRESS),
+        ("nm", "aeonicnm__name", "aeonicnm_id", mgmodels.AeonicNM),
+    )),
+    Table("item_queues", mgmodels.ItemQueuePosition, (
+        ("item", "queue__item__name", "queue_id", ITEM_QUEUE),
+        ("character", "character__name", "character_id", CHARACTER),
+        ("position", "position", "position", None),
+    ), ordering=["queue__item__name", "position"]),
+    Table("registered_drops", DropsThrough, (
+        ("character", "character__name", "character_id", CHARACTER),
+        ("item", "lootitem__name", "lootitem_id", mgmodels.LootItem),
+    )),
+    Table("registered_drop_dates", mgmodels.RegisteredDrop, (
+        ("character", "character__name", "character_id", CHARACTER),
+        ("item", "item__name", "item_id", mgmodels.LootItem),
+        ("registered", "registered", "registered", None),
+    )),
+)
+
+
+def export_roster(f):
+    """Writes a snapshot zip file to the binary file object f."""
+    with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as archive:
+        for table in TABLES:
+            with archive.open(table.filename, "w") as member:
+                text = io.TextIOWrapper(
+                    member, encoding="utf-8", newline=""
+                )
+                writer = csv.writer(text)
+                writer.writerow(table.header())
+                for row in table.rows():
+                    writer.writerow(["" if x is None else x for x in row])
+                text.flush()
+                text.detach()
+
+
+class RosterImport(object):
+    """
+    Loads a snapshot. Characters and owners that do not exist are
+    created, and all data of the characters in the snapshot is replaced
+    by the snapshot's. Item queues that are in the snapshot are replaced
+    as a whole. The loot ledger of the characters is rebuilt from their
+    registered alliances and the imported drop dates.
+    """
+
+    def __init__(self, f):
+        self.archive = zipfile.ZipFile(f)
+        self.counts = {}
+        self.names = {}
+
+    def read(self, table):
+        """
+        Yields a dict per row of a table, with values as strings. Tables
+        that older snapshots do not have are read as empty.
+        """
+        if table.filename not in self.archive.namelist():
+            return
+        with self.archive.open(table.filename) as member:
+            text = io.TextIOWrapper(member, encoding="utf-8", newline="")
+            yield from csv.DictReader(text)
+
+    def lookup(self, reference):
+        """Returns the pks by name of what a column refers to."""
+        if reference not in self.names:
+            if reference == CHARACTER:
+                names = mgmodels.Character.objects.values_list("name", "pk")
+            elif reference == AEONICS_PROGRESS:
+                names = mgmodels.AeonicsProgress.objects.values_list(
+                    "character__name", "pk"
+                )
+            elif reference == ITEM_QUEUE:
+                names = mgmodels.ItemQueue.objects.values_list(
+                    "item__name", "pk"
+                )
+            else:
+                names = reference.objects.values_list("name", "pk")
+            self.names[reference] = dict(names)
+        return self.names[reference]
+
+    def resolve(self, reference, name):
+        """
+        Returns the pk of what a column refers to, or None if it does not
+        exist here. Item queues are created for loot items that have none.
+        """
+        pk = self.lookup(reference).get(name)
+        if pk is None and reference == ITEM_QUEUE:
+            item_id = self.lookup(mgmodels.LootItem).get(name)
+            if item_id is not None:
+                pk = mgmodels.ItemQueue.objects.create(item_id=item_id).pk
+                self.names[ITEM_QUEUE][name] = pk
+        return pk
+
+    def convert(self, table, row):
+        """
+        Returns the model field values of a row, or None if it refers to
+        something that does not exist here.
+        """
+        values = {}
+        for column, lookup, attname, reference in table.columns:
+            field = table.field(column)
+            value = row[column]
+            if value == "" and field.null:
+                values[attname] = None
+            elif reference is not None:
+                values[attname] = self.resolve(reference, value)
+                if values[attname] is None:
+                    return None
+            else:
+                values[attname] = field.to_python(value)
+        return values
+
+    def run(self, dry_run=False):
+        with transaction.atomic():
+            character_ids = self.import_characters(TABLES[0])
+            for table in TABLES[1:]:
+                if table.model is mgmodels.ItemQueuePosition:
+                    self.import_item_queues(table)
+                else:
+                    self.import_table(table, character_ids)
+
+            # Bulk inserts of registered drops do not update the ledger
+            mgmodels.LootLedgerDay.rebuild(character_ids)
+
+            if dry_run:
+                transaction.set_rollback(True)
+
+        if not dry_run:
+            for character_id in character_ids:
+                for section in mgmodels.Character.profile_sections:
+                    mgmodels.Character.bump_profile_section(
+                        character_id, section
+                    )
+            mgmodels.DynamisWave3Registration.clear_readiness_matrix()
+
+        return self.counts
+
+    def import_characters(self, table):
+        """Returns the pks of the characters in the snapshot."""
+        rows = list(self.read(table))
+
+        users = dict(User.objects.values_list("username", "pk"))
+        new_users = {}
+        for row in rows:
+            if row["owner"] not in users:
+                new_users[row["owner"]] = User(
+                    username=row["owner"],
+                    first_name=row["owner_first_name"],
+                    is_active=row["owner_active"] == "True",
+                )
+        User.objects.bulk_create(new_users.values())
+        users = dict(User.objects.values_list("username", "pk"))
+
+        existing = self.lookup(mgmodels.Character)
+        new_characters = [
+            mgmodels.Character(name=x["name"], owner_id=users[x["owner"]])
+            for x in rows if x["name"] not in existing
+        ]
+        mgmodels.Character.objects.bulk_create(new_characters)
+        # Bulk inserts do not return primary keys on SQLite
+        del self.names[mgmodels.Character]
+        self.counts["owners created"] = len(new_users)
+        self.counts["characters created"] = len(new_characters)
+
+        characters = self.lookup(mgmodels.Character)
+        return [characters[x["name"]] for x in rows]
+
+    def import_table(self, table, character_ids):
+        model = table.model
+        if model in (Through, KilledThrough):
+            character_filter = "aeonicsprogress__character_id__in"
+        else:
+            character_filter = "character_id__in"
+        model.objects.filter(**{character_filter: character_ids}).delete()
+        if model is mgmodels.DynamisGearChoice:
+            # The snapshot has the legacy choices as rows
+            mgmodels.DynamisGearChoices.objects.filter(
+                character_id__in=character_ids
+            ).update(**{
+                x: None
+                for x in mgmodels.DynamisGearChoices.legacy_field_names()
+            })
+
+        objects = []
+        for row in self.read(table):
+            values = self.convert(table, row)
+            if values is not None:
+                objects.append(model(**values))
+
+        model.objects.bulk_create(objects, batch_size=500)
+        self.counts[table.name] = len(objects)
+
+    def import_item_queues(self, table):
+        positions = [
+            mgmodels.ItemQueuePosition(**x)
+            for x in (self.convert(table, x) for x in self.read(table))
+            if x is not None
+        ]
+        mgmodels.ItemQueuePosition.objects.filter(
+            queue_id__in=set(x.queue_id for x in positions)
+        ).delete()
+        mgmodels.ItemQueuePosition.objects.bulk_create(positions)
+        self.counts[table.name] = len(positions)
@@ -0,0 +1,159 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+import mgmembers.models as mgmodels
+
+
+@receiver(post_save, sender=mgmodels.LootItem)
+@receiver(post_delete, sender=mgmodels.LootItem)
+def clear_loot_catalog(sender, **kwargs):
+    sender.clear_catalog()
+
+
+@receiver(post_save, sender=mgmodels.AeonicNM)
+@receiver(post_delete, sender=mgmodels.AeonicNM)
+@receiver(post_save, sender=mgmodels.AeonicGear)
+@receiver(post_delete, sender=mgmodels.AeonicGear)
+def clear_aeonics_catalog(sender, **kwargs):
+    mgmodels.AeonicNM.clear_catalog()
+
+
+@receiver(post_save, sender=mgmodels.Character)
+def bump_all_profile_sections(sender, instance, **kwargs):
+    # Section fragments show the character name, so a rename invalidates
+    # all of them.
+    for section in sender.profile_sections:
+        sender.bump_profile_section(instance.pk, section)
+
+
+def bump_profile_section_for(model, section):
+    def bump(sender, instance, **kwargs):
+        mgmodels.Character.bump_profile_section(
+            instance.character_id, section
+        )
+
+    post_save.connect(bump, sender=model, weak=False)
+    post_delete.connect(bump, sender=model, weak=False)
+
+
+for model, section in (
+    (mgmodels.CharacterJob, mgmodels.Character.PROFILE_SECTION_JOBS),
+    (mgmodels.OmenBossWishlist, mgmodels.Character.PROFILE_SECTION_OMEN),
+    (mgmodels.DynamisGearChoices, mgmodels.Character.PROFILE_SECTION_DYNAMIS),
+    (mgmodels.DynamisGearChoice, mgmodels.Character.PROFILE_SECTION_DYNAMIS),
+):
+    bump_profile_section_for(model, section)
+
+
+@receiver(post_save, sender=mgmodels.DynamisWave3Registration)
+@receiver(post_delete, sender=mgmodels.DynamisWave3Registration)
+@receiver(post_save, sender=mgmodels.Character)
+@receiver(post_delete, sender=mgmodels.Character)
+def clear_dynamis_readiness(sender, **kwargs):
+    mgmodels.DynamisWave3Registration.clear_readiness_matrix()
+
+
+@receiver(post_save, sender=User)
+def clear_dynamis_readiness_on_user(sender, update_fields=None, **kwargs):
+    # Only active owners are listed. Logging in only touches last_login,
+    # which does not matter here.
+    if update_fields and set(update_fields) == {"last_login"}:
+        return
+    mgmodels.DynamisWave3Registration.clear_readiness_matrix()
+
+
+@receiver(m2m_changed, sender=mgmodels.DynamisWave3Registration.wave3jobs.through)
+def clear_dynamis_readiness_on_jobs(sender, action, **kwargs):
+    if action.startswith("post_"):
+        mgmodels.DynamisWave3Registration.clear_readiness_matrix()
+
+
+def alliance_attendance_changed(alliance, character_ids, change):
+    character_ids = list(character_ids)
+    day = timezone.localdate(alliance.register_time)
+    mgmodels.LootLedgerDay.record(character_ids, day, events=change)
+    mgmodels.AttendanceRollup.record(
+        character_ids, alliance.zone, day, change
+    )
+
+
+@receiver(m2m_changed, sender=mgmodels.RegisteredAlliance.characters.through)
+def record_alliance_attendance(sender, instance, action, reverse, **kwargs):
+    if action == "pre_clear":
+        if reverse:
+            alliances = instance.registeredalliance_set.all()
+        else:
+            alliances = [instance]
+        change = -1
+    elif action in ("post_add", "post_remove"):
+        pk_set = kwargs.get("pk_set") or ()
+        if reverse:
+            alliances = mgmodels.RegisteredAlliance.objects.filter(
+                pk__in=pk_set
+            )
+        else:
+            alliances = [instance]
+        change = 1 if action == "post_add" else -1
+    else:
+        return
+
+    for alliance in alliances:
+        if reverse:
+            character_ids = [instance.pk]
+        elif action == "pre_clear":
+            character_ids = alliance.characters.values_list("pk", flat=True)
+        else:
+            character_ids = kwargs.get("pk_set") or ()
+        alliance_attendance_changed(alliance, character_ids, change)
+
+
+@receiver(pre_delete, sender=mgmodels.RegisteredAlliance)
+def remove_alliance_attendance(sender, instance, **kwargs):
+    # Deleting the alliance removes its member rows without m2m_changed
+    alliance_attendance_changed(
+        instance, instance.characters.values_list("pk", flat=True), -1
+    )
+
+
+@receiver(m2m_changed, sender=mgmodels.Character.registered_drops.through)
+def record_registered_drops(sender, instance, action, reverse, **kwargs):
+    if action == "pre_clear":
+        if reverse:
+            pairs = [
+                (x, instance.pk) for x in
+                instance.character_set.values_list("pk", flat=True)
+            ]
+        else:
+            pairs = [
+                (instance.pk, x) for x in
+                instance.registered_drops.values_list("pk", flat=True)
+            ]
+        mgmodels.RegisteredDrop.removed(pairs)
+        return
+
+    if action not in ("post_add", "post_remove"):
+        return
+
+    pk_set = kwargs.get("pk_set") or ()
+    if reverse:
+        pairs = [(x, instance.pk) for x in pk_set]
+    else:
+        pairs = [(instance.pk, x) for x in pk_set]
+
+    if action == "post_add":
+        mgmodels.RegisteredDrop.added(pairs)
+    else:
+        mgmodels.RegisteredDrop.removed(pairs)
+
+
+@receiver(pre_delete, sender=mgmodels.LootItem)
+def remove_registered_drops(sender, instance, **kwargs):
+    # Deleting the item removes its drop rows without m2m_changed
+    mgmodels.RegisteredDrop.removed(
+        instance.registereddrop_set.values_list("character_id", "item_id")
+    )
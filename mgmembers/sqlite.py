@@ -0,0 +1,28 @@
+"""
+Per-connection tuning for the SQLite database.
+
+The PRAGMAs listed in settings.SQLITE_PRAGMAS are applied whenever Django
+opens a new SQLite connection. Most of them only last for the lifetime of
+the connection, which is why they are applied on connect rather than once.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def get_pragmas():
+    return tuple(getattr(settings, "SQLITE_PRAGMAS", ()))
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas:
+        cursor.execute("PRAGMA %s = %s" % (name, value))
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, get_pragmas())
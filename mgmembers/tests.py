@@ -1,3 +1,1210 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db import transaction
 from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+import datetime
+import io
+import os
+import tempfile
+import threading
+import time
+import zipfile
+
+import mgmembers.aeonics as mgaeonics
+import mgmembers.cache as mgcache
+import mgmembers.forms as mgforms
+import mgmembers.item_import as mgitemimport
+import mgmembers.itemsearch as mgitemsearch
+import mgmembers.models as mgmodels
+import mgmembers.omen as mgomen
+import mgmembers.progress_import as mgimport
+import mgmembers.queryplans as mgqueryplans
+import mgmembers.resources as mgresources
+import mgmembers.roster as mgroster
+import mgmembers.warder as mgwarder
+
+_cache_settings = []
+
+
+def setUpModule():
+    # Keep the file cache of the tests out of CACHE_DIR
+    cache_dir = tempfile.TemporaryDirectory()
+    caches = dict(settings.CACHES)
+    caches["persistent"] = dict(caches["persistent"], LOCATION=cache_dir.name)
+    cache_settings = override_settings(CACHES=caches)
+    cache_settings.enable()
+    _cache_settings.extend([cache_dir, cache_settings])
+
+
+def tearDownModule():
+    cache_dir, cache_settings = _cache_settings
+    cache_settings.disable()
+    cache_dir.cleanup()
+
+
+class CacheTest(TestCase):
+
+    def setUp(self):
+        mgcache.stats.reset()
+
+    def test_only_one_thread_computes_a_missing_value(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                mgcache.get_or_compute("stampede", 1, compute=compute)
+            ))
+            for x in range(5)
+        ]
+        for x in threads:
+            x.start()
+        for x in threads:
+            x.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(
+            mgcache.stats.snapshot()["stampede"],
+            {"hits": 4, "misses": 1, "waits": 0}
+        )
+
+    def test_waits_for_the_value_of_the_lock_holder(self):
+        key = mgcache.make_key("locked", 1)
+        # Another process is computing the value
+        mgcache.get_cache().add(key + ":lock", True, mgcache.LOCK_TIMEOUT)
+        timer = threading.Timer(
+            0.2, lambda: mgcache.get_cache().set(key, "theirs")
+        )
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        value = mgcache.get_or_compute(
+            "locked", 1, compute=lambda: self.fail("Computed twice")
+        )
+        self.assertEqual(value, "theirs")
+        counters = mgcache.stats.snapshot()["locked"]
+        self.assertEqual((counters["hits"], counters["misses"]), (1, 0))
+        self.assertGreater(counters["waits"], 0)
+
+    def test_bumping_a_namespace_invalidates_its_keys(self):
+        values = iter(["first", "second"])
+        for x in range(2):
+            self.assertEqual(mgcache.get_or_compute(
+                "bumped", 1, compute=lambda: next(values)
+            ), "first")
+        other = mgcache.get_or_compute("other", 1, compute=lambda: "other")
+
+        version = mgcache.namespace_version("bumped")
+        mgcache.bump_namespace("bumped")
+        self.assertNotEqual(mgcache.namespace_version("bumped"), version)
+        self.assertEqual(mgcache.get_or_compute(
+            "bumped", 1, compute=lambda: next(values)
+        ), "second")
+        self.assertEqual(mgcache.get_or_compute(
+            "other", 1, compute=lambda: "changed"
+        ), other)
+
+        self.assertEqual(mgcache.stats.snapshot(), {
+            "bumped": {"hits": 1, "misses": 2, "waits": 0},
+            "other": {"hits": 1, "misses": 1, "waits": 0},
+        })
+        mgcache.stats.reset()
+        self.assertEqual(mgcache.stats.snapshot(), {})
+
+
+class OverviewQueryPlanTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        mgmodels.Job.create_defaults()
+        mgmodels.LootItem.create_defaults()
+        jobs = list(mgmodels.Job.objects.all())
+
+        characters = []
+        for i in range(10):
+            owner = User.objects.create(username="user%d" % i)
+            character = mgmodels.Character.objects.create(
+                owner=owner, name="Char%d" % i
+            )
+            characters.append(character)
+            for j in range(3):
+                mgmodels.CharacterJob.objects.create(
+                    character=character,
+                    job=jobs[(i + j) % len(jobs)],
+                    level=99,
+                    event_status=j + 1,
+                    gear_status=j + 1,
+                )
+            mgmodels.OmenBossWishlist.objects.create(
+                character=character,
+                first_choice=i % 5 + 1,
+                second_choice=(i + 1) % 5 + 1,
+            )
+            mgmodels.DynamisGearChoice.objects.create(
+                character=character,
+                zone=mgmodels.DynamisGearChoice.ZONE_SANDORIA,
+                rank=mgmodels.DynamisGearChoice.RANK_PRIMARY,
+                job=jobs[i],
+            )
+
+        queue = mgmodels.ItemQueue.objects.create(
+            item=mgmodels.LootItem.objects.first()
+        )
+        for position, character in enumerate(characters[:3]):
+            mgmodels.ItemQueuePosition.objects.create(
+                queue=queue, character=character, position=position + 1
+            )
+
+        cls.plans = mgqueryplans.capture_query_plans()
+
+    def plan_lines(self, url_name):
+        return [x for sql, plan in self.plans[url_name] for x in plan]
+
+    def assertUsesIndex(self, url_name, index_name):
+        lines = self.plan_lines(url_name)
+        self.assertTrue(
+            any(index_name in x for x in lines),
+            "%s does not use %s:\n%s" % (
+                url_name, index_name, "\n".join(lines)
+            )
+        )
+
+    def test_gear_overview_uses_job_gear_index(self):
+        self.assertUsesIndex('gear-choices-overview', 'mgm_cjob_job_gear_idx')
+
+    def test_party_builder_uses_job_event_index(self):
+        self.assertUsesIndex('party-builder', 'mgm_cjob_job_event_idx')
+
+    def test_omen_scales_uses_wishlist_indexes(self):
+        self.assertUsesIndex('gear-omen-scales', 'mgm_omen_first_idx')
+        self.assertUsesIndex('gear-omen-scales', 'mgm_omen_second_idx')
+
+    def test_item_queue_list_uses_queue_position_index(self):
+        self.assertUsesIndex('item-queue-list', 'mgm_queuepos_queue_pos_idx')
+
+    def test_dynamis_overview_does_not_scan_characters(self):
+        for x in self.plan_lines('gear-dynamis-overview'):
+            self.assertFalse(x.startswith('SCAN mgmembers_character'), x)
+
+    def test_character_name_lookup_uses_index(self):
+        qs = mgmodels.Character.objects.filter(name="Char1")
+        plan = mgqueryplans.explain(*qs.query.sql_with_params())
+        self.assertTrue(any("INDEX" in x for x in plan), plan)
+
+
+class CharacterProfileCacheTest(TestCase):
+
+    def setUp(self):
+        mgmodels.Job.create_defaults()
+        self.owner = User.objects.create(username="profile")
+        self.character = mgmodels.Character.objects.create(
+            owner=self.owner, name="Profile"
+        )
+        self.job = mgmodels.CharacterJob.objects.create(
+            character=self.character,
+            job=mgmodels.Job.objects.get(name="WAR"),
+            level=77,
+        )
+
+    def page(self, name="Profile"):
+        return self.client.get(
+            reverse("character", args=[name])
+        ).content.decode()
+
+    def test_fragments_are_cached_until_their_section_changes(self):
+        self.assertIn("<td>77</td>", self.page())
+
+        # Queryset updates send no signals, so the cached table stays
+        mgmodels.CharacterJob.objects.update(level=88)
+        self.assertIn("<td>77</td>", self.page())
+
+        versions = self.character.profile_section_versions()
+        self.job.refresh_from_db()
+        self.job.save()
+        changed = self.character.profile_section_versions()
+        self.assertNotEqual(changed["jobs"], versions["jobs"])
+        self.assertEqual(changed["omen"], versions["omen"])
+        self.assertIn("<td>88</td>", self.page())
+
+    def test_character_edit_bumps_every_section(self):
+        self.assertIn("Omen bosses Profile wants", self.page())
+        versions = self.character.profile_section_versions()
+
+        self.client.force_login(self.owner)
+        self.client.post(
+            reverse("character-edit", args=["Profile"]), {"name": "Renamed"}
+        )
+
+        changed = self.character.profile_section_versions()
+        for section in mgmodels.Character.profile_sections:
+            self.assertNotEqual(changed[section], versions[section])
+        self.assertIn("Omen bosses Renamed wants", self.page("Renamed"))
+
+
+class ItemQueueTest(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create(username="queued")
+        self.characters = [
+            mgmodels.Character.objects.create(owner=owner, name=x)
+            for x in ("Queued1", "Queued2", "Queued3")
+        ]
+        self.add_queues(2)
+
+    def add_queues(self, count):
+        for x in range(count):
+            item = mgmodels.LootItem.objects.create(
+                name="Queued item %d" % mgmodels.LootItem.objects.count()
+            )
+            queue = mgmodels.ItemQueue.objects.create(item=item)
+            for position, character in enumerate(self.characters):
+                mgmodels.ItemQueuePosition.objects.create(
+                    queue=queue, character=character, position=position
+                )
+
+    def test_with_positions_uses_two_queries(self):
+        for count in (2, 5):
+            with self.assertNumQueries(2):
+                queues = [
+                    (str(x.item), x.character_list())
+                    for x in mgmodels.ItemQueue.with_positions()
+                ]
+            self.assertEqual(len(queues), count)
+            self.assertEqual(queues[0][1], "Queued1, Queued2, Queued3")
+            self.add_queues(3)
+
+    def test_list_page_queries_do_not_grow_with_queues(self):
+        url = reverse("item-queue-list")
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, "Queued item 1")
+
+        self.add_queues(4)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, "Queued item 5")
+
+
+class LootItemCatalogTest(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create(username="looter")
+        self.character = mgmodels.Character.objects.create(
+            owner=owner, name="Looter"
+        )
+
+    def names(self, catalog):
+        return [
+            item["name"]
+            for category in catalog
+            for subcategory in category["subcategories"]
+            for item in subcategory["items"]
+        ]
+
+    def test_catalog_is_cached_until_loot_items_change(self):
+        item = mgmodels.LootItem.objects.create(name="Cached item")
+        with self.assertNumQueries(1):
+            mgmodels.LootItem.catalog()
+        with self.assertNumQueries(0):
+            catalog = mgmodels.LootItem.catalog()
+        self.assertEqual(self.names(catalog), ["Cached item"])
+
+        item.name = "Renamed item"
+        item.save()
+        self.assertEqual(
+            self.names(mgmodels.LootItem.catalog()), ["Renamed item"]
+        )
+        item.delete()
+        self.assertEqual(self.names(mgmodels.LootItem.catalog()), [])
+
+    def test_set_registered_drops_only_touches_changes(self):
+        for count in (2, 6):
+            items = [
+                mgmodels.LootItem.objects.create(name="Drop %d %d" % (
+                    count, x
+                ))
+                for x in range(count)
+            ]
+            self.character.set_registered_drops(items[:count // 2])
+            # The same number of queries however many drops change, with
+            # the loot ledger updates and their savepoints
+            with self.assertNumQueries(17):
+                self.character.set_registered_drops(items[1:])
+            self.assertEqual(
+                set(self.character.registered_drops.all()), set(items[1:])
+            )
+            # Nothing to change, so only the current drops are read
+            with self.assertNumQueries(3):
+                self.character.set_registered_drops(items[1:])
+            self.character.set_registered_drops([])
+
+
+class DynamisReadinessMatrixTest(TestCase):
+
+    def setUp(self):
+        mgmodels.Job.create_defaults()
+        self.registrations = {}
+        for name, backup, jobs in (
+            ("Backup", True, ["PLD"]),
+            ("Main", False, ["RUN", "WHM"]),
+        ):
+            self.add_registration(name, backup, jobs)
+
+    def add_registration(self, name, backup, jobs):
+        owner = User.objects.create(username=name.lower())
+        registration = mgmodels.DynamisWave3Registration.objects.create(
+            character=mgmodels.Character.objects.create(
+                owner=owner, name=name
+            ),
+            backup_character=backup,
+        )
+        registration.wave3jobs.set(
+            mgmodels.Job.objects.filter(name__in=jobs)
+        )
+        self.registrations[name] = registration
+        return registration
+
+    def candidates(self, zone="bastok", role="main_tank"):
+        matrix = mgmodels.DynamisWave3Registration.readiness_matrix()
+        return [x["character"] for x in matrix["zone_roles"][zone][role]]
+
+    def test_matrix_uses_two_queries(self):
+        Registration = mgmodels.DynamisWave3Registration
+        with self.assertNumQueries(2):
+            matrix = Registration.build_readiness_matrix()
+        self.assertEqual(
+            [x["name"] for x in matrix["characters"]], ["Backup", "Main"]
+        )
+
+        self.add_registration("Another", False, ["PLD", "WAR"])
+        with self.assertNumQueries(2):
+            Registration.build_readiness_matrix()
+
+    def test_matrix_is_cached_until_registrations_change(self):
+        self.assertEqual(self.candidates(), ["Main", "Backup"])
+        with self.assertNumQueries(0):
+            self.candidates()
+
+        backup = self.registrations["Backup"]
+        backup.backup_character = False
+        backup.bastok_boss_clear = True
+        backup.save()
+        self.assertEqual(self.candidates(), ["Backup", "Main"])
+
+        self.registrations["Main"].wave3jobs.clear()
+        self.assertEqual(self.candidates(), ["Backup"])
+        self.assertEqual(self.candidates(role="healer"), [])
+
+        owner = backup.character.owner
+        owner.is_active = False
+        owner.save()
+        self.assertEqual(self.candidates(), [])
+
+        self.registrations["Main"].delete()
+        matrix = mgmodels.DynamisWave3Registration.readiness_matrix()
+        self.assertEqual(matrix["characters"], [])
+
+
+class DynamisLegacyChoicesTest(TestCase):
+
+    def setUp(self):
+        mgmodels.Job.create_defaults()
+        self.jobs = dict(mgmodels.Job.objects.values_list("name", "pk"))
+        owner = User.objects.create(username="legacy")
+        self.choices = mgmodels.DynamisGearChoices.objects.create(
+            character=mgmodels.Character.objects.create(
+                owner=owner, name="Legacy"
+            ),
+            sandoria_primary_id=self.jobs["WAR"],
+            jeuno_secondary_id=self.jobs["BLM"],
+        )
+        self.Choice = mgmodels.DynamisGearChoice
+
+    def rows(self):
+        return dict(
+            ((x.zone, x.rank), x.job.name)
+            for x in self.choices.character.dynamis_gear_choices.all()
+        )
+
+    def test_legacy_choices_show_until_converted(self):
+        self.assertEqual(self.choices.sandoria_jobs, ["WAR"])
+        self.assertEqual(
+            self.choices.zone_choice_map()[
+                (self.Choice.ZONE_JEUNO, self.Choice.RANK_SECONDARY)
+            ].name,
+            "BLM"
+        )
+
+    def test_first_save_converts_the_other_zones(self):
+        self.choices.set_zone_choices({
+            (self.Choice.ZONE_BASTOK, self.Choice.RANK_PRIMARY):
+                mgmodels.Job.objects.get(name="RDM"),
+        })
+        self.assertEqual(self.rows(), {
+            (self.Choice.ZONE_SANDORIA, self.Choice.RANK_PRIMARY): "WAR",
+            (self.Choice.ZONE_BASTOK, self.Choice.RANK_PRIMARY): "RDM",
+            (self.Choice.ZONE_JEUNO, self.Choice.RANK_SECONDARY): "BLM",
+        })
+        self.choices.refresh_from_db()
+        self.assertEqual(self.choices.legacy_zone_choices(), {})
+
+        # Cleared choices do not fall back to the legacy columns
+        self.choices.set_zone_choices({key: None for key in self.rows()})
+        self.assertEqual(self.choices.zone_choice_map(), {})
+
+    def test_normalize_copies_and_clears_legacy_columns(self):
+        out = io.StringIO()
+        call_command("normalize_dynamis_choices", stdout=out)
+        self.assertIn("2 choices for 1 characters", out.getvalue())
+        self.assertEqual(self.rows(), {
+            (self.Choice.ZONE_SANDORIA, self.Choice.RANK_PRIMARY): "WAR",
+            (self.Choice.ZONE_JEUNO, self.Choice.RANK_SECONDARY): "BLM",
+        })
+        self.choices.refresh_from_db()
+        self.assertEqual(self.choices.legacy_zone_choices(), {})
+
+    def test_overview_lists_unconverted_choices(self):
+        def names(context, key, job):
+            return [
+                x.name
+                for row in context[key] if row["name"] == job
+                for x in row["characters"]
+            ]
+
+        context = self.client.get(reverse("gear-dynamis-overview")).context
+        self.assertEqual(names(context, "sdo_jobs", "WAR"), ["Legacy"])
+        self.assertEqual(names(context, "jeuno_jobs", "BLM"), ["Legacy"])
+        self.assertEqual(names(context, "bastok_jobs", "WAR"), [])
+
+        call_command("normalize_dynamis_choices", stdout=io.StringIO())
+        context = self.client.get(reverse("gear-dynamis-overview")).context
+        self.assertEqual(names(context, "sdo_jobs", "WAR"), ["Legacy"])
+        self.assertEqual(names(context, "jeuno_jobs", "BLM"), ["Legacy"])
+
+
+class DynamisLegacyPlanTest(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create(username="alice")
+        self.alice = mgmodels.Character.objects.create(
+            owner=owner, name="Alice"
+        )
+        mgmodels.DynamisWave3Registration.objects.create(
+            character=self.alice
+        )
+        self.plan = mgmodels.DynamisWave3Plan.objects.create(
+            date=datetime.date(2030, 1, 1),
+            party1_slot1=self.alice,
+            party1_slot2_other="Bob",
+        )
+
+    def reload(self):
+        return mgmodels.DynamisWave3Plan.objects.get(pk=self.plan.pk)
+
+    def assertLegacySlotsKept(self, plan):
+        self.assertEqual(plan.character_for_slot(1, 1), self.alice)
+        self.assertEqual(plan.character_for_slot_display(1, 2), "Bob")
+        self.assertEqual(plan.role_for_slot(1, 2), "off_tank")
+
+    def test_legacy_slots_show_until_converted(self):
+        self.assertLegacySlotsKept(self.reload())
+
+    def test_editing_an_unconverted_plan_keeps_its_slots(self):
+        form = mgforms.DynamisPlanUpdateForm(instance=self.reload())
+        data = {}
+        for name in form.fields:
+            value = form[name].value()
+            data[name] = "" if value is None else str(value)
+        data["party2_slot1_other"] = "Carol"
+
+        form = mgforms.DynamisPlanUpdateForm(
+            instance=self.reload(), data=data
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+
+        out = io.StringIO()
+        call_command("normalize_dynamis_plans", stdout=out)
+        self.assertIn("0 slots for 0 plans", out.getvalue())
+
+        plan = self.reload()
+        self.assertLegacySlotsKept(plan)
+        self.assertEqual(plan.character_for_slot_display(2, 1), "Carol")
+        self.assertFalse(plan.has_legacy_slots())
+
+    def test_normalize_copies_and_resets_legacy_columns(self):
+        out = io.StringIO()
+        call_command("normalize_dynamis_plans", stdout=out)
+        self.assertIn("18 slots for 1 plans", out.getvalue())
+
+        plan = self.reload()
+        self.assertEqual(plan.slots.count(), 18)
+        self.assertLegacySlotsKept(plan)
+        self.assertFalse(plan.has_legacy_slots())
+
+
+class DynamisPlanSlotTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create(username="planner")
+        cls.character = mgmodels.Character.objects.create(
+            owner=owner, name="Planner"
+        )
+        cls.plan = mgmodels.DynamisWave3Plan.objects.create(
+            date=datetime.date(2030, 1, 1)
+        )
+        cls.plan.set_slots({
+            (party, slot): ("dd", cls.character if slot == 1 else None, None)
+            for party in range(1, 6)
+            for slot in range(1, 7)
+        })
+
+    def test_plan_with_all_parties_loads_in_two_queries(self):
+        with self.assertNumQueries(2):
+            plan = mgmodels.DynamisWave3Plan.with_slots().get(pk=self.plan.pk)
+            parties = plan.parties()
+            names = [
+                x.character_display for party in parties for x in party["slots"]
+            ]
+        self.assertEqual(len(parties), 5)
+        self.assertEqual(names.count("Planner"), 5)
+
+    def test_set_slots_only_writes_changes(self):
+        plan = mgmodels.DynamisWave3Plan.with_slots().get(pk=self.plan.pk)
+        slots = {
+            (x.party, x.slot): (x.role, x.character, x.other)
+            for x in plan.slot_rows()
+        }
+        slots[(1, 2)] = ("healer", None, "Outsider")
+        del slots[(5, 6)]
+
+        with CaptureQueriesContext(connection) as queries:
+            plan.set_slots(slots)
+        writes = [
+            x["sql"].split()[0] for x in queries.captured_queries
+            if x["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+        ]
+        self.assertEqual(sorted(writes), ["DELETE", "UPDATE"])
+
+        self.assertEqual(plan.get_slot(1, 2).character_display, "Outsider")
+        self.assertEqual(plan.get_slot(5, 6).pk, None)
+
+
+class AeonicsRouteTest(TestCase):
+
+    def test_route_finishes_cheapest_characters_first(self):
+        # Three NMs; A needs NM 0, B needs NMs 0 and 1, C needs all three
+        rows = [0b001, 0b011, 0b111]
+        route = mgaeonics.plan_route(rows, [3, 2, 1])
+        self.assertEqual(route, [(0, [0]), (1, [1]), (2, [2])])
+
+    def test_route_skips_nms_nobody_needs(self):
+        route = mgaeonics.plan_route([0b100, 0, 0b100], [0, 0, 2])
+        self.assertEqual(route, [(2, [0, 2])])
+
+
+class AeonicsCatalogTest(TestCase):
+
+    def setUp(self):
+        mgmodels.AeonicNM.create_defaults()
+        mgmodels.AeonicGear.create_defaults()
+
+    def test_catalogs_are_cached_until_nms_or_gear_change(self):
+        with self.assertNumQueries(1):
+            catalog = mgmodels.AeonicNM.catalog()
+        with self.assertNumQueries(1):
+            gear = mgmodels.AeonicGear.catalog()
+        with self.assertNumQueries(0):
+            self.assertEqual(mgmodels.AeonicNM.catalog(), catalog)
+            self.assertEqual(mgmodels.AeonicGear.catalog(), gear)
+
+        nm = mgmodels.AeonicNM.objects.order_by("pk").first()
+        nm.name = "Renamed NM"
+        nm.save()
+        first = mgmodels.AeonicNM.catalog()["areas"][0]["types"][0]["nms"][0]
+        self.assertEqual(first, {"id": nm.pk, "name": "Renamed NM"})
+
+        nm.delete()
+        self.assertNotIn(
+            nm.pk, dict(mgmodels.AeonicNM.catalog()["choices"])
+        )
+
+        godhands = mgmodels.AeonicGear.objects.get(name="Godhands")
+        godhands.delete()
+        self.assertEqual(
+            mgmodels.AeonicGear.catalog(),
+            tuple(x for x in gear if x[1] != "Godhands")
+        )
+
+    def test_set_killed_nms_only_touches_changes(self):
+        owner = User.objects.create(username="hunter")
+        progress = mgmodels.AeonicsProgress.objects.create(
+            character=mgmodels.Character.objects.create(
+                owner=owner, name="Hunter"
+            )
+        )
+        nm_ids = list(
+            mgmodels.AeonicNM.objects.order_by("pk").values_list(
+                "pk", flat=True
+            )
+        )
+
+        for count in (2, 8):
+            progress.set_killed_nms(nm_ids[:count // 2])
+            # A read, a delete and an insert however many NMs change
+            with self.assertNumQueries(5):
+                progress.set_killed_nms(nm_ids[1:count])
+            self.assertEqual(progress.killed_nm_ids(), set(nm_ids[1:count]))
+            with self.assertNumQueries(3):
+                progress.set_killed_nms(nm_ids[1:count])
+            progress.set_killed_nms([])
+
+
+class OmenPlanTest(TestCase):
+
+    def test_missing_clears_outweigh_second_choices(self):
+        W = mgmodels.OmenBossWishlist
+        attendees = [
+            {"name": "A", "choices": {W.FU: 1}, "cleared": {W.FU},
+             "received": set()},
+            {"name": "B", "choices": {W.KIN: 2}, "cleared": set(),
+             "received": set()},
+            {"name": "C", "choices": {W.KIN: 1, W.FU: 2}, "cleared": set(),
+             "received": set()},
+        ]
+        plan = mgomen.plan_run(attendees, {W.FU: ["B"]}, 1)
+
+        kin, = plan["targets"]
+        self.assertEqual(kin["boss"], W.KIN)
+        self.assertEqual(kin["score"], 6)
+        self.assertEqual(kin["distribution"], ["C", "B"])
+
+        fu = [x for x in plan["other_bosses"] if x["boss"] == W.FU][0]
+        # Queued characters come first, even without a wishlist choice
+        self.assertEqual(fu["distribution"], ["B", "A", "C"])
+
+
+class WarderCoverTest(TestCase):
+
+    def test_min_cover_finds_smallest_group(self):
+        holders = [("A", 0b0011), ("B", 0b0100), ("C", 0b1000),
+                   ("D", 0b1100)]
+        self.assertEqual(mgwarder.min_cover(holders, 0b1111), ["A", "D"])
+        self.assertIsNone(mgwarder.min_cover(holders, 0b10000))
+
+
+class LootLedgerTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create(username="ledger")
+        cls.regular = mgmodels.Character.objects.create(
+            owner=owner, name="Regular"
+        )
+        cls.lucky = mgmodels.Character.objects.create(
+            owner=owner, name="Lucky"
+        )
+
+    def test_alliances_and_drops_update_counters(self):
+        for i in range(3):
+            alliance = mgmodels.RegisteredAlliance.objects.create(zone="Test")
+            alliance.characters.add(self.regular, self.lucky)
+        alliance.delete()
+        self.lucky.set_registered_drops(
+            [mgmodels.LootItem.objects.create(name="Test item")]
+        )
+
+        summary = mgmodels.LootLedgerDay.summary(windows=(30,))
+        self.assertEqual(summary[self.regular.pk][30]["events"], 2)
+        self.assertEqual(summary[self.lucky.pk][30]["drops"], 1)
+
+        order = mgmodels.LootLedgerDay.fairness_order(
+            [self.lucky, self.regular], 30
+        )
+        self.assertEqual([x.name for x, counters in order],
+                         ["Regular", "Lucky"])
+
+    def test_removed_drop_is_taken_from_the_day_it_was_registered(self):
+        item = mgmodels.LootItem.objects.create(name="Old item")
+        registered = timezone.now() - datetime.timedelta(days=10)
+        self.lucky.registered_drops.add(item)
+        mgmodels.RegisteredDrop.objects.update(registered=registered)
+        mgmodels.LootLedgerDay.rebuild()
+
+        self.lucky.set_registered_drops([])
+        days = mgmodels.LootLedgerDay.objects.filter(character=self.lucky)
+        self.assertEqual(
+            list(days.values_list("day", "drops")),
+            [(timezone.localdate(registered), 0)]
+        )
+        self.assertFalse(mgmodels.RegisteredDrop.objects.exists())
+
+    def test_rebuild_leaves_out_undated_drops(self):
+        old, new = [
+            mgmodels.LootItem.objects.create(name=x) for x in ("Old", "New")
+        ]
+        self.lucky.registered_drops.add(old, new)
+        # Drops registered before their dates were recorded
+        mgmodels.RegisteredDrop.objects.filter(item=old).delete()
+
+        mgmodels.LootLedgerDay.rebuild()
+        summary = mgmodels.LootLedgerDay.summary(windows=(30,))
+        self.assertEqual(summary[self.lucky.pk][30]["drops"], 1)
+
+        # Removing the undated drop does not take anything off the ledger
+        self.lucky.registered_drops.remove(old)
+        summary = mgmodels.LootLedgerDay.summary(windows=(30,))
+        self.assertEqual(summary[self.lucky.pk][30]["drops"], 1)
+
+
+class AttendanceRollupTest(TestCase):
+
+    def test_window_combines_daily_and_weekly_rows(self):
+        owner = User.objects.create(username="attendee")
+        character = mgmodels.Character.objects.create(
+            owner=owner, name="Attendee"
+        )
+        Rollup = mgmodels.AttendanceRollup
+        # A 12 day window back from a Wednesday starts on a Saturday, so
+        # it reads daily rows for the weekend and weekly rows after it
+        today = datetime.date(2030, 1, 16)
+        for days_ago in (0, 3, 7, 9, 10, 12):
+            Rollup.record(
+                [character.pk], "Dynamis",
+                today - datetime.timedelta(days=days_ago), 1
+            )
+        Rollup.record([character.pk], "Omen", today, 2)
+
+        with self.assertNumQueries(1):
+            result = Rollup.attendance(12, today=today)
+        self.assertEqual(result["first_day"], "2030-01-05")
+        self.assertEqual(
+            result["characters"]["Attendee"],
+            {"total": 7, "zones": {"Dynamis": 5, "Omen": 2}}
+        )
+
+        result = Rollup.attendance(12, zone="Omen", today=today)
+        self.assertEqual(result["characters"]["Attendee"]["total"], 2)
+
+
+class AllianceDeduplicationTest(TestCase):
+
+    def test_repeated_uploads_are_stored_once(self):
+        owner = User.objects.create(username="member")
+        ids = [
+            mgmodels.Character.objects.create(owner=owner, name=x).pk
+            for x in ("Member1", "Member2")
+        ]
+        Alliance = mgmodels.RegisteredAlliance
+        start = Alliance.bucket_start(
+            datetime.datetime(2030, 1, 1, 20, tzinfo=datetime.timezone.utc)
+        )
+
+        first, created = Alliance.register("Omen", ids, "Member1", start)
+        self.assertTrue(created)
+        # Same alliance uploaded by the other member in the next bucket
+        second, created = Alliance.register(
+            "Omen", reversed(ids), "Member2",
+            start + Alliance.DEDUPLICATION_BUCKET
+        )
+        self.assertFalse(created)
+        self.assertEqual(second.pk, first.pk)
+
+        other, created = Alliance.register("Omen", ids[:1], "Member1", start)
+        self.assertTrue(created)
+        self.assertEqual(Alliance.objects.count(), 2)
+
+
+class ProgressImportTest(TestCase):
+
+    SHEET = (
+        ',,Alpha,Beta\n'
+        'Jobs,WAR,Primary (Mastered),Levelled\n'
+        ',WHM,Unlocked,Secondary\n'
+        ',,,\n'
+        'Omen clear KIs obtained,Omen clears,,\n'
+        ',Fu,Yes,No\n'
+        ',,,\n'
+        '"Omen scales wanted\nOnly the first two",Omen scales,,\n'
+        ',"Fu (BST, DRG, SMN, PUP)",Yes,No\n'
+        ',"Kin (WAR, MNK, PLD, DRK, SAM)",Yes,Yes\n'
+        ',,,\n'
+    )
+
+    def test_import_is_bulk_and_repeatable(self):
+        mgmodels.Job.create_defaults()
+        sheet = mgimport.parse(io.StringIO(self.SHEET))
+        self.assertEqual(sheet.get("omen_wanted", "Alpha"), ["fu", "kin"])
+
+        importer = mgimport.ProgressImport(sheet)
+        importer.run(dry_run=True)
+        self.assertEqual(mgmodels.Character.objects.count(), 0)
+
+        importer = mgimport.ProgressImport(sheet)
+        # The same number of queries however many characters there are
+        with self.assertNumQueries(18):
+            importer.run()
+        self.assertEqual(importer.counts["jobs"], 3)
+        alpha = mgmodels.Character.objects.get(name="Alpha")
+        self.assertTrue(alpha.characterjobs.get(job__name="WAR").mastered)
+        self.assertEqual(
+            alpha.omenbosswishlist.second_choice,
+            mgmodels.OmenBossWishlist.KIN
+        )
+
+        self.assertEqual(mgimport.ProgressImport(sheet).run(), [])
+
+
+class RosterSnapshotTest(TestCase):
+
+    def test_snapshot_round_trips(self):
+        mgmodels.Job.create_defaults()
+        owner = User.objects.create(username="owner")
+        character = mgmodels.Character.objects.create(
+            owner=owner, name="Snapshot"
+        )
+        mgmodels.CharacterJob.objects.create(
+            character=character, job=mgmodels.Job.objects.get(name="WAR"),
+            level=99, mastered=True
+        )
+        mgmodels.OmenBossesClears.objects.create(character=character, fu=True)
+        character.set_registered_drops(
+            [mgmodels.LootItem.objects.create(name="Snapshot item")]
+        )
+
+        first = io.BytesIO()
+        mgroster.export_roster(first)
+
+        character.delete()
+        mgroster.RosterImport(io.BytesIO(first.getvalue())).run()
+
+        character = mgmodels.Character.objects.get(name="Snapshot")
+        self.assertTrue(character.omenbossesclears.fu)
+        summary = mgmodels.LootLedgerDay.summary(windows=(30,))
+        self.assertEqual(summary[character.pk][30]["drops"], 1)
+        second = io.BytesIO()
+        mgroster.export_roster(second)
+        for x in mgroster.TABLES:
+            self.assertEqual(
+                zipfile.ZipFile(first).read(x.filename),
+                zipfile.ZipFile(second).read(x.filename),
+            )
+
+    def test_references_are_imported_by_name(self):
+        owner = User.objects.create(username="owner")
+        mgmodels.Character.objects.create(owner=owner, name="Filler")
+        character = mgmodels.Character.objects.create(
+            owner=owner, name="Snapshot"
+        )
+        gear = mgmodels.AeonicGear.objects.create(name="Snapshot aeonic")
+        mgmodels.AeonicsProgress.objects.create(
+            character=character
+        ).finished_aeonics.set([gear])
+        mgmodels.LootItem.objects.create(name="Unqueued item")
+        item = mgmodels.LootItem.objects.create(name="Queued item")
+        mgmodels.ItemQueuePosition.objects.create(
+            character=character,
+            queue=mgmodels.ItemQueue.objects.create(item=item),
+            position=1,
+        )
+
+        snapshot = io.BytesIO()
+        mgroster.export_roster(snapshot)
+        character.delete()
+        mgmodels.ItemQueue.objects.all().delete()
+        mgroster.RosterImport(io.BytesIO(snapshot.getvalue())).run()
+
+        character = mgmodels.Character.objects.get(name="Snapshot")
+        self.assertEqual(
+            list(character.aeonicsprogress.finished_aeonics.all()), [gear]
+        )
+        position = mgmodels.ItemQueuePosition.objects.get()
+        self.assertEqual(position.character, character)
+        self.assertEqual(position.queue.item, item)
+
+    def test_legacy_dynamis_choices_are_exported_as_rows(self):
+        mgmodels.Job.create_defaults()
+        owner = User.objects.create(username="owner")
+        choices = mgmodels.DynamisGearChoices.objects.create(
+            character=mgmodels.Character.objects.create(
+                owner=owner, name="Legacy"
+            ),
+            sandoria_primary=mgmodels.Job.objects.get(name="BLM"),
+        )
+
+        snapshot = io.BytesIO()
+        mgroster.export_roster(snapshot)
+        self.assertIn(
+            ("Legacy,%s,%s,BLM" % (
+                mgmodels.DynamisGearChoice.ZONE_SANDORIA,
+                mgmodels.DynamisGearChoice.RANK_PRIMARY,
+            )).encode(),
+            zipfile.ZipFile(snapshot).read("dynamis_gear_choices.csv")
+        )
+
+        mgroster.RosterImport(io.BytesIO(snapshot.getvalue())).run()
+        choices.refresh_from_db()
+        self.assertEqual(choices.legacy_zone_choices(), {})
+        self.assertEqual(choices.sandoria_jobs, ["BLM"])
+
+
+class ItemSearchTest(TestCase):
+
+    def setUp(self):
+        mgmodels.Job.create_defaults()
+        mgmodels.ItemSlot.create_defaults()
+        for name, item_level, jobs, slots in (
+            ("Ethereal Earring", None, ["WAR", "BLM"], [11, 12]),
+            ("Malignance Earring", 119, ["BLM", "RDM"], [11, 12]),
+            ("Malignance Tabard", 119, ["BLM", "RDM"], [5]),
+            ("Moonshade Earring", 119, ["WAR"], [11, 12]),
+        ):
+            item = mgmodels.Item.objects.create(
+                name=name, name_ja=name, item_level=item_level
+            )
+            item.jobs.set(mgmodels.Job.objects.filter(name__in=jobs))
+            item.slots.set(slots)
+        self.assertEqual(mgitemsearch.rebuild(), 4)
+
+    def names(self, **kwargs):
+        return [x.name for x in mgitemsearch.search(**kwargs)]
+
+    def test_search_by_name(self):
+        self.assertEqual(
+            self.names(text="ligna"),
+            ["Malignance Earring", "Malignance Tabard"]
+        )
+        self.assertEqual(self.names(text="ea"), [
+            "Ethereal Earring", "Malignance Earring", "Moonshade Earring"
+        ])
+
+    def test_filters_use_one_query(self):
+        # The query and the savepoint around it
+        with self.assertNumQueries(3):
+            names = self.names(
+                text="earring", job="BLM", slot="ear", min_item_level=119
+            )
+        self.assertEqual(names, ["Malignance Earring"])
+
+    def drop_fts_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE %s" % mgitemsearch.FTS_TABLE)
+
+    def test_search_survives_rolled_back_rebuild(self):
+        if not mgitemsearch.fts_supported():
+            self.skipTest("No FTS5 trigram tokenizer")
+        self.drop_fts_table()
+        with transaction.atomic():
+            mgitemsearch.rebuild()
+            transaction.set_rollback(True)
+
+        self.assertEqual(
+            self.names(text="ligna"),
+            ["Malignance Earring", "Malignance Tabard"]
+        )
+        self.assertFalse(mgitemsearch.fts_exists())
+
+    def test_fallback_inside_a_transaction(self):
+        if not mgitemsearch.fts_supported():
+            self.skipTest("No FTS5 trigram tokenizer")
+        self.assertTrue(mgitemsearch.fts_exists())
+        self.drop_fts_table()
+        with transaction.atomic():
+            self.assertEqual(self.names(text="moon"), ["Moonshade Earring"])
+            self.assertEqual(mgmodels.ItemSearchEntry.objects.count(), 4)
+        self.assertFalse(mgitemsearch.fts_exists())
+
+    def test_rebuild_without_trigram_support(self):
+        database = connection.settings_dict["NAME"]
+        supported = mgitemsearch._fts_support.get(database)
+        self.addCleanup(
+            mgitemsearch._fts_support.__setitem__, database, supported
+        )
+        if supported:
+            self.drop_fts_table()
+        mgitemsearch._fts_support[database] = False
+
+        self.assertEqual(mgitemsearch.rebuild(), 4)
+        self.assertFalse(mgitemsearch.fts_exists(cached=False))
+        self.assertEqual(self.names(text="moon"), ["Moonshade Earring"])
+
+
+RES_FIXTURE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(mgmodels.__file__)), "data", "res"
+)
+
+
+class ResourceFixtureMixin(object):
+    """Reads the resource files from the small fixture in data/res."""
+
+    def setUp(self):
+        super().setUp()
+        for model in (mgmodels.Job, mgmodels.Race, mgmodels.ItemFlag,
+                      mgmodels.Target, mgmodels.ItemSlot):
+            model.create_defaults()
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        self.index_dir = index_dir.name
+        settings = override_settings(
+            FFXI_RES_FILES_DIR=RES_FIXTURE_DIR,
+            FFXI_RES_INDEX_DIR=self.index_dir,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class ItemBitmaskTest(ResourceFixtureMixin, TestCase):
+
+    def import_items(self):
+        with CaptureQueriesContext(connection) as queries:
+            mgmodels.Item.create_defaults()
+        return [x["sql"] for x in queries.captured_queries]
+
+    def test_import_stores_masks(self):
+        self.import_items()
+
+        earring = mgmodels.Item.objects.get(pk=100)
+        self.assertEqual(earring.jobs_mask, 0x12)
+        self.assertEqual(
+            set(earring.jobs.values_list("name", flat=True)), {"WAR", "BLM"}
+        )
+        self.assertEqual(
+            list(
+                mgmodels.Item.objects.for_jobs("BLM").for_slots(11)
+            ), [earring, mgmodels.Item.objects.get(pk=103)]
+        )
+        self.assertEqual(
+            list(mgmodels.Item.objects.for_targets(0x01)),
+            [mgmodels.Item.objects.get(pk=101)]
+        )
+
+        # Nothing changed, so no M2M rows are written again
+        self.assertFalse([
+            x for x in self.import_items()
+            if x.startswith("INSERT") and "mgmembers_item_" in x
+        ])
+
+    def test_set_jobs_by_bitmask(self):
+        item = mgmodels.Item.objects.create(name="Test", name_ja="Test")
+        item.set_jobs_by_bitmask(mgmodels.Job.BITS["RDM"])
+        self.assertEqual(list(item.jobs.values_list("name", flat=True)),
+                         ["RDM"])
+        self.assertEqual(
+            list(mgmodels.Item.objects.for_jobs("RDM", "WAR")), [item]
+        )
+
+
+class ResourceFileTest(ResourceFixtureMixin, TestCase):
+
+    def test_records_are_read_from_the_mapped_file(self):
+        resource = mgresources.resource_file("items.lua")
+        self.assertIs(mgresources.resource_file("items.lua"), resource)
+        self.assertEqual(resource.ids(), [100, 101, 102, 103])
+        # The first record with a name wins
+        self.assertEqual(resource.id_for_name("test earring"), 100)
+        self.assertEqual(
+            bytes(resource.record_data(101)[:20]), b'{id=101,en="Test Pot'
+        )
+        self.assertEqual(resource.record(102)["ja"], "テストタバード")
+        self.assertIsNone(resource.record(104))
+        self.assertEqual(
+            [x["id"] for x in resource.records()], [100, 101, 102, 103]
+        )
+
+        # Another reader of the same file uses the saved offset table
+        other = mgresources.ResourceFile(resource.path)
+        other.open()
+        self.assertEqual(other.offsets, resource.offsets)
+        with open(other.index_path, "w") as f:
+            f.write("out of date\n")
+        other.close()
+        self.assertEqual(other.open().offsets, resource.offsets)
+
+
+class LazyItemImportTest(ResourceFixtureMixin, TestCase):
+
+    def test_items_are_imported_on_first_reference(self):
+        self.assertFalse(mgmodels.Item.objects.exists())
+
+        items = mgmodels.Item.resolve_names(["Test Earring", "Nothing"])
+        self.assertEqual(list(items), ["Test Earring"])
+        self.assertEqual(list(mgmodels.Item.objects.all()),
+                         [items["Test Earring"]])
+        self.assertEqual(
+            list(mgmodels.Item.objects.for_jobs("BLM")),
+            [items["Test Earring"]]
+        )
+
+        with self.assertNumQueries(1):
+            self.assertEqual(mgmodels.Item.get_or_import(100).name,
+                             "Test Earring")
+        self.assertEqual(mgmodels.Item.get_or_import(101).name,
+                         "Test Potion")
+        self.assertIsNone(mgmodels.Item.get_or_import(104))
+
+
+class ItemImportTest(ResourceFixtureMixin, TestCase):
+
+    def items(self):
+        return [
+            (x.pk, x.name, x.category.name, x.slots_mask,
+             sorted(x.jobs.values_list("name", flat=True)))
+            for x in mgmodels.Item.objects.order_by("pk")
+        ]
+
+    def test_worker_processes_give_the_same_items(self):
+        counts = mgitemimport.ItemImport(batch_size=2).run()
+        self.assertEqual(counts["created"], 4)
+        items = self.items()
+        self.assertEqual(
+            items[0], (100, "Test Earring", "Armor", 0x1800, ["BLM", "WAR"])
+        )
+
+        mgmodels.Item.objects.all().delete()
+        counts = mgitemimport.ItemImport(workers=2, batch_size=2).run()
+        self.assertEqual(counts["created"], 4)
+        self.assertEqual(self.items(), items)
+
+        mgmodels.Item.objects.filter(pk=102).update(name="Renamed")
+        counts = mgitemimport.ItemImport(workers=2, batch_size=2).run()
+        self.assertEqual((counts["updated"], counts["unchanged"]), (1, 3))
+        self.assertEqual(self.items(), items)
+
+
+class SeedReferenceDataTest(TestCase):
+
+    def test_seed_is_bulk_and_repeatable(self):
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command("seed_reference_data", stdout=out)
+        # A read and an insert per table and their savepoints, whatever
+        # the number of rows
+        self.assertLess(len(queries.captured_queries), 60)
+        self.assertEqual(
+            mgmodels.LootItem.objects.count(), len(mgmodels.LootItem.defaults)
+        )
+        self.assertEqual(
+            mgmodels.Skill.objects.get(pk=3).category.name, "Combat"
+        )
+        self.assertEqual(mgmodels.ItemType.objects.get(pk=7).name, "Crystal")
+
+        mgmodels.Race.objects.filter(pk=7).update(name="Changed")
+        out = io.StringIO()
+        call_command("seed_reference_data", stdout=out)
+        self.assertEqual(mgmodels.Race.objects.get(pk=7).name, "Mithra")
+        self.assertIn("races: 0 created, 1 updated", out.getvalue())
+        self.assertIn("loot items: 0 created, 0 updated", out.getvalue())
@@ -10,6 +10,7 @@ from django.forms import modelformset_factory
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 from django.shortcuts import reverse
+from django.http import FileResponse
 from django.http import Http404
 from django.http import JsonResponse
 from django.utils import timezone
@@ -26,10 +27,17 @@ from django.views.generic import View
 
 import datetime
 import json
+import mgmembers.aeonics as mgaeonics
+import mgmembers.cache as mgcache
 import mgmembers.forms as mgforms
+import mgmembers.itemsearch as mgitemsearch
 import mgmembers.models as mgmodels
+import mgmembers.omen as mgomen
+import mgmembers.roster as mgroster
+import mgmembers.warder as mgwarder
 import pytz
 import re
+import tempfile
 
 
 class IndexView(TemplateView):
@@ -98,8 +106,14 @@ class CharacterView(DetailView):
     template_name = 'mgmembers/character.html'
     context_object_name = 'character'
 
+    def get_queryset(self):
+        return super().get_queryset().select_related("owner")
+
     def get_context_data(self, **kwargs):
         kwargs['can_edit'] = self.object.user_can_edit(self.request.user)
+        kwargs['section_versions'] = self.object.profile_section_versions()
+        kwargs['fragment_timeout'] = mgmodels.PROFILE_FRAGMENT_TIMEOUT
+        kwargs['cache_alias'] = mgcache.cache_alias()
 
         return super().get_context_data(**kwargs)
 
@@ -438,7 +452,7 @@ class GearChoicesOverview(TemplateView):
             charjobs = mgmodels.CharacterJob.objects.filter(
                 job__name=val,
                 character__owner__is_active=True
-            )
+            ).select_related('character')
             cj = mgmodels.CharacterJob
 
             jobs.append({
@@ -460,18 +474,7 @@ class GearChoicesOverview(TemplateView):
 class DynamisGearView(UpdateView):
     model = mgmodels.DynamisGearChoices
     template_name = 'mgmembers/dynamisgear.html'
-    fields = (
-        'sandoria_primary',
-        'sandoria_secondary',
-        'bastok_primary',
-        'bastok_secondary',
-        'windurst_primary',
-        'windurst_secondary',
-        'jeuno_primary',
-        'jeuno_secondary',
-        'body_primary',
-        'body_secondary',
-    )
+    form_class = mgforms.DynamisGearForm
 
     def dispatch(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -495,9 +498,8 @@ class DynamisGearView(UpdateView):
             return self.model(character=self.character)
 
     def form_valid(self, form):
-        self.object = form.save(commit=False)
-        self.object.last_change = timezone.now()
-        self.object.save()
+        form.instance.last_change = timezone.now()
+        self.object = form.save()
         return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
@@ -530,6 +532,206 @@ class OmenScalesOverview(TemplateView):
         return result
 
 
+class AttendeesMixin(object):
+    """
+    Attendees come from ?alliance=<RegisteredAlliance pk>, or a list of
+    names in ?characters, or default to all active characters.
+    """
+
+    def get_alliance(self):
+        pk = self.request.GET.get("alliance", "")
+        if pk.isdigit():
+            return mgmodels.RegisteredAlliance.objects.filter(pk=pk).first()
+
+    def get_character_names(self):
+        return [
+            x for x in re.split(r"[\s,]+", self.request.GET.get("characters", ""))
+            if x
+        ]
+
+    def get_attendees(self):
+        alliance = self.get_alliance()
+        if alliance:
+            return mgmodels.Character.objects.filter(
+                registeredalliance=alliance
+            )
+
+        names = self.get_character_names()
+        if names:
+            return mgmodels.Character.objects.filter(name__in=names)
+
+        return mgmodels.Character.objects.filter(owner__is_active=True)
+
+    def get_context_data(self, **kwargs):
+        result = super().get_context_data(**kwargs)
+
+        result["alliance"] = self.get_alliance()
+        result["alliances"] = mgmodels.RegisteredAlliance.objects.order_by(
+            "-register_time"
+        )[:20]
+        result["character_names"] = " ".join(self.get_character_names())
+
+        return result
+
+
+class OmenPlannerMixin(AttendeesMixin):
+
+    def get_number_of_bosses(self):
+        try:
+            number = int(self.request.GET.get("bosses", ""))
+        except ValueError:
+            return mgomen.DEFAULT_NUMBER_OF_BOSSES
+        return min(max(number, 1), len(mgomen.BOSSES))
+
+    def get_plan(self):
+        return mgomen.build_plan(
+            self.get_attendees(), self.get_number_of_bosses()
+        )
+
+
+class OmenPlanner(OmenPlannerMixin, TemplateView):
+    template_name = 'mgmembers/omen_planner.html'
+
+    def get_context_data(self, **kwargs):
+        result = super().get_context_data(**kwargs)
+
+        result["plan"] = self.get_plan()
+        result["number_of_bosses"] = self.get_number_of_bosses()
+        result["boss_range"] = range(1, len(mgomen.BOSSES) + 1)
+
+        return result
+
+
+class OmenPlannerJson(OmenPlannerMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(
+            self.get_plan(),
+            json_dumps_params={"indent": "  ", "sort_keys": True}
+        )
+
+
+class WarderCoverage(AttendeesMixin, TemplateView):
+    template_name = 'mgmembers/warder_coverage.html'
+
+    def get_context_data(self, **kwargs):
+        result = super().get_context_data(**kwargs)
+        result["report"] = mgwarder.build_report(self.get_attendees())
+        return result
+
+
+class WarderCoverageJson(AttendeesMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(
+            mgwarder.build_report(self.get_attendees()),
+            json_dumps_params={"indent": "  ", "sort_keys": True}
+        )
+
+
+class AttendanceMixin(object):
+
+    def get_days(self):
+        try:
+            days = int(self.request.GET.get("days", ""))
+        except ValueError:
+            return mgmodels.AttendanceRollup.DEFAULT_DAYS
+        return min(max(days, 1), 3650)
+
+    def get_zone(self):
+        return self.request.GET.get("zone") or None
+
+    def get_attendance(self):
+        return mgmodels.AttendanceRollup.attendance(
+            self.get_days(), self.get_zone()
+        )
+
+
+class Attendance(AttendanceMixin, TemplateView):
+    template_name = 'mgmembers/attendance.html'
+
+    def get_context_data(self, **kwargs):
+        result = super().get_context_data(**kwargs)
+
+        attendance = self.get_attendance()
+        result["attendance"] = attendance
+        result["known_zones"] = mgmodels.AttendanceRollup.known_zones()
+        result["rows"] = sorted(
+            (
+                {
+                    "name": name,
+                    "total": x["total"],
+                    "zones": [x["zones"].get(z, 0) for z in attendance["zones"]],
+                }
+                for name, x in attendance["characters"].items()
+            ),
+            key=lambda x: (-x["total"], x["name"])
+        )
+
+        return result
+
+
+class AttendanceJson(AttendanceMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(
+            self.get_attendance(),
+            json_dumps_params={"indent": "  ", "sort_keys": True}
+        )
+
+
+class ItemSearchMixin(object):
+
+    def get_int(self, name):
+        try:
+            return int(self.request.GET.get(name, ""))
+        except ValueError:
+            return None
+
+    def get_filters(self):
+        return {
+            "text": self.request.GET.get("q", ""),
+            "job": self.request.GET.get("job") or None,
+            "slot": self.request.GET.get("slot") or None,
+            "flag": self.get_int("flag"),
+            "min_item_level": self.get_int("min_item_level"),
+            "max_item_level": self.get_int("max_item_level"),
+        }
+
+    def get_results(self):
+        return [
+            mgitemsearch.entry_dict(x)
+            for x in mgitemsearch.search(**self.get_filters())
+        ]
+
+
+class ItemSearch(ItemSearchMixin, TemplateView):
+    template_name = 'mgmembers/item_search.html'
+
+    def get_context_data(self, **kwargs):
+        result = super().get_context_data(**kwargs)
+
+        result["filters"] = self.get_filters()
+        result["results"] = self.get_results()
+        result["limit"] = mgitemsearch.DEFAULT_LIMIT
+        result["jobs"] = mgmodels.Job.job_choices
+        result["slots"] = [
+            (key, label) for key, label, ids in mgitemsearch.SLOT_FILTERS
+        ]
+        result["flags"] = mgmodels.ItemFlag.defaults
+
+        return result
+
+
+class ItemSearchJson(ItemSearchMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(
+            {"filters": self.get_filters(), "items": self.get_results()},
+            json_dumps_params={"indent": "  ", "sort_keys": True}
+        )
+
+
 class DynamisGearOverview(TemplateView):
     template_name = 'mgmembers/gear_dynamis_overview.html'
 
@@ -537,67 +739,41 @@ class DynamisGearOverview(TemplateView):
         result = super().get_context_data(**kwargs)
 
 
-        sdo_jobs = []
-        bastok_jobs = []
-        windurst_jobs = []
-        jeuno_jobs = []
-        body_jobs = []
+        jobs = list(mgmodels.Job.objects.all())
+        dgc = mgmodels.DynamisGearChoice
 
-        for val, desc in mgmodels.Job.job_choices:
-            if not val:
-                continue
+        rows = list(dgc.objects.filter(
+            character__owner__is_active=True
+        ).select_related('character'))
+        # Characters whose legacy choices have not been converted yet
+        rows += mgmodels.DynamisGearChoices.unconverted_rows(
+            character__owner__is_active=True
+        )
 
-            sdo_jobs.append({
-                'name': val,
-                'characters': mgmodels.Character.objects.filter(
-                    Q(dynamisgearchoices__sandoria_primary__name=val) |
-                    Q(dynamisgearchoices__sandoria_secondary__name=val)
-                ).filter(
-                    owner__is_active=True
-                )
-            })
-            bastok_jobs.append({
-                'name': val,
-                'characters': mgmodels.Character.objects.filter(
-                    Q(dynamisgearchoices__bastok_primary__name=val) |
-                    Q(dynamisgearchoices__bastok_secondary__name=val)
-                ).filter(
-                    owner__is_active=True
-                )
-            })
-            windurst_jobs.append({
-                'name': val,
-                'characters': mgmodels.Character.objects.filter(
-                    Q(dynamisgearchoices__windurst_primary__name=val) |
-                    Q(dynamisgearchoices__windurst_secondary__name=val)
-                ).filter(
-                    owner__is_active=True
-                )
-            })
-            jeuno_jobs.append({
-                'name': val,
-                'characters': mgmodels.Character.objects.filter(
-                    Q(dynamisgearchoices__jeuno_primary__name=val) |
-                    Q(dynamisgearchoices__jeuno_secondary__name=val)
-                ).filter(
-                    owner__is_active=True
-                )
-            })
-            body_jobs.append({
-                'name': val,
-                'characters': mgmodels.Character.objects.filter(
-                    Q(dynamisgearchoices__body_primary__name=val) |
-                    Q(dynamisgearchoices__body_secondary__name=val)
-                ).filter(
-                    owner__is_active=True
-                )
-            })
+        characters_by_zone_job = {}
+        for x in sorted(rows, key=lambda x: (x.character_id, x.rank)):
+            characters = characters_by_zone_job.setdefault(
+                (x.zone, x.job_id), []
+            )
+            if x.character not in characters:
+                characters.append(x.character)
+
+        def zone_jobs(zone):
+            return [
+                {
+                    'name': job.name,
+                    'characters': characters_by_zone_job.get(
+                        (zone, job.pk), []
+                    ),
+                }
+                for job in jobs
+            ]
 
-        result['sdo_jobs'] = sdo_jobs
-        result['bastok_jobs'] = bastok_jobs
-        result['windurst_jobs'] = windurst_jobs
-        result['jeuno_jobs'] = jeuno_jobs
-        result['body_jobs'] = body_jobs
+        result['sdo_jobs'] = zone_jobs(dgc.ZONE_SANDORIA)
+        result['bastok_jobs'] = zone_jobs(dgc.ZONE_BASTOK)
+        result['windurst_jobs'] = zone_jobs(dgc.ZONE_WINDURST)
+        result['jeuno_jobs'] = zone_jobs(dgc.ZONE_JEUNO)
+        result['body_jobs'] = zone_jobs(dgc.ZONE_BODY)
 
         return result
 
@@ -760,7 +936,8 @@ class LootJsonView(View):
         qs = mgmodels.Character.objects.filter(
             owner__is_active=True
         ).prefetch_related(
-            "jobs", "dynamisgearchoices", "omenbosswishlist"
+            "jobs", "dynamisgearchoices", "omenbosswishlist",
+            "dynamis_gear_choices__job"
         )
 
         for character in qs:
@@ -826,18 +1003,15 @@ class LootJsonView(View):
         if alliance_json_str:
             data = json.loads(alliance_json_str)
             if "zone" in data and "members" in data:
-                reg = mgmodels.RegisteredAlliance(
+                # Every member of the alliance uploads it, only the first
+                # upload is stored
+                mgmodels.RegisteredAlliance.register(
                     zone=data["zone"],
+                    character_ids=mgmodels.Character.objects.filter(
+                        name__in=data.get("members", [])
+                    ).values_list('pk', flat=True),
                     registered_by=data.get("uploaded_by"),
                 )
-                reg.save()
-                members = data.get("members", [])
-                for x in members:
-                    try:
-                        char = mgmodels.Character.objects.get(name=x)
-                        reg.characters.add(char)
-                    except mgmodels.Character.DoesNotExist:
-                        pass
 
         return self.get(request, *args, **kwargs)
 
@@ -851,7 +1025,7 @@ class PartyBuilder(TemplateView):
             event_chars = job.characterjobs.filter(
                 event_status=mgmodels.CharacterJob.EVENT_PRIMARY,
                 character__owner__is_active=True
-            )
+            ).select_related('character')
             if(event_chars.exists()):
                 jobs.append({
                     "name": job.name,
@@ -918,17 +1092,9 @@ class AeonicsProgressView(UpdateView):
     def get_context_data(self, **kwargs):
         result = super().get_context_data(**kwargs)
 
-        last_area = None
-        last_type = None
-        new_area_pks = {}
-        new_type_pks = {}
-        for x in result["form"]["killed_nms"].field.queryset:
-            if last_area != x.area:
-                new_area_pks[x.pk] = x.get_area_display()
-                last_area = x.area
-            if last_type != x.type:
-                new_type_pks[x.pk] = x.get_type_display()
-                last_type = x.type
+        catalog = mgmodels.AeonicNM.catalog()
+        new_area_pks = catalog["area_starts"]
+        new_type_pks = catalog["type_starts"]
 
         result["new_area_pks"] = new_area_pks
         result["new_type_pks"] = new_type_pks
@@ -948,9 +1114,21 @@ class AeonicsOverview(TemplateView):
         chars = []
         non_aeonic_chars = []
 
-        for c in mgmodels.AeonicsProgress.objects.all().order_by(
-            "character__name"
+        progresses = list(
+            mgmodels.AeonicsProgress.objects.select_related(
+                "character", "malformed_weapon_in_progress"
+            ).order_by("character__name")
+        )
+
+        killed_by_progress = {}
+        for progress_id, nm_id in (
+            mgmodels.AeonicsProgress.killed_nms.through.objects.filter(
+                aeonicsprogress__malformed_weapon_in_progress__isnull=False
+            ).values_list("aeonicsprogress_id", "aeonicnm_id")
         ):
+            killed_by_progress.setdefault(progress_id, set()).add(nm_id)
+
+        for c in progresses:
             working_on = None
             if c.malformed_weapon_in_progress:
                 working_on = c.malformed_weapon_in_progress
@@ -960,7 +1138,7 @@ class AeonicsOverview(TemplateView):
                     "name": c.character.name,
                     "beads": c.number_of_beads,
                     "working_on": working_on,
-                    "killed_nms": set([x.id for x in c.killed_nms.all()])
+                    "killed_nms": killed_by_progress.get(c.pk, set())
                 })
             else:
                 non_aeonic_chars.append({
@@ -969,39 +1147,21 @@ class AeonicsOverview(TemplateView):
                 })
 
         result['characters'] = chars
-        areas = []
-        current_area = { "id": -1 }
-        current_type = { "id": -1 }
-        for x in mgmodels.AeonicNM.objects.all().order_by(
-            "area", "type", "pk"
-        ):
-            if current_area["id"] != x.area:
-                current_area = {
-                    "id": x.area,
-                    "name": x.get_area_display(),
-                    "types": [],
-                    "characters": []
-                }
-                areas.append(current_area)
 
-            if current_type["id"] != x.type:
-                current_type = {
-                    "id": x.type,
-                    "name": x.get_type_display(),
-                    "nms": [],
-                }
-                current_area["types"].append(current_type)
-
-            current_type["nms"].append(x)
+        # Copy the cached catalog's areas, as characters are added to them
+        areas = [
+            dict(x, characters=[])
+            for x in mgmodels.AeonicNM.catalog()["areas"]
+        ]
 
         for area in areas:
-            partial_completion_characters = set()
-
-            for type in area["types"]:
-                for nm in type["nms"]:
-                    for char in chars:
-                        if not nm.id in char["killed_nms"]:
-                            partial_completion_characters.add(char["id"])
+            area_nm_ids = set(
+                nm["id"] for type in area["types"] for nm in type["nms"]
+            )
+            partial_completion_characters = set(
+                char["id"] for char in chars
+                if not area_nm_ids <= char["killed_nms"]
+            )
             next_area_chars = []
 
             # Filter current characters: Any with a partial completion for this
@@ -1022,6 +1182,34 @@ class AeonicsOverview(TemplateView):
 
         return result
 
+class AeonicsPlannerMixin(object):
+
+    def get_minutes_per_nm(self):
+        try:
+            minutes = int(self.request.GET.get("minutes_per_nm", ""))
+        except ValueError:
+            return mgaeonics.DEFAULT_MINUTES_PER_NM
+        return min(max(minutes, 1), 120)
+
+
+class AeonicsPlanner(AeonicsPlannerMixin, TemplateView):
+    template_name = 'mgmembers/aeonics_planner.html'
+
+    def get_context_data(self, **kwargs):
+        result = super().get_context_data(**kwargs)
+        result["report"] = mgaeonics.build_report(self.get_minutes_per_nm())
+        return result
+
+
+class AeonicsPlannerJson(AeonicsPlannerMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(
+            mgaeonics.build_report(self.get_minutes_per_nm()),
+            json_dumps_params={"indent": "  ", "sort_keys": True}
+        )
+
+
 class DynamisWave3UpdateView(UpdateView):
     model = mgmodels.DynamisWave3Registration
     template_name = 'mgmembers/dynawave3update.html'
@@ -1058,44 +1246,96 @@ class DynamisWave3Overview(TemplateView):
 
         result['characters'] = mgmodels.Character.objects.filter(
             owner__is_active=True
+        ).select_related(
+            "owner", "dynamiswave3registration"
+        ).prefetch_related(
+            "dynamiswave3registration__wave3jobs"
         ).order_by("name")
 
+        plans = mgmodels.DynamisWave3Plan.with_slots()
         plan_pk = self.request.GET.get("plan_id", -1)
         plan = None
         try:
-            plan = mgmodels.DynamisWave3Plan.objects.get(pk=plan_pk)
-        except mgmodels.DynamisWave3Plan.DoesNotExist:
+            plan = plans.get(pk=plan_pk)
+        except (mgmodels.DynamisWave3Plan.DoesNotExist, ValueError):
             pass
         if not plan:
-            plan = mgmodels.DynamisWave3Plan.objects.filter(
+            plan = plans.filter(
                 date__gte=timezone.now(),
-            ).first() or mgmodels.DynamisWave3Plan.objects.order_by(
+            ).first() or plans.order_by(
                 "-date"
             ).first()
 
         if plan:
             result["plan"] = plan
-            parties = []
-            for party_nr in range(1, 4):
-                party = {
-                    "nr": party_nr,
-                    "slots": []
-                }
-                for slot_nr in range(1, 7):
-                    party["slots"].append({
-                        "role": plan.role_display_for_slot(party_nr, slot_nr),
-                        "jobs": plan.jobs_for_slot(party_nr, slot_nr),
-                        "character": plan.character_for_slot(party_nr, slot_nr),
-                        "character_display": plan.character_for_slot_display(party_nr, slot_nr),
-                    })
-                parties.append(party)
-            result["plan_parties"] = parties
+            result["plan_parties"] = plan.parties()
 
         result["plans"] = mgmodels.DynamisWave3Plan.objects.order_by("-date")
 
         return result
 
 
+class DynamisWave3Readiness(TemplateView):
+    template_name = "mgmembers/dynawave3readiness.html"
+
+    def get_zone(self):
+        zones = dict(mgmodels.DynamisWave3Plan.ZONE_CHOICES)
+        zone = self.request.GET.get("zone")
+        if zone in zones:
+            return zone
+
+        plans = mgmodels.DynamisWave3Plan.objects.all()
+        plan_pk = self.request.GET.get("plan_id")
+        plan = None
+        if plan_pk and plan_pk.isdigit():
+            plan = plans.filter(pk=plan_pk).first()
+        if not plan:
+            plan = plans.filter(
+                date__gte=timezone.now()
+            ).order_by("date").first()
+        if plan:
+            return plan.zone
+
+        return mgmodels.DynamisWave3Plan.ZONE_CHOICES[0][0]
+
+    def get_context_data(self, **kwargs):
+        result = super().get_context_data(**kwargs)
+
+        matrix = mgmodels.DynamisWave3Registration.readiness_matrix()
+        zone = self.get_zone()
+
+        result["zone"] = zone
+        result["zones"] = matrix["zones"]
+        result["roles"] = [
+            {
+                "name": role_name,
+                "jobs": ", ".join(role_jobs),
+                "candidates": matrix["zone_roles"][zone][role],
+            }
+            for role, role_name, role_jobs in matrix["roles"]
+        ]
+
+        return result
+
+
+class DynamisWave3ReadinessJson(View):
+
+    def get(self, request, *args, **kwargs):
+        matrix = mgmodels.DynamisWave3Registration.readiness_matrix()
+
+        zone = request.GET.get("zone")
+        if zone:
+            if zone not in matrix["zone_roles"]:
+                raise Http404("Unknown zone")
+            matrix = dict(matrix)
+            matrix["zone_roles"] = {zone: matrix["zone_roles"][zone]}
+
+        return JsonResponse(
+            matrix,
+            json_dumps_params={"indent": "  ", "sort_keys": True}
+        )
+
+
 class DynamisPlanUpdateView(UpdateView):
     model = mgmodels.DynamisWave3Plan
     template_name = 'mgmembers/dynaplanupdate.html'
@@ -1109,7 +1349,7 @@ class DynamisPlanUpdateView(UpdateView):
     def get_object(self):
         pk = self.kwargs.get("pk")
         if(pk):
-            return self.model.objects.get(pk=pk)
+            return self.model.with_slots().get(pk=pk)
         else:
             return self.model()
 
@@ -1120,9 +1360,8 @@ class DynamisPlanUpdateView(UpdateView):
         result["jobs_by_character"] = {}
         result["backup_characters"] = {}
 
-        for c in mgmodels.Character.objects.filter(
-            dynamiswave3registration__isnull=False
-        ):
+        # The form has already loaded the registered characters
+        for c in result["form"].characters.values():
             if c.dynamiswave3registration.backup_character:
                 result["backup_characters"][c.id] = True
 
@@ -1168,35 +1407,16 @@ class RegisteredDropsView(UpdateView):
         for x in result["form"].initial["registered_drops"]:
             selected.add(x.id)
 
-        loot_items = []
-        current_category = None
-        current_2nd_category = None
-        for x in mgmodels.LootItem.objects.all():
-            if not current_category or x.category != current_category["id"]:
-                current_category = {
-                    "id": x.category,
-                    "name": x.get_category_display(),
-                    "subcategories": [],
-                }
-                loot_items.append(current_category)
-            if (not current_2nd_category or 
-                current_2nd_category["name"] != x.second_category):
-                current_2nd_category = {
-                    "name": x.second_category,
-                    "items": []
-                }
-                current_category["subcategories"].append(current_2nd_category)
-            if x.id in selected:
-                x.selected = True
-            else:
-                x.selected = False
-            current_2nd_category["items"].append(x)
-
-        result["loot_items"] = loot_items
-        result["selected"] = {}
+        result["loot_items"] = mgmodels.LootItem.catalog()
+        result["selected"] = selected
 
         return result
 
+    def form_valid(self, form):
+        self.object.set_registered_drops(
+            form.cleaned_data["registered_drops"]
+        )
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
         return reverse('character-loot-overview', args=[self.character.name])
@@ -1382,6 +1602,9 @@ class ItemQueueList(ListView):
     template_name = 'mgmembers/itemqueues/list.html'
     model = mgmodels.ItemQueue
 
+    def get_queryset(self):
+        return self.model.with_positions()
+
     def get_context_object_name(self, object_list):
         return "itemqueues"
 
@@ -1400,6 +1623,15 @@ class ItemQueueEdit(AdminOnlyMixin, UpdateView):
             owner__is_active=True
         ).order_by('name')
 
+        window = mgmodels.LootLedgerDay.windows()[0]
+        result["ledger_window"] = window
+        result["suggested_order"] = mgmodels.LootLedgerDay.fairness_order(
+            [x.character for x in self.object.positions.select_related(
+                'character'
+            )],
+            window
+        )
+
         return result
 
     def form_valid(self, form):
@@ -1444,3 +1676,58 @@ class ItemQueueEdit(AdminOnlyMixin, UpdateView):
     def get_success_url(self):
         return reverse('item-queue-list')
 
+
+class LootLedgerJson(View):
+
+    def get(self, request, *args, **kwargs):
+        characters = mgmodels.Character.objects.filter(
+            owner__is_active=True
+        ).order_by('name')
+        summary = mgmodels.LootLedgerDay.summary(
+            [x.pk for x in characters]
+        )
+        empty = {
+            days: mgmodels.LootLedgerDay.counters(0, 0)
+            for days in mgmodels.LootLedgerDay.windows()
+        }
+
+        return JsonResponse(
+            {
+                x.name: summary.get(x.pk, empty)
+                for x in characters
+            },
+            json_dumps_params={"indent": "  ", "sort_keys": True}
+        )
+
+
+class RosterExportView(AdminOnlyMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        # Written to a temporary file rather than kept in memory
+        f = tempfile.TemporaryFile()
+        mgroster.export_roster(f)
+        f.seek(0)
+
+        return FileResponse(
+            f,
+            as_attachment=True,
+            filename="roster-%s.zip" % timezone.localdate().isoformat(),
+        )
+
+    def get_success_url(self):
+        return reverse('home')
+
+
+class CacheStatsView(AdminOnlyMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(
+            {
+                "alias": mgcache.cache_alias(),
+                "namespaces": mgcache.stats.snapshot(),
+            },
+            json_dumps_params={"indent": "  ", "sort_keys": True}
+        )
+
+    def get_success_url(self):
+        return reverse('home')
@@ -0,0 +1,134 @@
+"""
+Warder of Courage pop item coverage.
+
+Each character's pop items from WarderOfCouragePops are held as an
+eleven bit mask, so combining characters is a bitwise OR and finding the
+smallest group that covers a pop chain is an exact search over at most
+2^11 states.
+"""
+import mgmembers.models as mgmodels
+
+# Bit order of the pop items
+ITEMS = (
+    "primal_nazar",
+    "primary_nazar",
+    "secondary_nazar",
+    "tertiary_nazar",
+    "quaternary_nazar",
+    "quinary_nazar",
+    "senary_nazar",
+    "septenary_nazar",
+    "octonary_nazar",
+    "nonary_nazar",
+    "denary_nazar",
+)
+
+ITEM_BITS = {x: 1 << i for i, x in enumerate(ITEMS)}
+
+# Ways to pop the Warder: the full pop item alone, or all ten warder items
+CHAINS = (
+    ("Primal Nazar", ITEM_BITS["primal_nazar"]),
+    ("Warder items", sum(ITEM_BITS[x] for x in ITEMS[1:])),
+)
+
+
+def item_label(item):
+    return mgmodels.WarderOfCouragePops._meta.get_field(item).verbose_name
+
+
+def pops_mask(pops):
+    mask = 0
+    for item, bit in ITEM_BITS.items():
+        if getattr(pops, item):
+            mask |= bit
+    return mask
+
+
+def load_holders(characters):
+    """Returns [(character name, item mask)] using one query."""
+    return [
+        (x.name, pops_mask(x.warderofcouragepops))
+        for x in characters.filter(
+            warderofcouragepops__isnull=False
+        ).select_related("warderofcouragepops").order_by("name")
+    ]
+
+
+def min_cover(holders, target):
+    """
+    Returns the names of the smallest group of holders whose items
+    together include every bit in target, or None if nobody can.
+
+    Breadth first search over the covered bits: every state is reached
+    with the fewest characters first, so the first state covering target
+    is optimal. Holders with identical masks (after masking to target)
+    are only tried once.
+    """
+    if target == 0:
+        return []
+
+    by_mask = {}
+    for name, mask in holders:
+        mask &= target
+        if mask:
+            by_mask.setdefault(mask, name)
+
+    seen = {0: []}
+    frontier = [0]
+    while frontier:
+        next_frontier = []
+        for state in frontier:
+            for mask, name in by_mask.items():
+                new_state = state | mask
+                if new_state in seen:
+                    continue
+                seen[new_state] = seen[state] + [name]
+                if new_state == target:
+                    return seen[new_state]
+                next_frontier.append(new_state)
+        frontier = next_frontier
+
+    return None
+
+
+def build_report(characters):
+    holders = load_holders(characters)
+
+    covered = 0
+    for name, mask in holders:
+        covered |= mask
+
+    items = []
+    for item in ITEMS:
+        bit = ITEM_BITS[item]
+        items.append({
+            "item": item,
+            "name": item_label(item),
+            "covered": bool(covered & bit),
+            "holders": [name for name, mask in holders if mask & bit],
+        })
+
+    chains = []
+    for name, target in CHAINS:
+        chains.append({
+            "name": name,
+            "complete": covered & target == target,
+            "missing": [
+                item_label(x) for x in ITEMS
+                if target & ITEM_BITS[x] and not covered & ITEM_BITS[x]
+            ],
+            "minimal_group": min_cover(holders, target),
+        })
+
+    possible = [x for x in chains if x["minimal_group"] is not None]
+    best = min(
+        possible, key=lambda x: len(x["minimal_group"])
+    ) if possible else None
+
+    return {
+        "characters": [name for name, mask in holders],
+        "items": items,
+        "chains": chains,
+        "best_chain": best["name"] if best else None,
+        "minimal_group": best["minimal_group"] if best else None,
+    }
@@ -93,6 +93,58 @@ DATABASES = {
     }
 }
 
+# PRAGMAs applied to every new SQLite connection, see mgmembers/sqlite.py.
+# WAL lets readers keep going while a form save or loot POST is writing,
+# and busy_timeout makes writers wait for each other instead of failing
+# with "database is locked". Compare settings with
+# "python manage.py benchmark_sqlite".
+SQLITE_PRAGMAS = (
+    ('busy_timeout', 20000),
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    # Negative values are in KiB, so this is 20 MB of page cache
+    ('cache_size', -20000),
+    ('mmap_size', 256 * 1024 * 1024),
+)
+
+
+# Caching
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+#
+# "default" lives in process memory and is emptied when the server restarts.
+# "persistent" keeps entries as files in CACHE_DIR, so they survive restarts
+# of the single process server. To keep them in SQLite instead, change it to
+# 'django.core.cache.backends.db.DatabaseCache' with LOCATION
+# 'mgmembers_cache' and run "python manage.py createcachetable".
+
+CACHE_DIR = os.path.join(BASE_DIR, 'cache')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mgmembers',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    'persistent': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+# Cache used by mgmembers.cache and the cached fragments of the character
+# page. Set to 'default' in local_settings.py to keep them in memory only.
+MGMEMBERS_CACHE_ALIAS = 'persistent'
+
+# Windows, in days, the loot ledger reports attendance and drops over. The
+# first one is used for the fairness suggestions on item queues.
+MGMEMBERS_LOOT_LEDGER_WINDOWS = (30, 90, 365)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -154,6 +206,10 @@ RECAPTCHA_PUBLIC_KEY = ''
 FFXI_RES_FILES_DIR = r'c:\program files (x86)\windower4\res'
 FFXI_ADDON_LIBS_DIR = r'c:\program files (x86)\windower4\addons\libs'
 
+# Where the record offset indexes of the resource files are kept, see
+# mgmembers/resources.py. They are rebuilt when a resource file changes.
+FFXI_RES_INDEX_DIR = os.path.join(CACHE_DIR, 'res')
+
 LOCAL_SETTINGS_FILE = os.path.join(SITE_DIR, "local_settings.py")
 if os.path.exists(LOCAL_SETTINGS_FILE):
     from mgmembers_site.local_settings import *  # noqa
@@ -101,9 +101,45 @@ urlpatterns = [
     url(r'^aeonics-overview/?$',
         mgviews.AeonicsOverview.as_view(),
         name='aeonics-overview'),
+    url(r'^omen-planner/?$',
+        mgviews.OmenPlanner.as_view(),
+        name='omen-planner'),
+    url(r'^omen-planner.json$',
+        mgviews.OmenPlannerJson.as_view(),
+        name='omen-planner-json'),
+    url(r'^warder-coverage/?$',
+        mgviews.WarderCoverage.as_view(),
+        name='warder-coverage'),
+    url(r'^warder-coverage.json$',
+        mgviews.WarderCoverageJson.as_view(),
+        name='warder-coverage-json'),
+    url(r'^item-search/?$',
+        mgviews.ItemSearch.as_view(),
+        name='item-search'),
+    url(r'^item-search.json$',
+        mgviews.ItemSearchJson.as_view(),
+        name='item-search-json'),
+    url(r'^attendance/?$',
+        mgviews.Attendance.as_view(),
+        name='attendance'),
+    url(r'^attendance.json$',
+        mgviews.AttendanceJson.as_view(),
+        name='attendance-json'),
+    url(r'^aeonics-planner/?$',
+        mgviews.AeonicsPlanner.as_view(),
+        name='aeonics-planner'),
+    url(r'^aeonics-planner.json$',
+        mgviews.AeonicsPlannerJson.as_view(),
+        name='aeonics-planner-json'),
     url(r'^dyna-wave3-overview/?$',
         mgviews.DynamisWave3Overview.as_view(),
         name='dynamis-wave3-overview'),
+    url(r'^dyna-wave3-readiness/?$',
+        mgviews.DynamisWave3Readiness.as_view(),
+        name='dynamis-wave3-readiness'),
+    url(r'^dyna-wave3-readiness.json$',
+        mgviews.DynamisWave3ReadinessJson.as_view(),
+        name='dynamis-wave3-readiness-json'),
     url(r'^dynamis/plan/(?P<pk>\d+)/?$',
         mgviews.DynamisPlanUpdateView.as_view(),
         name='dynamis-plan-edit'),
@@ -127,6 +163,16 @@ urlpatterns = [
     url(r'^item-queues/(?P<pk>\d+)/?$',
         mgviews.ItemQueueEdit.as_view(),
         name="item-queue-edit"),
+    url(r'^loot-ledger.json$',
+        mgviews.LootLedgerJson.as_view(),
+        name="loot-ledger-json"),
+
+    url(r'^roster-export.zip$',
+        mgviews.RosterExportView.as_view(),
+        name="roster-export"),
+    url(r'^cache-stats.json$',
+        mgviews.CacheStatsView.as_view(),
+        name="cache-stats"),
 
 ]
 